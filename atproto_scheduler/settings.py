@@ -80,6 +80,9 @@ if DEVELOPMENT_MODE is True:
         "default": {
             "ENGINE": "django.db.backends.sqlite3",
             "NAME": os.path.join(BASE_DIR, "db.sqlite3"),
+            # A file rather than in memory, so connections of concurrent claims
+            # wait for each other's locks as scheduler processes do
+            "TEST": {"NAME": os.path.join(BASE_DIR, "test_db.sqlite3")},
         }
     }
 elif len(sys.argv) > 0 and sys.argv[1] != "collectstatic":
@@ -117,4 +120,47 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 # For the post scheduler
 SCHEDULER_INTERVAL = timedelta(seconds=10)
+# "interval" polls every SCHEDULER_INTERVAL, "next_due" wakes up for the next pending post
+SCHEDULER_MODE = os.getenv("SCHEDULER_MODE", "interval")
+# Set to False when the scheduler runs as its own process with manage.py run_scheduler
+SCHEDULER_IN_WEB = os.getenv("SCHEDULER_IN_WEB", "True") == "True"
+SCHEDULER_SAFETY_INTERVAL = timedelta(minutes=5)
+NEXT_DUE_LEAD = timedelta(seconds=1)
+SCHEDULE_BATCH_SIZE = 1000
+# How long a scheduler process holds the posts it claimed before others may take them
+POST_CLAIM_LEASE = timedelta(minutes=5)
+# "sync" publishes accounts one after another, "async" publishes them concurrently
+PUBLISH_ENGINE = os.getenv("PUBLISH_ENGINE", "sync")
+PUBLISH_CONCURRENCY = 20
+PUBLISH_REQUEST_TIMEOUT = timedelta(seconds=30)
+# Transient publish failures are retried with exponential backoff before becoming drafts
+RETRY_BASE_DELAY = timedelta(seconds=30)
+RETRY_MAX_DELAY = timedelta(hours=1)
+RETRY_MAX_ATTEMPTS = 8
+# Bluesky's documented limits, used until the PDS reports its own in ratelimit-* headers
+RATE_LIMIT_ACCOUNT_WRITES = (5000, timedelta(hours=1))
+RATE_LIMIT_PDS_REQUESTS = (3000, timedelta(minutes=5))
+# Longest a request waits for its rate limit before the post is deferred instead
+RATE_LIMIT_MAX_WAIT = timedelta(seconds=10)
+# Gap between deferred posts of one account, which keeps them in their original order
+DEFERRED_POST_SPACING = timedelta(seconds=1)
+# Only useful on storage that survives restarts and deploys, results are kept in
+# memory until they are written to the database without it
+POST_RESULTS_JOURNAL = os.getenv("POST_RESULTS_JOURNAL") or None
+SESSION_REFRESH_MARGIN = timedelta(minutes=15)
+# PDS the Bluesky accounts are hosted on
+BLUESKY_PDS_URL = os.getenv("BLUESKY_PDS_URL", "https://bsky.social")
+MEDIA_WORKERS = 4
+MEDIA_CACHE_DIR = os.getenv("MEDIA_CACHE_DIR", os.path.join(BASE_DIR, "media_cache"))
+MEDIA_CACHE_MAX_BYTES = int(os.getenv("MEDIA_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+MEDIA_BLOB_REF_TTL = timedelta(days=7)
+MEDIA_PREFETCH_HORIZON = timedelta(minutes=30)
+MEDIA_PREFETCH_INTERVAL = timedelta(minutes=5)
+# Media is streamed from S3 and to the PDS in chunks of this size
+MEDIA_CHUNK_SIZE = 1024 * 1024
+MEDIA_UPLOAD_TIMEOUT = timedelta(minutes=5)
+# Videos are uploaded to Bluesky's video service, which processes them into a blob
+VIDEO_SERVICE_URL = os.getenv("VIDEO_SERVICE_URL", "https://video.bsky.app")
+VIDEO_PROCESSING_TIMEOUT = timedelta(minutes=5)
+VIDEO_POLL_INTERVAL = timedelta(seconds=2)
 TIME_ZONE = "America/New_York"
@@ -1,5 +1,26 @@
 from django.contrib import admin
-from posts.models import Post, Config
+from posts.models import MAX_THREAD_REPLIES, Post, Config
+
+
+class ThreadReplyInline(admin.StackedInline):
+    model = Post
+    fk_name = "thread_parent"
+    verbose_name = "thread reply"
+    verbose_name_plural = "Thread replies"
+    extra = 0
+    max_num = MAX_THREAD_REPLIES
+    classes = ["collapse"]
+    fields = [
+        "thread_position",
+        "text",
+        "link_1",
+        ("link_card_title", "link_card_description"),
+        ("image_1", "alt_1"),
+        ("image_2", "alt_2"),
+        ("image_3", "alt_3"),
+        ("image_4", "alt_4"),
+        ("video", "video_alt"),
+    ]
 
 
 class PostAdmin(admin.ModelAdmin):
@@ -9,8 +30,17 @@ class PostAdmin(admin.ModelAdmin):
         "is_draft",
         "scheduled_post_time",
         "posted_at",
+        "media_error",
+        "last_error",
+    ]
+    readonly_fields = [
+        "created_at",
+        "updated_at",
+        "media_error",
+        "attempt_count",
+        "next_attempt_at",
+        "last_error",
     ]
-    readonly_fields = ["created_at", "updated_at"]
     fieldsets = [
         (
             None,
@@ -46,9 +76,24 @@ class PostAdmin(admin.ModelAdmin):
                     ("image_2", "alt_2"),
                     ("image_3", "alt_3"),
                     ("image_4", "alt_4"),
+                    "media_error",
                 ],
             },
         ),
+        (
+            "Add video",
+            {
+                "classes": ["collapse", "extrapretty"],
+                "fields": [("video", "video_alt")],
+            },
+        ),
+        (
+            "Publishing attempts",
+            {
+                "classes": ["collapse", "extrapretty"],
+                "fields": ["attempt_count", "next_attempt_at", "last_error"],
+            },
+        ),
         (
             "Reset posted info",
             {
@@ -57,6 +102,19 @@ class PostAdmin(admin.ModelAdmin):
             },
         ),
     ]
+    inlines = [ThreadReplyInline]
+
+    def get_inlines(self, request, obj):
+        # Replies are edited from the first post of their thread
+        if obj and obj.thread_parent_id:
+            return []
+        return self.inlines
+
+    def get_readonly_fields(self, request, obj=None):
+        # Whether a reply is published is decided by the first post of its thread
+        if obj and obj.thread_parent_id:
+            return [*self.readonly_fields, "is_draft"]
+        return self.readonly_fields
 
 
 class ConfigAdmin(admin.ModelAdmin):
@@ -64,8 +122,11 @@ class ConfigAdmin(admin.ModelAdmin):
         "bluesky_username",
         "interval_hours",
         "interval_minutes",
+        "first_post_time",
+        "catch_up_policy",
         "allow_posts",
     ]
+    exclude = ["session_string"]
 
 
 admin.site.register(Post, PostAdmin)
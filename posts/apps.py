@@ -1,22 +1,43 @@
+import sys
+
 from django.apps import AppConfig
 
+from atproto_scheduler.settings import SCHEDULER_IN_WEB
+
+# Commands that must not run the scheduler in the background
+NO_SCHEDULER_COMMANDS = (
+    "run_scheduler",
+    "benchmark_memory",
+    "benchmark_facets",
+    "benchmark_fetch",
+    "benchmark_publishing",
+    "benchmark_queue_plans",
+    "benchmark_startup",
+    "simulate_schedule",
+    "test",
+)
+
 
 class PostsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "posts"
 
     def ready(self):
+        # The publishing stack is only imported by processes that run the scheduler.
+        # The run_scheduler worker starts its own, and the benchmark, simulation and
+        # test commands run the scheduling code themselves.
+        if not SCHEDULER_IN_WEB or sys.argv[1:2] in [
+            [command] for command in NO_SCHEDULER_COMMANDS
+        ]:
+            return
+
         try:
             from schedule_client import updater
-
-            updater.start()
-        except ModuleNotFoundError:
+        except ModuleNotFoundError as err:
             print(
-                "ModuleNotFoundError: If this is the static site, this error can be ignored."
+                f"Scheduler not started, {err.name} is not installed. "
+                "Set SCHEDULER_IN_WEB=False if this process should not publish posts."
             )
-            pass
-        except ImportError:
-            print("ImportError: If this is the static site, this error can be ignored.")
-            pass
-        except Exception:
-            raise
+            return
+
+        updater.start()
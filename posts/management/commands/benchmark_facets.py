@@ -0,0 +1,77 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from schedule_client.utils.facets import extract_facets
+
+# Text of each scenario, repeated to the measured length
+SCENARIOS = {
+    "post": "Read @alice.bsky.social on #python at https://example.com/page?q=1 日本 😀 ",
+    "dotted": "a.",
+    "hyphenated": "a-",
+    "unterminated url": "http://a.b",
+    "hashes": "#",
+    "opening parentheses": "(",
+    "closing parentheses": ")",
+    "trailing punctuation": "!",
+    "multibyte": "é.",
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure facet extraction on ordinary and adversarial text of increasing "
+        "length and fail if its time grows faster than the length"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            type=int,
+            nargs="+",
+            default=[10000, 100000, 1000000],
+            help="Length of the text of each run, in characters",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=3,
+            help="Number of runs of each size, the fastest one is reported",
+        )
+        parser.add_argument(
+            "--max-growth",
+            type=float,
+            default=3.0,
+            help="Fail if the time per character of the longest text exceeds the "
+            "time per character of the shortest by more than this factor",
+        )
+
+    def handle(self, *args, **options):
+        sizes = sorted(options["sizes"])
+        failures = []
+        for scenario, piece in SCENARIOS.items():
+            per_char = {}
+            for size in sizes:
+                text = (piece * (size // len(piece) + 1))[:size]
+                seconds = min(self.measure(text) for _ in range(options["repeat"]))
+                per_char[size] = seconds / size
+                self.stdout.write(
+                    f"{scenario}, {size} characters: {seconds * 1000:.1f} ms, "
+                    f"{size / seconds / 1e6:.1f}M characters/s"
+                )
+
+            growth = per_char[sizes[-1]] / per_char[sizes[0]]
+            if growth > options["max_growth"]:
+                failures.append(f"{scenario} {growth:.1f}x")
+
+        if failures:
+            raise CommandError(
+                f"Time per character grows with the length: {', '.join(failures)}"
+            )
+
+    @staticmethod
+    def measure(text: str) -> float:
+        start = time.perf_counter()
+        # Links without a scheme are detected in posts with appended links
+        extract_facets(text, aggressive=True)
+        return time.perf_counter() - start
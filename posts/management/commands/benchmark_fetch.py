@@ -0,0 +1,149 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from posts.models import Config, Post
+from schedule_client.utils.data_models import PostObject
+from schedule_client.utils.django_client import PUBLISH_COLUMNS, PostClient
+from schedule_client.utils.rendering import check_length, render_post, source_hash
+
+BENCHMARK_USERNAME = "benchmark-fetch.invalid"
+
+
+class Rollback(Exception):
+    """Raised to discard the posts created for a benchmark run"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the rows per second of building due posts from model instances "
+        "with full validation and from column projections"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--posts", type=int, default=50000, help="Number of due posts"
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=3,
+            help="Number of runs of each path, the fastest one is reported",
+        )
+        parser.add_argument(
+            "--min-speedup",
+            type=float,
+            default=1.0,
+            help="Fail if projections are not this many times faster",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.seed(options["posts"])
+                due_posts = Post.objects.filter(
+                    bluesky_username=BENCHMARK_USERNAME
+                ).order_by("scheduled_post_time", "id")
+
+                paths = {
+                    "model instances": lambda: [
+                        self.validated_post_object(post) for post in due_posts.all()
+                    ],
+                    "projections": lambda: [
+                        self.projected_post_object(row)
+                        for row in due_posts.values_list(*PUBLISH_COLUMNS)
+                    ],
+                }
+                rates = {}
+                for name, build in paths.items():
+                    seconds = min(self.measure(build) for _ in range(options["repeat"]))
+                    rates[name] = options["posts"] / seconds
+                    self.stdout.write(
+                        f"{name}: {rates[name]:,.0f} rows/s, "
+                        f"{seconds:.2f}s for {options['posts']} posts"
+                    )
+                raise Rollback
+        except Rollback:
+            pass
+
+        speedup = rates["projections"] / rates["model instances"]
+        self.stdout.write(f"Projections are {speedup:.1f}x faster")
+        if speedup < options["min_speedup"]:
+            raise CommandError(
+                f"Projections are less than {options['min_speedup']:g}x faster"
+            )
+
+    @staticmethod
+    def seed(posts: int) -> None:
+        """Create due posts rendered as Post.save would, which bulk_create skips"""
+        config = Config.objects.create(bluesky_username=BENCHMARK_USERNAME)
+
+        def benchmark_post(number: int) -> Post:
+            post = Post(
+                text=f"Benchmark post {number} #benchmark",
+                bluesky_username=config,
+                is_draft=False,
+                scheduled_post_time=timezone.now(),
+                link_1="https://example.com/benchmark",
+                image_1=f"benchmark/{number}.jpg",
+                alt_1=f"Benchmark image {number}",
+            )
+            render_source = post.render_source()
+            post.rendered = render_post(*render_source)
+            post.rendered_hash = source_hash(*render_source)
+            return post
+
+        Post.objects.bulk_create(
+            (benchmark_post(number) for number in range(posts)), batch_size=1000
+        )
+
+    @staticmethod
+    def measure(build) -> float:
+        start = time.perf_counter()
+        build()
+        return time.perf_counter() - start
+
+    @staticmethod
+    def validated_post_object(post: Post) -> PostObject:
+        """Build a post from a full model instance with pydantic validation"""
+        rendered = post.rendered
+        render_source = post.render_source()
+        if not rendered or post.rendered_hash != source_hash(*render_source):
+            rendered = render_post(*render_source)
+        return PostObject(
+            id=post.id,
+            text=post.text,
+            bluesky_username=BENCHMARK_USERNAME,
+            links=[
+                link
+                for link in (post.link_1, post.link_2, post.link_3, post.link_4)
+                if link
+            ],
+            link_card_title=post.link_card_title or "",
+            link_card_description=post.link_card_description or "",
+            embed=rendered["embed"],
+            image_urls_with_alts=[
+                {"image": image, "alt_text": alt_text or ""}
+                for image, alt_text in (
+                    (post.image_1, post.alt_1),
+                    (post.image_2, post.alt_2),
+                    (post.image_3, post.alt_3),
+                    (post.image_4, post.alt_4),
+                )
+                if image
+            ],
+            rendered_text=rendered["text"],
+            facets=rendered["facets"],
+            attempt_count=post.attempt_count,
+            rkey=post.rkey or "",
+        )
+
+    @staticmethod
+    def projected_post_object(row: tuple) -> PostObject:
+        """Build a post from PUBLISH_COLUMNS as the scheduler does, length check
+        included"""
+        post_object = PostClient._build_post_object(row, BENCHMARK_USERNAME, False)
+        check_length(post_object.rendered_text)
+        return post_object
@@ -0,0 +1,108 @@
+from contextlib import redirect_stdout
+import os
+import tracemalloc
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from posts.models import Config, Post
+from schedule_client.utils.data_models import AccountObject
+from schedule_client.utils.django_client import PostClient
+
+BENCHMARK_USERNAME = "benchmark-memory.invalid"
+
+
+class Rollback(Exception):
+    """Raised to discard the posts created for a benchmark run"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure peak memory of scheduling and claiming unscheduled backlogs of "
+        "increasing size with tracemalloc"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            type=int,
+            nargs="+",
+            default=[10000, 50000, 100000],
+            help="Number of unscheduled posts in each backlog",
+        )
+        parser.add_argument(
+            "--max-growth",
+            type=float,
+            default=2.0,
+            help="Fail if the peak of the largest backlog exceeds the peak of the "
+            "smallest by more than this factor",
+        )
+
+    def handle(self, *args, **options):
+        peaks = {}
+        for size in sorted(options["sizes"]):
+            schedule_peak, claim_peak, chunks = self.measure(size)
+            peaks[size] = max(schedule_peak, claim_peak)
+            self.stdout.write(
+                f"{size} posts: scheduling peak {schedule_peak / 1024:.0f} KiB, "
+                f"claiming peak {claim_peak / 1024:.0f} KiB over {chunks} chunks"
+            )
+
+        smallest, largest = peaks[min(peaks)], peaks[max(peaks)]
+        if largest > smallest * options["max_growth"]:
+            raise CommandError(
+                f"Peak memory grows with the backlog: {smallest / 1024:.0f} KiB "
+                f"for {min(peaks)} posts, {largest / 1024:.0f} KiB for {max(peaks)}"
+            )
+
+    @staticmethod
+    def measure(size: int) -> tuple[int, int, int]:
+        """Schedule and claim a backlog of size posts, then roll it back
+
+        Returns:
+            tuple[int, int, int]: Peak bytes allocated while scheduling and while
+            claiming, and the number of chunks claimed
+        """
+        account = AccountObject(
+            bluesky_username=BENCHMARK_USERNAME, interval_hours=0, interval_minutes=1
+        )
+        post_client = PostClient()
+
+        # Logged queries would otherwise be counted as memory held by the scheduler
+        with override_settings(DEBUG=False), open(os.devnull, "w") as devnull:
+            try:
+                with transaction.atomic():
+                    config = Config.objects.create(bluesky_username=BENCHMARK_USERNAME)
+                    Post.objects.bulk_create(
+                        (
+                            Post(text="", bluesky_username=config, is_draft=False)
+                            for _ in range(size)
+                        ),
+                        batch_size=1000,
+                    )
+
+                    with redirect_stdout(devnull):
+                        tracemalloc.start()
+                        post_client.schedule_unscheduled_posts(account)
+                        _, schedule_peak = tracemalloc.get_traced_memory()
+                        tracemalloc.stop()
+
+                        # Make every post due, so all of them are claimed
+                        Post.objects.filter(bluesky_username=config).update(
+                            scheduled_post_time=timezone.now()
+                        )
+
+                        tracemalloc.start()
+                        chunks = sum(
+                            1 for _ in post_client.iter_scheduled_posts(account)
+                        )
+                        _, claim_peak = tracemalloc.get_traced_memory()
+                        tracemalloc.stop()
+
+                    raise Rollback
+            except Rollback:
+                pass
+
+        return schedule_peak, claim_peak, chunks
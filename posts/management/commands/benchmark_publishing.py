@@ -0,0 +1,339 @@
+import argparse
+from contextlib import redirect_stdout
+from datetime import timedelta
+import json
+import os
+from pathlib import Path
+import resource
+import subprocess
+import sys
+import tempfile
+from threading import Lock
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from atproto_scheduler.settings import PUBLISH_ENGINE
+
+BENCHMARK_BUCKET = "benchmark"
+# Compared with the baseline, a higher value is a regression
+BASELINE_METRICS = ("tick_seconds", "queries", "peak_rss_kib")
+SCENARIO_OPTIONS = (
+    "accounts",
+    "posts",
+    "images",
+    "image_kib",
+    "engine",
+    "latency_ms",
+    "throttle_rate",
+    "error_rate",
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure a scheduler tick publishing seeded posts with images to a local fake "
+        "PDS and S3 bucket, and compare it with a recorded baseline"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--accounts", type=int, default=20, help="Number of seeded accounts"
+        )
+        parser.add_argument(
+            "--posts", type=int, default=10, help="Due posts of each account"
+        )
+        parser.add_argument(
+            "--images", type=int, choices=range(5), default=1, help="Images per post"
+        )
+        parser.add_argument(
+            "--image-kib", type=int, default=100, help="Size of each image"
+        )
+        parser.add_argument(
+            "--engine",
+            choices=["sync", "async"],
+            default=PUBLISH_ENGINE,
+            help="Publish engine, defaults to PUBLISH_ENGINE",
+        )
+        parser.add_argument(
+            "--latency-ms",
+            type=float,
+            default=20,
+            help="Delay of every PDS and S3 response",
+        )
+        parser.add_argument(
+            "--throttle-rate",
+            type=float,
+            default=0.0,
+            help="Share of PDS writes and uploads answered with a 429",
+        )
+        parser.add_argument(
+            "--error-rate",
+            type=float,
+            default=0.0,
+            help="Share of PDS writes and uploads answered with a 5xx error",
+        )
+        parser.add_argument(
+            "--seed", type=int, default=0, help="Seed of the injected failures"
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=3,
+            help="Number of ticks measured, the fastest one is reported",
+        )
+        parser.add_argument(
+            "--baseline",
+            type=Path,
+            default=settings.BASE_DIR / "benchmark_publishing.json",
+            help="JSON file of recorded results, keyed by scenario",
+        )
+        parser.add_argument(
+            "--save-baseline",
+            action="store_true",
+            help="Record the results as the baseline of this scenario",
+        )
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.25,
+            help="Fail if a metric exceeds its baseline by more than this share",
+        )
+        # Set for the process that seeds the database and runs the tick
+        parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options["worker"]:
+            self.stdout.write(json.dumps(self.run_tick(options)))
+            return
+
+        # Imported here so other management commands never load the publishing stack
+        from schedule_client.utils.fake_services import FakePDS, FakeS3
+
+        latency = timedelta(milliseconds=options["latency_ms"])
+        pds = FakePDS(
+            latency, options["throttle_rate"], options["error_rate"], options["seed"]
+        )
+        s3 = FakeS3(BENCHMARK_BUCKET, options["image_kib"] * 1024, latency)
+        pds.start()
+        s3.start()
+        try:
+            runs = [
+                self.measure(options, pds.url, s3.url) for _ in range(options["repeat"])
+            ]
+        finally:
+            pds.stop()
+            s3.stop()
+
+        result = min(runs, key=lambda run: run["tick_seconds"])
+        result["posts_per_second"] = result["posted"] / result["tick_seconds"]
+        self.write_result(options, result, pds.stats, s3.stats)
+
+        scenario = " ".join(
+            f"{option}={options[option]}" for option in SCENARIO_OPTIONS
+        )
+        baselines = {}
+        if options["baseline"].exists():
+            baselines = json.loads(options["baseline"].read_text())
+
+        if options["save_baseline"]:
+            baselines[scenario] = result
+            options["baseline"].write_text(json.dumps(baselines, indent=2) + "\n")
+            self.stdout.write(f"Baseline saved to {options['baseline']}")
+        elif scenario in baselines:
+            self.compare(result, baselines[scenario], options["tolerance"])
+        else:
+            self.stdout.write(
+                f"No baseline for this scenario in {options['baseline']}, "
+                "record one with --save-baseline"
+            )
+
+    def measure(self, options: dict, pds_url: str, s3_url: str) -> dict:
+        """Run a tick in a fresh worker process with its own temporary database
+
+        Returns:
+            dict: Results of the tick, see run_tick
+        """
+        with tempfile.TemporaryDirectory() as temp_dir:
+            env = {
+                **os.environ,
+                "DJANGO_SETTINGS_MODULE": os.environ.get(
+                    "DJANGO_SETTINGS_MODULE", "atproto_scheduler.settings"
+                ),
+                "DEVELOPMENT_MODE": "False",
+                "DATABASE_URL": f"sqlite:///{temp_dir}/benchmark.sqlite3",
+                "SCHEDULER_IN_WEB": "False",
+                "PUBLISH_ENGINE": options["engine"],
+                "BLUESKY_PDS_URL": pds_url,
+                "AWS_S3_ENDPOINT_URL": s3_url,
+                "AWS_BUCKET_NAME": BENCHMARK_BUCKET,
+                "AWS_ACCESS_KEY": "benchmark",
+                "AWS_SECRET_ACCESS_KEY": "benchmark",
+                "MEDIA_CACHE_DIR": os.path.join(temp_dir, "media_cache"),
+                "POST_RESULTS_JOURNAL": os.path.join(temp_dir, "post_results.jsonl"),
+            }
+            result = subprocess.run(
+                [
+                    sys.executable,
+                    "manage.py",
+                    "benchmark_publishing",
+                    "--worker",
+                    f"--accounts={options['accounts']}",
+                    f"--posts={options['posts']}",
+                    f"--images={options['images']}",
+                ],
+                cwd=settings.BASE_DIR,
+                env=env,
+                capture_output=True,
+                text=True,
+            )
+
+        if result.returncode != 0:
+            raise CommandError(result.stderr.strip().splitlines()[-1])
+
+        return json.loads(result.stdout.strip().splitlines()[-1])
+
+    def run_tick(self, options: dict) -> dict:
+        """Seed the worker's database with due posts and publish them in one tick
+
+        Returns:
+            dict: Tick duration, database queries, peak resident memory of the worker
+            and the number of posts published, waiting for a retry, deferred and
+            turned into drafts
+        """
+        from django.core.management import call_command
+        from django.db import connection
+        from django.db.backends.signals import connection_created
+        from django.utils import timezone
+
+        from posts.models import Post
+        from schedule_client.schedule_jobs import schedule_and_post
+
+        call_command("migrate", verbosity=0)
+        self.seed(options["accounts"], options["posts"], options["images"])
+        # Due at the start of the tick, however long seeding took
+        Post.objects.update(scheduled_post_time=timezone.now())
+
+        # Publishing threads open connections of their own
+        queries = {"count": 0}
+        queries_lock = Lock()
+
+        def count_query(execute, sql, params, many, context):
+            with queries_lock:
+                queries["count"] += 1
+            return execute(sql, params, many, context)
+
+        def watch_connection(sender, connection, **kwargs):
+            connection.execute_wrappers.append(count_query)
+
+        connection_created.connect(watch_connection)
+        connection.execute_wrappers.append(count_query)
+
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            start = time.perf_counter()
+            schedule_and_post()
+            tick_seconds = time.perf_counter() - start
+
+        connection.execute_wrappers.remove(count_query)
+        pending = Post.objects.filter(posted_at=None, is_draft=False)
+        return {
+            "tick_seconds": tick_seconds,
+            "queries": queries["count"],
+            # Kilobytes on Linux
+            "peak_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            "posted": Post.objects.exclude(posted_at=None).count(),
+            "retrying": pending.exclude(next_attempt_at=None).count(),
+            "deferred": pending.filter(next_attempt_at=None).count(),
+            "drafts": Post.objects.filter(is_draft=True).count(),
+        }
+
+    @staticmethod
+    def seed(accounts: int, posts: int, images: int) -> None:
+        """Create accounts allowed to post, each with posts of distinct images"""
+        from posts.models import CatchUpPolicy, Config, Post
+        from schedule_client.utils.rendering import render_post, source_hash
+
+        def benchmark_post(config: Config, number: int) -> Post:
+            post = Post(
+                text=f"Benchmark post {number} of {config.bluesky_username}",
+                bluesky_username=config,
+                is_draft=False,
+            )
+            for image in range(1, images + 1):
+                setattr(post, f"image_{image}", f"{config.pk}/{number}-{image}.jpg")
+                setattr(post, f"alt_{image}", f"Benchmark image {image}")
+
+            # Rendered as Post.save would, which bulk_create skips
+            render_source = post.render_source()
+            post.rendered = render_post(*render_source)
+            post.rendered_hash = source_hash(*render_source)
+            return post
+
+        for account in range(accounts):
+            config = Config.objects.create(
+                bluesky_username=f"benchmark-{account}.test",
+                app_password="benchmark",
+                allow_posts=True,
+                # Later accounts of a tick would otherwise miss the catch-up window of
+                # SCHEDULER_INTERVAL and be left for the next tick
+                catch_up_policy=CatchUpPolicy.PUBLISH_LATE,
+            )
+            Post.objects.bulk_create(
+                (benchmark_post(config, number) for number in range(posts)),
+                batch_size=1000,
+            )
+
+    def write_result(self, options: dict, result: dict, pds_stats, s3_stats) -> None:
+        repeat = options["repeat"]
+        self.stdout.write(
+            f"{options['accounts']} accounts x {options['posts']} posts with "
+            f"{options['images']} images of {options['image_kib']} KiB, "
+            f"{options['engine']} engine, {options['latency_ms']:g} ms latency"
+        )
+        self.stdout.write(
+            f"Tick: {result['tick_seconds']:.2f}s, "
+            f"{result['posts_per_second']:.1f} posts/s, fastest of {repeat}"
+        )
+        self.stdout.write(
+            f"Posts: {result['posted']} published, {result['retrying']} retrying, "
+            f"{result['deferred']} deferred, {result['drafts']} drafts"
+        )
+        self.stdout.write(
+            f"Queries: {result['queries']} "
+            f"({result['queries'] / max(result['posted'], 1):.1f} per published post)"
+        )
+        self.stdout.write(f"Peak memory: {result['peak_rss_kib'] / 1024:.0f} MiB RSS")
+
+        # Requests are counted over every tick
+        requests = {
+            nsid.rsplit(".", 1)[-1]: count // repeat
+            for nsid, count in pds_stats.items()
+            if "." in nsid
+        }
+        self.stdout.write(
+            "PDS requests per tick: "
+            + ", ".join(f"{count} {name}" for name, count in sorted(requests.items()))
+            + f", {pds_stats['throttled'] // repeat} throttled, "
+            f"{pds_stats['errors'] // repeat} errors"
+        )
+        self.stdout.write(
+            f"S3 requests per tick: {s3_stats['GET'] // repeat} GET, "
+            f"{s3_stats['HEAD'] // repeat} HEAD"
+        )
+
+    def compare(self, result: dict, baseline: dict, tolerance: float) -> None:
+        regressions = []
+        for metric in BASELINE_METRICS:
+            change = result[metric] / baseline[metric] - 1
+            self.stdout.write(
+                f"  {metric}: {result[metric]:g} vs baseline {baseline[metric]:g} "
+                f"({change:+.0%})"
+            )
+            if change > tolerance:
+                regressions.append(f"{metric} {change:+.0%}")
+
+        if regressions:
+            raise CommandError(
+                f"Regressions beyond {tolerance:.0%}: {', '.join(regressions)}"
+            )
@@ -0,0 +1,196 @@
+from contextlib import redirect_stdout
+from datetime import timedelta
+import os
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from atproto_scheduler.settings import MEDIA_PREFETCH_HORIZON
+from posts.models import Config, Post
+from schedule_client.utils.data_models import AccountObject
+from schedule_client.utils.django_client import PostClient
+
+BENCHMARK_USERNAME = "benchmark-queue-{}.invalid"
+# A plan line reading the whole table instead of an index
+FULL_SCANS = {
+    "sqlite": re.compile(r"\bSCAN posts_post\b(?! USING)"),
+    "postgresql": re.compile(r"\bSeq Scan on posts_post\b"),
+}
+
+
+class Rollback(Exception):
+    """Raised to discard the posts created for a benchmark run"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the queries of a scheduler tick against a large table of published "
+        "posts and fail if any of them scans the whole post table"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--accounts", type=int, default=20, help="Number of seeded accounts"
+        )
+        parser.add_argument(
+            "--published",
+            type=int,
+            default=5000,
+            help="Published posts of each account",
+        )
+        parser.add_argument(
+            "--pending",
+            type=int,
+            default=100,
+            help="Pending posts of each account, half of them due and half unscheduled",
+        )
+        parser.add_argument(
+            "--verbose-plans",
+            action="store_true",
+            help="Print the plan of every query, not only of the full scans",
+        )
+
+    def handle(self, *args, **options):
+        full_scan = FULL_SCANS.get(connection.vendor)
+        if not full_scan:
+            raise CommandError(f"Plans of {connection.vendor} are not supported")
+
+        try:
+            with transaction.atomic():
+                accounts = self.seed(
+                    options["accounts"], options["published"], options["pending"]
+                )
+                plans = self.explain_tick(accounts)
+                raise Rollback
+        except Rollback:
+            pass
+
+        full_scans = 0
+        for method, sql, elapsed, plan in plans:
+            scans = any(full_scan.search(line) for line in plan)
+            full_scans += scans
+            self.stdout.write(
+                f"{'FULL SCAN' if scans else 'index'}  {elapsed * 1000:7.1f} ms  "
+                f"{method}: {sql[:100]}"
+            )
+            if scans or options["verbose_plans"]:
+                for line in plan:
+                    self.stdout.write(f"    {line}")
+
+        total = options["accounts"] * (options["published"] + options["pending"])
+        self.stdout.write(f"{len(plans)} queries on a table of {total} posts")
+        if full_scans:
+            raise CommandError(f"{full_scans} queries scan the whole post table")
+
+    @staticmethod
+    def seed(accounts: int, published: int, pending: int) -> list[AccountObject]:
+        """Create accounts with a history of published posts, due posts and
+        unscheduled posts
+
+        Returns:
+            list[AccountObject]: The seeded accounts
+        """
+        now = timezone.now()
+        account_objects = []
+        for account in range(accounts):
+            config = Config.objects.create(
+                bluesky_username=BENCHMARK_USERNAME.format(account),
+                allow_posts=True,
+            )
+            posts = [
+                Post(
+                    text="",
+                    bluesky_username=config,
+                    is_draft=False,
+                    scheduled_post_time=now - timedelta(hours=number + 1),
+                    posted_at=now - timedelta(hours=number + 1),
+                )
+                for number in range(published)
+            ]
+            posts += [
+                Post(
+                    text="",
+                    bluesky_username=config,
+                    is_draft=False,
+                    scheduled_post_time=now if number % 2 else None,
+                    image_1=f"{config.pk}/{number}.jpg",
+                )
+                for number in range(pending)
+            ]
+            Post.objects.bulk_create(posts, batch_size=1000)
+            account_objects.append(
+                AccountObject(
+                    bluesky_username=config.bluesky_username, allow_posts=True
+                )
+            )
+
+        # Due at the start of the tick, however long seeding took
+        Post.objects.filter(posted_at=None).exclude(scheduled_post_time=None).update(
+            scheduled_post_time=timezone.now()
+        )
+        # PostgreSQL gathers statistics on its own, SQLite only when ANALYZE is run,
+        # which Django never does
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute(f"ANALYZE {Post._meta.db_table}")
+
+        return account_objects
+
+    @staticmethod
+    def explain_tick(
+        accounts: list[AccountObject],
+    ) -> list[tuple[str, str, float, list[str]]]:
+        """Run the PostClient methods of a tick and explain every query they run on
+        the post table
+
+        Returns:
+            list[tuple[str, str, float, list[str]]]: Method, SQL, time taken and plan of each query
+        """
+        post_client = PostClient()
+        tick = [
+            (
+                "catch_up_missed_posts",
+                lambda: post_client.catch_up_missed_posts(accounts),
+            ),
+            ("get_accounts_with_work", post_client.get_accounts_with_work),
+            ("get_next_due_time", post_client.get_next_due_time),
+            (
+                "get_upcoming_image_posts",
+                lambda: post_client.get_upcoming_image_posts(MEDIA_PREFETCH_HORIZON),
+            ),
+            (
+                "schedule_unscheduled_posts",
+                lambda: post_client.schedule_unscheduled_posts(accounts[0]),
+            ),
+            (
+                "iter_scheduled_posts",
+                lambda: list(post_client.iter_scheduled_posts(accounts[0])),
+            ),
+        ]
+
+        queries = []
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            for method, run in tick:
+                with CaptureQueriesContext(connection) as captured:
+                    run()
+                queries += [
+                    (method, query["sql"], float(query["time"]))
+                    for query in captured
+                    if Post._meta.db_table in query["sql"]
+                    and query["sql"].startswith(("SELECT", "UPDATE"))
+                ]
+
+        prefix = connection.ops.explain_query_prefix()
+        plans = []
+        with connection.cursor() as cursor:
+            for method, sql, elapsed in queries:
+                cursor.execute(f"{prefix} {sql}")
+                # The detail is the last column of SQLite plans, the only one of
+                # PostgreSQL plans
+                plan = [row[-1] for row in cursor.fetchall()]
+                plans.append((method, sql, elapsed, plan))
+
+        return plans
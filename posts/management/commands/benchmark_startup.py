@@ -0,0 +1,136 @@
+import os
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Code run in a fresh interpreter for each kind of process
+STARTUP_TARGETS = {
+    "web": "from atproto_scheduler.wsgi import application\nimport atproto_scheduler.urls",
+    "worker": "import django\ndjango.setup()\nfrom schedule_client import updater",
+}
+
+# Packages only the scheduler worker should load
+PUBLISHING_PACKAGES = (
+    "apscheduler",
+    "atproto",
+    "atproto_client",
+    "atproto_core",
+    "boto3",
+    "botocore",
+    "httpx",
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure cold start of a web process and of the scheduler worker "
+        "with python -X importtime"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=5,
+            help="Number of cold starts per process, the fastest one is reported",
+        )
+        parser.add_argument(
+            "--top", type=int, default=10, help="Number of slowest imports to list"
+        )
+        parser.add_argument(
+            "--web-budget-ms", type=float, help="Fail if web start exceeds this"
+        )
+        parser.add_argument(
+            "--worker-budget-ms", type=float, help="Fail if worker start exceeds this"
+        )
+
+    def handle(self, *args, **options):
+        budgets = {
+            "web": options["web_budget_ms"],
+            "worker": options["worker_budget_ms"],
+        }
+        failures = []
+
+        for target, code in STARTUP_TARGETS.items():
+            runs = [self.measure(code) for _ in range(options["repeat"])]
+            wall_ms, imports = min(runs, key=lambda run: run[0])
+
+            top_level = {
+                module: cumulative_us
+                for module, cumulative_us, depth in imports
+                if depth == 0
+            }
+            loaded = {module for module, _, _ in imports}
+
+            self.stdout.write(
+                f"{target}: {wall_ms:.0f} ms wall, "
+                f"{sum(top_level.values()) / 1000:.0f} ms importing "
+                f"{len(loaded)} modules"
+            )
+            slowest = sorted(top_level.items(), key=lambda item: -item[1])
+            for module, cumulative_us in slowest[: options["top"]]:
+                self.stdout.write(f"  {cumulative_us / 1000:8.1f} ms  {module}")
+
+            if target == "web":
+                leaked = sorted(
+                    module
+                    for module in loaded
+                    if module.split(".")[0] in PUBLISHING_PACKAGES
+                )
+                if leaked:
+                    failures.append(
+                        f"web imports the publishing stack: {', '.join(leaked[:5])}"
+                    )
+
+            budget = budgets[target]
+            if budget is not None and wall_ms > budget:
+                failures.append(f"{target} start {wall_ms:.0f} ms > {budget:.0f} ms")
+
+        if failures:
+            raise CommandError("; ".join(failures))
+
+    @staticmethod
+    def measure(code: str) -> tuple[float, list[tuple[str, int, int]]]:
+        """Start a fresh interpreter running code
+
+        Returns:
+            tuple[float, list[tuple[str, int, int]]]: Wall time in milliseconds and
+            every import as (module, cumulative microseconds, nesting depth)
+        """
+        env = {
+            **os.environ,
+            "DJANGO_SETTINGS_MODULE": os.environ.get(
+                "DJANGO_SETTINGS_MODULE", "atproto_scheduler.settings"
+            ),
+            # Web processes are measured as they run alongside a dedicated worker
+            "SCHEDULER_IN_WEB": "False",
+        }
+
+        start = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            cwd=settings.BASE_DIR,
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+        wall_ms = (time.perf_counter() - start) * 1000
+
+        if result.returncode != 0:
+            raise CommandError(result.stderr.strip().splitlines()[-1])
+
+        imports = []
+        for line in result.stderr.splitlines():
+            if not line.startswith("import time:") or "|" not in line:
+                continue
+            _, cumulative, name = line.split("|")
+            if not cumulative.strip().isdigit():
+                continue
+            module = name.strip()
+            depth = (len(name) - len(name.lstrip()) - 1) // 2
+            imports.append((module, int(cumulative), depth))
+
+        return wall_ms, imports
@@ -0,0 +1,25 @@
+import signal
+from threading import Event
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Run the post scheduler as a dedicated worker process"
+
+    def handle(self, *args, **options):
+        # Imported here so other management commands never load the publishing stack
+        from schedule_client import updater
+
+        stop = Event()
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signal_number, lambda *_: stop.set())
+
+        updater.start()
+        self.stdout.write("Scheduler started.")
+
+        stop.wait()
+
+        # Let a running tick finish and flush its results before exiting
+        self.stdout.write("Stopping scheduler...")
+        updater.scheduler.shutdown(wait=True)
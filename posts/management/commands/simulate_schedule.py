@@ -0,0 +1,207 @@
+from datetime import datetime, timedelta
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from atproto_scheduler.settings import (
+    RATE_LIMIT_ACCOUNT_WRITES,
+    RATE_LIMIT_PDS_REQUESTS,
+    SCHEDULER_MODE,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Project when pending posts are published and how many requests the "
+        "scheduler sends, under a virtual clock"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days", type=int, default=30, help="Length of the simulation"
+        )
+        parser.add_argument(
+            "--start",
+            type=datetime.fromisoformat,
+            help="Virtual time of the first tick (ISO 8601), defaults to now",
+        )
+        parser.add_argument(
+            "--mode",
+            choices=["interval", "next_due"],
+            default=SCHEDULER_MODE,
+            help="Scheduler mode, defaults to SCHEDULER_MODE",
+        )
+        parser.add_argument(
+            "--account",
+            action="append",
+            default=[],
+            help="Only simulate this Bluesky handle, can be repeated",
+        )
+        parser.add_argument(
+            "--post",
+            type=int,
+            action="append",
+            default=[],
+            help="Report when the post with this ID is published, can be repeated",
+        )
+        parser.add_argument(
+            "--timeline",
+            type=int,
+            default=5,
+            help="Number of upcoming posts listed per account",
+        )
+        parser.add_argument(
+            "--synthetic",
+            type=int,
+            nargs=2,
+            metavar=("ACCOUNTS", "POSTS"),
+            help="Simulate ACCOUNTS accounts with POSTS unscheduled posts each "
+            "instead of the database",
+        )
+        parser.add_argument(
+            "--synthetic-interval-minutes",
+            type=int,
+            default=12 * 60,
+            help="Interval of the synthetic accounts",
+        )
+        parser.add_argument(
+            "--synthetic-images",
+            type=int,
+            default=0,
+            help="Images of each synthetic post",
+        )
+
+    def handle(self, *args, **options):
+        # Imported here so listing commands does not load the publishing stack
+        from schedule_client.utils.django_client import ConfigClient
+        from schedule_client.utils.simulation import (
+            load_snapshot,
+            simulate,
+            synthetic_snapshot,
+        )
+
+        start = options["start"] or timezone.now()
+        if timezone.is_naive(start):
+            start = timezone.make_aware(start)
+
+        if options["synthetic"]:
+            accounts, snapshot = synthetic_snapshot(
+                *options["synthetic"],
+                timedelta(minutes=options["synthetic_interval_minutes"]),
+                options["synthetic_images"],
+            )
+        else:
+            config = ConfigClient()
+            if config.is_placeholder:
+                raise CommandError("No Bluesky accounts are configured")
+            accounts = [
+                account
+                for account in config.accounts
+                if not options["account"]
+                or account.bluesky_username in options["account"]
+            ]
+            snapshot = load_snapshot(accounts)
+
+        started = time.perf_counter()
+        result = simulate(
+            accounts,
+            snapshot,
+            start,
+            options["days"],
+            options["mode"],
+            options["timeline"],
+            options["post"],
+        )
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(
+            f"Simulated {options['days']} days of {len(accounts)} accounts from "
+            f"{start:%Y-%m-%d %H:%M} in {elapsed:.2f}s ({options['mode']} mode)"
+        )
+
+        # Synthetic accounts all publish alike, their timelines are not listed
+        if not options["synthetic"]:
+            for timeline in result.timelines.values():
+                self.write_timeline(timeline)
+
+        for post_id, published_at in result.watched_posts.items():
+            if published_at is None:
+                self.stdout.write(f"Post {post_id} is not published")
+            else:
+                self.stdout.write(
+                    f"Post {post_id} is published at {self.local(published_at)}"
+                )
+
+        self.write_request_rates(result)
+
+    def write_timeline(self, timeline) -> None:
+        self.stdout.write(
+            f"\n{timeline.bluesky_username}: {timeline.pending} pending, "
+            f"{timeline.published} published, "
+            f"{timeline.beyond_horizon} after the simulation, "
+            f"{timeline.unpublished} not published"
+        )
+        if timeline.last_published_at:
+            self.stdout.write(
+                f"  last post within the simulation at "
+                f"{self.local(timeline.last_published_at)}"
+            )
+        for post_id, scheduled_time, published_at in timeline.first_posts:
+            self.stdout.write(
+                f"  post {post_id}: scheduled {self.local(scheduled_time)}, "
+                f"published {self.local(published_at)}"
+            )
+
+    def write_request_rates(self, result) -> None:
+        pds_limit, pds_window = RATE_LIMIT_PDS_REQUESTS
+        account_limit, account_window = RATE_LIMIT_ACCOUNT_WRITES
+
+        requests, window_start = result.peak_pds_requests()
+        self.stdout.write(
+            f"\nPeak PDS requests: {requests} per {pds_window} "
+            f"(limit {pds_limit}), from {self.local(window_start)}"
+        )
+        points, window_start, bluesky_username = result.peak_account_points()
+        self.stdout.write(
+            f"Peak account writes: {points} points per {account_window} "
+            f"(limit {account_limit}) by {bluesky_username}, "
+            f"from {self.local(window_start)}"
+        )
+
+        self.stdout.write("Busiest hours:")
+        for hour, requests in result.hourly_requests.most_common(5):
+            self.stdout.write(
+                f"  {self.local(result.hour_start(hour))}: {requests} requests"
+            )
+
+        over_limit = [
+            window
+            for window, requests in result.pds_requests.items()
+            if requests > pds_limit
+        ]
+        accounts_over_limit = {
+            bluesky_username
+            for (bluesky_username, _), points in result.account_points.items()
+            if points > account_limit
+        }
+        if over_limit:
+            self.stdout.write(
+                self.style.WARNING(
+                    f"{len(over_limit)} windows exceed the PDS limit, "
+                    "their posts would be deferred"
+                )
+            )
+        if accounts_over_limit:
+            self.stdout.write(
+                self.style.WARNING(
+                    f"{len(accounts_over_limit)} accounts exceed their write limit, "
+                    "their posts would be deferred"
+                )
+            )
+
+    @staticmethod
+    def local(when: datetime | None) -> str:
+        if when is None:
+            return "-"
+        return f"{timezone.localtime(when):%Y-%m-%d %H:%M:%S}"
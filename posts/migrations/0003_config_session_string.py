@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-18 14:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("posts", "0002_add_placeholder_config"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="config",
+            name="session_string",
+            field=models.TextField(blank=True, null=True),
+        ),
+    ]
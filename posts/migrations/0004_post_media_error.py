@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-18 14:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("posts", "0003_config_session_string"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="post",
+            name="media_error",
+            field=models.CharField(blank=True, max_length=300, null=True),
+        ),
+    ]
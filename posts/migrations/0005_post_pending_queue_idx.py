@@ -0,0 +1,21 @@
+# Generated by Django 5.0.1 on 2026-10-18 14:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("posts", "0004_post_media_error"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(
+                condition=models.Q(("is_draft", False), ("posted_at__isnull", True)),
+                fields=["bluesky_username", "scheduled_post_time"],
+                name="post_pending_queue_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.0.1 on 2026-10-18 15:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("posts", "0005_post_pending_queue_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="post",
+            name="rendered",
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="post",
+            name="rendered_hash",
+            field=models.CharField(
+                blank=True, editable=False, max_length=64, null=True
+            ),
+        ),
+        migrations.AlterField(
+            model_name="post",
+            name="text",
+            field=models.TextField(max_length=3000),
+        ),
+    ]
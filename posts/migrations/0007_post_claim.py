@@ -0,0 +1,25 @@
+# Generated by Django 5.0.1 on 2026-10-18 15:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("posts", "0006_post_rendered"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="post",
+            name="claim_expires_at",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="post",
+            name="claimed_by",
+            field=models.CharField(
+                blank=True, editable=False, max_length=200, null=True
+            ),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.0.1 on 2026-10-18 15:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("posts", "0007_post_claim"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="post",
+            name="attempt_count",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="post",
+            name="last_error",
+            field=models.CharField(
+                blank=True, editable=False, max_length=200, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="post",
+            name="next_attempt_at",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
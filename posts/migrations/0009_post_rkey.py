@@ -0,0 +1,20 @@
+# Generated by Django 5.0.1 on 2026-10-18 15:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("posts", "0008_post_retry_state"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="post",
+            name="rkey",
+            field=models.CharField(
+                blank=True, editable=False, max_length=13, null=True
+            ),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.0.1 on 2026-10-18 15:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("posts", "0009_post_rkey"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="post",
+            name="thread_parent",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="thread_replies",
+                to="posts.post",
+            ),
+        ),
+        migrations.AddField(
+            model_name="post",
+            name="thread_position",
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
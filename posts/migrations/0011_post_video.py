@@ -0,0 +1,23 @@
+# Generated by Django 5.0.1 on 2026-10-18 15:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("posts", "0010_post_thread"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="post",
+            name="video",
+            field=models.CharField(blank=True, max_length=200, null=True),
+        ),
+        migrations.AddField(
+            model_name="post",
+            name="video_alt",
+            field=models.TextField(blank=True, max_length=1000, null=True),
+        ),
+    ]
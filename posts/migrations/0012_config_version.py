@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-18 15:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("posts", "0011_post_video"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="config",
+            name="version",
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.0.1 on 2026-10-18 15:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("posts", "0012_config_version"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="config",
+            name="first_post_time",
+            field=models.TimeField(
+                blank=True,
+                help_text="Time of day the first slot of the posting grid starts at, e.g. 03:00 with a 24 hour interval to post at 3AM every day. Defaults to midnight.",
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="config",
+            name="quiet_hours_end",
+            field=models.TimeField(
+                blank=True,
+                help_text="No posts are scheduled during quiet hours.",
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="config",
+            name="quiet_hours_start",
+            field=models.TimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.0.1 on 2026-10-18 15:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("posts", "0013_config_schedule_grid"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="config",
+            name="catch_up_policy",
+            field=models.CharField(
+                choices=[
+                    ("reschedule", "Reschedule into the next free slots"),
+                    ("publish_late", "Publish late, up to the maximum lateness"),
+                    ("spread", "Spread over the next catch-up slots"),
+                ],
+                default="reschedule",
+                max_length=20,
+            ),
+        ),
+        migrations.AddField(
+            model_name="config",
+            name="catch_up_slots",
+            field=models.PositiveSmallIntegerField(
+                default=3, help_text="Number of intervals missed posts are spread over."
+            ),
+        ),
+        migrations.AddField(
+            model_name="config",
+            name="max_lateness_minutes",
+            field=models.PositiveIntegerField(
+                default=60,
+                help_text="Missed posts later than this are rescheduled instead of published late.",
+            ),
+        ),
+    ]
@@ -0,0 +1,19 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    def publish_replies_with_their_thread(apps, schema_editor):
+        # Replies added in the admin were saved as drafts, which their thread ignores
+        Post = apps.get_model("posts", "Post")
+        Post.objects.exclude(thread_parent=None).update(is_draft=False)
+
+    dependencies = [
+        ("posts", "0014_config_catch_up"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            publish_replies_with_their_thread, migrations.RunPython.noop
+        )
+    ]
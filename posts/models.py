@@ -1,6 +1,29 @@
+from datetime import timedelta
+import time
+
 from django.contrib import admin
+from django.core.exceptions import ValidationError
 from django.db import models
 
+from schedule_client.utils.rendering import (
+    PostTooLong,
+    check_length,
+    render_post,
+    source_hash,
+)
+from schedule_client.utils.slots import MIN_INTERVAL, NoAllowedSlot, SlotGrid
+
+# Replies that can follow the first post of a thread
+MAX_THREAD_REPLIES = 25
+
+
+class CatchUpPolicy(models.TextChoices):
+    """What happens to posts whose scheduled time passed without being published"""
+
+    RESCHEDULE = "reschedule", "Reschedule into the next free slots"
+    PUBLISH_LATE = "publish_late", "Publish late, up to the maximum lateness"
+    SPREAD = "spread", "Spread over the next catch-up slots"
+
 
 class Config(models.Model):
     bluesky_username = models.CharField(max_length=100, primary_key=True, unique=True)
@@ -8,21 +31,91 @@ class Config(models.Model):
 
     interval_hours = models.IntegerField(default=12)
     interval_minutes = models.IntegerField(default=0)
+    # Posts are scheduled on a grid of slots an interval apart, starting at this time
+    first_post_time = models.TimeField(
+        null=True,
+        blank=True,
+        help_text="Time of day the first slot of the posting grid starts at, "
+        "e.g. 03:00 with a 24 hour interval to post at 3AM every day. "
+        "Defaults to midnight.",
+    )
+    quiet_hours_start = models.TimeField(null=True, blank=True)
+    quiet_hours_end = models.TimeField(
+        null=True, blank=True, help_text="No posts are scheduled during quiet hours."
+    )
+    # Applied to posts missed while the scheduler was down or a tick overran
+    catch_up_policy = models.CharField(
+        max_length=20, choices=CatchUpPolicy, default=CatchUpPolicy.RESCHEDULE
+    )
+    max_lateness_minutes = models.PositiveIntegerField(
+        default=60,
+        help_text="Missed posts later than this are rescheduled instead of "
+        "published late.",
+    )
+    catch_up_slots = models.PositiveSmallIntegerField(
+        default=3,
+        help_text="Number of intervals missed posts are spread over.",
+    )
 
     allow_posts = models.BooleanField(default=False)
 
+    session_string = models.TextField(null=True, blank=True)
+    # Changed on every save, scheduler processes reload their cached accounts when the
+    # sum of versions changes
+    version = models.BigIntegerField(default=0, editable=False)
+
     class Meta:
         verbose_name = "Bluesky user configuration"
         verbose_name_plural = "Bluesky user configurations"
         ordering = ["bluesky_username"]
 
+    def clean(self):
+        interval = timedelta(hours=self.interval_hours, minutes=self.interval_minutes)
+        if interval < MIN_INTERVAL:
+            raise ValidationError(
+                {"interval_minutes": "The interval must be at least one minute."}
+            )
+
+        if self.catch_up_slots < 1:
+            raise ValidationError(
+                {"catch_up_slots": "Missed posts need at least one interval."}
+            )
+
+        if bool(self.quiet_hours_start) != bool(self.quiet_hours_end):
+            raise ValidationError(
+                {"quiet_hours_end": "Quiet hours need both a start and an end."}
+            )
+
+        try:
+            self.slot_grid().next_allowed(0)
+        except NoAllowedSlot as err:
+            raise ValidationError({"quiet_hours_start": str(err)})
+
+    def slot_grid(self) -> SlotGrid:
+        return SlotGrid(
+            timedelta(hours=self.interval_hours, minutes=self.interval_minutes),
+            self.first_post_time,
+            self.quiet_hours_start,
+            self.quiet_hours_end,
+        )
+
+    def save(self, *args, **kwargs):
+        # A timestamp in microseconds, so a deleted row and a new one never leave the
+        # sum unchanged, and summing millions of rows still fits in 64 bits
+        self.version = time.time_ns() // 1000
+        if kwargs.get("update_fields") is not None:
+            kwargs["update_fields"] = {*kwargs["update_fields"], "version"}
+
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return self.bluesky_username
 
 
 class Post(models.Model):
 
-    text = models.TextField(max_length=300)
+    # Length is validated in graphemes by clean(), this only bounds the admin form
+    text = models.TextField(max_length=3000)
     bluesky_username = models.ForeignKey(
         Config, on_delete=models.CASCADE, null=True, blank=True
     )
@@ -40,6 +133,8 @@ class Post(models.Model):
     alt_2 = models.TextField(max_length=500, null=True, blank=True)
     alt_3 = models.TextField(max_length=500, null=True, blank=True)
     alt_4 = models.TextField(max_length=500, null=True, blank=True)
+    video = models.CharField(max_length=200, null=True, blank=True)
+    video_alt = models.TextField(max_length=1000, null=True, blank=True)
     is_draft = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -47,9 +142,97 @@ class Post(models.Model):
     cid = models.CharField(max_length=300, null=True, blank=True)
     uri = models.CharField(max_length=300, null=True, blank=True)
     scheduled_post_time = models.DateTimeField(null=True, blank=True)
+    media_error = models.CharField(max_length=300, null=True, blank=True)
+    rendered = models.JSONField(null=True, blank=True, editable=False)
+    rendered_hash = models.CharField(
+        max_length=64, null=True, blank=True, editable=False
+    )
+    # Lease taken by the scheduler process publishing the post
+    claimed_by = models.CharField(max_length=200, null=True, blank=True, editable=False)
+    claim_expires_at = models.DateTimeField(null=True, blank=True, editable=False)
+    # Record key assigned when the post is first claimed, so that publishing it again
+    # finds the existing record instead of creating a duplicate
+    rkey = models.CharField(max_length=13, null=True, blank=True, editable=False)
+    # Failed publishing attempts, reset once the post is published or made a draft
+    attempt_count = models.IntegerField(default=0, editable=False)
+    next_attempt_at = models.DateTimeField(null=True, blank=True, editable=False)
+    last_error = models.CharField(max_length=200, null=True, blank=True, editable=False)
+    # Replies are published with the first post of their thread, each replying to the
+    # one before it in thread_position order
+    thread_parent = models.ForeignKey(
+        "self",
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name="thread_replies",
+    )
+    thread_position = models.PositiveSmallIntegerField(default=0)
 
     class Meta:
         ordering = ["-created_at"]
+        indexes = [
+            # Pending queue queried on every scheduler tick
+            models.Index(
+                fields=["bluesky_username", "scheduled_post_time"],
+                name="post_pending_queue_idx",
+                condition=models.Q(is_draft=False, posted_at__isnull=True),
+            ),
+        ]
+
+    def clean(self):
+        if self.thread_parent and self.thread_parent.thread_parent_id:
+            raise ValidationError(
+                {"thread_parent": "Replies must belong to the first post of a thread."}
+            )
+
+        if self.video and any((self.image_1, self.image_2, self.image_3, self.image_4)):
+            raise ValidationError({"video": "A post can have images or a video."})
+
+        try:
+            check_length(render_post(*self.render_source())["text"])
+        except PostTooLong as err:
+            raise ValidationError({"text": str(err)})
+
+    def save(self, *args, **kwargs):
+        # Replies are published with their thread, only the first post can be a draft
+        if self.thread_parent_id:
+            self.is_draft = False
+
+        # Re-render the cached post record only when its source fields changed
+        render_source = self.render_source()
+        rendered_hash = source_hash(*render_source)
+
+        if rendered_hash != self.rendered_hash:
+            self.rendered = render_post(*render_source)
+            self.rendered_hash = rendered_hash
+
+            if kwargs.get("update_fields") is not None:
+                kwargs["update_fields"] = {
+                    *kwargs["update_fields"],
+                    "rendered",
+                    "rendered_hash",
+                }
+
+        super().save(*args, **kwargs)
+
+    def render_source(self) -> tuple:
+        """Fields the rendered post record is built from, in render_post argument order"""
+        return (
+            self.text,
+            [
+                link
+                for link in (self.link_1, self.link_2, self.link_3, self.link_4)
+                if link
+            ],
+            self.link_card_title or "",
+            self.link_card_description or "",
+            [
+                image
+                for image in (self.image_1, self.image_2, self.image_3, self.image_4)
+                if image
+            ],
+            self.video or "",
+        )
 
     @admin.display(description="Post snippet")
     def post_snippet(self):
@@ -1,3 +1,1401 @@
-from django.test import TestCase
+import asyncio
+from datetime import date, datetime, time, timedelta
+import hashlib
+import json
+import os
+import random
+import tempfile
+from threading import Barrier, Thread
+from unittest import mock
+from zoneinfo import ZoneInfo
 
-# Create your tests here.
+from atproto.exceptions import BadRequestError, RequestErrorBase, UnauthorizedError
+from atproto_client.models.blob_ref import BlobRef
+from atproto_client.models.common import XrpcError
+from atproto_client.request import Response
+from botocore.exceptions import ClientError
+from django.core.exceptions import ValidationError
+from django.contrib import admin
+from django.core.management import find_commands
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.utils import timezone
+import httpx
+import libipld
+
+from atproto_scheduler.settings import (
+    RETRY_BASE_DELAY,
+    RETRY_MAX_ATTEMPTS,
+    RETRY_MAX_DELAY,
+)
+from posts.admin import PostAdmin
+from posts.apps import NO_SCHEDULER_COMMANDS
+from posts.models import CatchUpPolicy, Config, Post
+from schedule_client.schedule_jobs import handle_account_posts, handle_accounts_async
+from schedule_client.utils.async_atproto_client import AsyncAtprotoClient
+from schedule_client.utils.atproto_client import AtprotoClient
+from schedule_client.utils.dag_cbor import encode, from_json, record_cid
+from schedule_client.utils.data_models import AccountObject, PostObject
+from schedule_client.utils.django_client import (
+    PUBLISH_COLUMNS,
+    ConfigCache,
+    PostClient,
+    SlotIndexCache,
+    slot_indexes,
+)
+from schedule_client.utils.facets import extract_facets
+from schedule_client.utils.fake_services import FakePDS, FakeS3, FakeVideoService
+from schedule_client.utils.media_cache import MediaCache
+from schedule_client.utils.post_results import PostResultJournal
+from schedule_client.utils.publishing import Publisher, first_error, link_card_embed
+from schedule_client.utils.rate_limiter import RateLimited, TokenBucket
+from schedule_client.utils.retry_policy import is_transient, next_attempt_at
+from schedule_client.utils.s3 import ImageClient
+from schedule_client.utils.session_manager import SessionManager, session_manager
+from schedule_client.utils.slots import NoAllowedSlot, SlotGrid, SlotIndex
+from schedule_client.utils.tid import (
+    S32_ALPHABET,
+    TID_LENGTH,
+    encode_tid,
+    generate_tids,
+)
+from schedule_client.utils.video import (
+    GET_JOB_STATUS_NSID,
+    GET_SERVICE_AUTH_NSID,
+    UPLOAD_VIDEO_NSID,
+    VideoProcessingFailed,
+)
+
+
+def bad_request(error: str) -> BadRequestError:
+    return BadRequestError(
+        Response(
+            success=False,
+            status_code=400,
+            content=XrpcError(error=error, message=error),
+            headers={},
+        )
+    )
+
+
+class NoSchedulerCommandsTests(SimpleTestCase):
+    def test_posts_commands_never_start_the_scheduler(self):
+        # Every command of this app runs the scheduling code itself or none at all
+        commands = find_commands(os.path.join(os.path.dirname(__file__), "management"))
+
+        self.assertLessEqual(set(commands), set(NO_SCHEDULER_COMMANDS))
+
+
+class DeferredPostTests(TestCase):
+    def setUp(self):
+        self.config = Config.objects.create(bluesky_username="deferred.test")
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.journal = PostResultJournal(os.path.join(temp_dir.name, "results.jsonl"))
+
+    def test_deferred_retry_is_not_due_before_deferred_until(self):
+        now = timezone.now()
+        post = Post.objects.create(
+            text="Retrying",
+            bluesky_username=self.config,
+            is_draft=False,
+            scheduled_post_time=now - timedelta(hours=1),
+            attempt_count=1,
+            next_attempt_at=now - timedelta(minutes=1),
+        )
+        deferred_until = now + timedelta(minutes=5)
+
+        self.journal.add_deferred(post.id, deferred_until, is_retry=True)
+        self.journal.flush()
+
+        post.refresh_from_db()
+        self.assertEqual(post.next_attempt_at, deferred_until)
+        self.assertFalse(Post.objects.filter(PostClient._due(now), id=post.id).exists())
+
+    def test_deferred_post_does_not_become_a_retry(self):
+        now = timezone.now()
+        post = Post.objects.create(
+            text="Fresh",
+            bluesky_username=self.config,
+            is_draft=False,
+            scheduled_post_time=now,
+        )
+
+        self.journal.add_deferred(post.id, now + timedelta(minutes=5))
+        self.journal.flush()
+
+        post.refresh_from_db()
+        self.assertIsNone(post.next_attempt_at)
+        self.assertEqual(post.scheduled_post_time, now + timedelta(minutes=5))
+
+
+class SchedulingQueryTests(TestCase):
+    """Scheduling a backlog costs a fixed number of queries per page of
+    SCHEDULE_BATCH_SIZE posts, never one per post"""
+
+    POSTS = 10_000
+
+    def setUp(self):
+        self.config = Config.objects.create(bluesky_username="backlog.test")
+        self.account = AccountObject(bluesky_username="backlog.test")
+        self.addCleanup(slot_indexes.indexes.clear)
+
+    def create_posts(self, **fields):
+        Post.objects.bulk_create(
+            (
+                Post(text=f"Backlog {number}", bluesky_username=self.config, **fields)
+                for number in range(self.POSTS)
+            ),
+            batch_size=1000,
+        )
+
+    def test_scheduling_10k_posts(self):
+        self.create_posts(is_draft=False)
+
+        # exists, the slot index fingerprint and build, then for each of the 10
+        # pages of SCHEDULE_BATCH_SIZE posts the page, a savepoint pair and five
+        # UPDATEs of bulk_update, limited by the query parameters of SQLite, and
+        # the last empty page
+        with self.assertNumQueries(3 + 10 * 8 + 1):
+            PostClient().schedule_unscheduled_posts(self.account)
+
+        self.assertFalse(Post.objects.filter(scheduled_post_time=None).exists())
+        self.assertEqual(
+            Post.objects.values("scheduled_post_time").distinct().count(), self.POSTS
+        )
+
+    def test_rescheduling_10k_missed_posts(self):
+        self.create_posts(
+            is_draft=False, scheduled_post_time=timezone.now() - timedelta(days=1)
+        )
+
+        # The accounts with missed posts, then a single UPDATE
+        with self.assertNumQueries(2):
+            PostClient().catch_up_missed_posts([self.account])
+
+        self.assertEqual(
+            Post.objects.filter(scheduled_post_time=None).count(), self.POSTS
+        )
+
+
+class CatchUpTests(TestCase):
+    def setUp(self):
+        self.config = Config.objects.create(
+            bluesky_username="catch-up.test", catch_up_policy=CatchUpPolicy.SPREAD
+        )
+        self.account = AccountObject(
+            bluesky_username="catch-up.test", catch_up_policy=CatchUpPolicy.SPREAD
+        )
+
+    def test_catch_up_slots_must_be_positive(self):
+        self.config.catch_up_slots = 0
+        with self.assertRaises(ValidationError):
+            self.config.clean()
+
+    def test_spreading_no_missed_posts_does_nothing(self):
+        # Only the count, another process may have spread the posts already
+        with self.assertNumQueries(1):
+            PostClient()._spread_missed_posts(
+                self.account,
+                Post.objects.filter(bluesky_username=self.config),
+                timezone.now(),
+            )
+
+
+class ConfigCacheTests(TestCase):
+    def setUp(self):
+        # Added by the migrations, it is only the configured account on a fresh install
+        Config.objects.filter(bluesky_username="placeholder").delete()
+        self.config = Config.objects.create(bluesky_username="first.test")
+        Config.objects.create(bluesky_username="second.test")
+        Config.objects.create(bluesky_username="third.test")
+        self.cache = ConfigCache()
+        self.cache.get_accounts()
+
+    def assert_reloaded(self, usernames: list[str]):
+        # The fingerprint, then the accounts
+        with self.assertNumQueries(2):
+            _, accounts = self.cache.get_accounts()
+
+        self.assertEqual(self.cache.stats["loads"], 2)
+        self.assertEqual([account.bluesky_username for account in accounts], usernames)
+        return accounts
+
+    def test_unchanged_table_is_not_reloaded(self):
+        # Only the fingerprint, however often the accounts are asked for
+        for _ in range(3):
+            with self.assertNumQueries(1):
+                self.cache.get_accounts()
+
+        self.assertEqual(self.cache.stats["loads"], 1)
+
+    def test_edit_reloads(self):
+        self.config.interval_hours = 5
+        self.config.save()
+
+        accounts = self.assert_reloaded(["first.test", "second.test", "third.test"])
+        self.assertEqual(accounts[0].interval_hours, 5)
+
+    def test_insert_reloads(self):
+        Config.objects.create(bluesky_username="fourth.test")
+
+        self.assert_reloaded(["first.test", "fourth.test", "second.test", "third.test"])
+
+    def test_delete_reloads(self):
+        self.config.delete()
+
+        self.assert_reloaded(["second.test", "third.test"])
+
+    def test_replaced_row_reloads(self):
+        # The count is unchanged, the sum of versions is not
+        self.config.delete()
+        Config.objects.create(bluesky_username="replacement.test")
+
+        self.assert_reloaded(["replacement.test", "second.test", "third.test"])
+
+    def test_session_updates_do_not_reload(self):
+        # Sessions are not part of the cached accounts and are saved without save()
+        Config.objects.filter(pk=self.config.pk).update(session_string="stored")
+
+        with self.assertNumQueries(1):
+            self.cache.get_accounts()
+        self.assertEqual(self.cache.stats["loads"], 1)
+
+
+class SlotGridTests(SimpleTestCase):
+    def setUp(self):
+        override = timezone.override(ZoneInfo("America/New_York"))
+        override.__enter__()
+        self.addCleanup(override.__exit__, None, None, None)
+
+    def wall_times(self, grid: SlotGrid, slots: list[int]) -> list[datetime]:
+        return [timezone.localtime(grid.slot_time(slot)) for slot in slots]
+
+    def test_quiet_hours_wrapping_midnight(self):
+        grid = SlotGrid(timedelta(hours=1), time(0, 30), time(22), time(6))
+        first_slot = grid.first_slot_from(timezone.make_aware(datetime(2024, 3, 1, 20)))
+
+        slots = SlotIndex().allocate(grid, 5, first_slot)
+
+        self.assertEqual(
+            [
+                wall_time.replace(tzinfo=None)
+                for wall_time in self.wall_times(grid, slots)
+            ],
+            [
+                datetime(2024, 3, 1, 20, 30),
+                datetime(2024, 3, 1, 21, 30),
+                datetime(2024, 3, 2, 6, 30),
+                datetime(2024, 3, 2, 7, 30),
+                datetime(2024, 3, 2, 8, 30),
+            ],
+        )
+
+    def test_every_slot_in_quiet_hours(self):
+        grid = SlotGrid(timedelta(days=1), time(23), time(22), time(6))
+
+        with self.assertRaises(NoAllowedSlot):
+            grid.next_allowed(0)
+
+    def test_daily_slot_keeps_its_wall_time_across_dst(self):
+        grid = SlotGrid(timedelta(days=1), time(3))
+        # The days before and after the changes of 2024
+        first_slot = grid.first_slot_from(timezone.make_aware(datetime(2024, 3, 9)))
+        slots = [first_slot, first_slot + 1]
+        slots += [slot + (date(2024, 11, 2) - date(2024, 3, 9)).days for slot in slots]
+
+        wall_times = self.wall_times(grid, slots)
+
+        self.assertEqual([wall_time.hour for wall_time in wall_times], [3] * 4)
+        self.assertEqual(
+            [wall_time.utcoffset() for wall_time in wall_times],
+            [timedelta(hours=offset) for offset in (-5, -4, -4, -5)],
+        )
+
+    def test_fall_back(self):
+        # 1:00 to 2:00 happens twice on 2024-11-03, the slot is only used once
+        grid = SlotGrid(timedelta(minutes=30))
+        first_slot = grid.first_slot_from(timezone.make_aware(datetime(2024, 11, 3)))
+
+        slots = SlotIndex().allocate(grid, 8, first_slot)
+        slot_times = [grid.slot_time(slot) for slot in slots]
+
+        self.assertEqual(slot_times, sorted(set(slot_times)))
+        self.assertEqual(
+            [wall_time.strftime("%H:%M") for wall_time in self.wall_times(grid, slots)],
+            ["00:00", "00:30", "01:00", "01:30", "02:00", "02:30", "03:00", "03:30"],
+        )
+        self.assertEqual([grid.slot_of(when) for when in slot_times], slots)
+        # A time in the repeated hour falls in the slot of its wall time
+        repeated = datetime(
+            2024, 11, 3, 1, 40, fold=1, tzinfo=ZoneInfo("America/New_York")
+        )
+        self.assertEqual(grid.slot_of(repeated), slots[3])
+
+    def test_freed_slots_are_filled_first(self):
+        grid = SlotGrid(timedelta(hours=1))
+        # Slots 2 and 5 were freed by deleted posts
+        slot_index = SlotIndex([0, 1, 3, 4, 6])
+
+        self.assertEqual(slot_index.allocate(grid, 3, 0), [2, 5, 7])
+        self.assertEqual(slot_index.first_free(0), 8)
+
+    def test_freed_slots_in_quiet_hours_are_skipped(self):
+        grid = SlotGrid(
+            timedelta(hours=1), quiet_hours_start=time(2), quiet_hours_end=time(4)
+        )
+        slot_index = SlotIndex([0, 1, 4])
+
+        self.assertEqual(slot_index.allocate(grid, 2, 0), [5, 6])
+
+
+class SlotIndexCacheTests(TestCase):
+    def setUp(self):
+        self.config = Config.objects.create(bluesky_username="slots.test")
+        self.account = AccountObject(bluesky_username="slots.test", interval_hours=1)
+        self.addCleanup(slot_indexes.indexes.clear)
+        slot_indexes.stats["builds"] = 0
+
+    def create_post(self, **fields) -> Post:
+        return Post.objects.create(
+            text="Slot", bluesky_username=self.config, is_draft=False, **fields
+        )
+
+    def schedule(self) -> None:
+        PostClient().schedule_unscheduled_posts(self.account)
+
+    def scheduled_times(self) -> list[datetime]:
+        return list(
+            Post.objects.exclude(scheduled_post_time=None)
+            .order_by("scheduled_post_time")
+            .values_list("scheduled_post_time", flat=True)
+        )
+
+    def test_index_is_kept_while_this_process_schedules(self):
+        for _ in range(3):
+            self.create_post()
+            self.schedule()
+
+        self.assertEqual(slot_indexes.stats["builds"], 1)
+        times = self.scheduled_times()
+        self.assertEqual(
+            [later - earlier for earlier, later in zip(times, times[1:])],
+            [timedelta(hours=1)] * 2,
+        )
+
+    def test_deleted_post_slot_is_filled(self):
+        for _ in range(3):
+            self.create_post()
+        self.schedule()
+        times = self.scheduled_times()
+
+        Post.objects.get(scheduled_post_time=times[1]).delete()
+        self.create_post()
+        self.schedule()
+
+        self.assertEqual(slot_indexes.stats["builds"], 2)
+        self.assertEqual(self.scheduled_times(), times)
+
+    def test_changed_grid_rebuilds(self):
+        self.create_post()
+        self.schedule()
+
+        self.account.interval_hours = 2
+        self.create_post()
+        self.schedule()
+
+        self.assertEqual(slot_indexes.stats["builds"], 2)
+
+    def test_posts_scheduled_by_another_process(self):
+        # Missed posts are unscheduled without changing their updated_at, and
+        # rescheduling one by another process leaves the count of scheduled posts
+        # unchanged
+        missed = self.create_post(
+            scheduled_post_time=timezone.now() - timedelta(days=1)
+        )
+        self.create_post()
+        self.schedule()
+
+        with mock.patch(
+            "schedule_client.utils.django_client.slot_indexes", SlotIndexCache()
+        ):
+            PostClient().catch_up_missed_posts([self.account])
+            self.schedule()
+        missed.refresh_from_db()
+        self.assertIsNotNone(missed.scheduled_post_time)
+
+        self.create_post()
+        self.schedule()
+
+        # No slot is given twice
+        self.assertEqual(len(set(self.scheduled_times())), 3)
+        self.assertEqual(slot_indexes.stats["builds"], 2)
+
+
+class PostLengthTests(TestCase):
+    def setUp(self):
+        Config.objects.create(bluesky_username="length.test")
+        self.account = AccountObject(bluesky_username="length.test")
+
+    def create_due_post(self, text: str) -> Post:
+        # Written without Post.clean, as an import would
+        return Post.objects.create(
+            text=text,
+            bluesky_username_id="length.test",
+            is_draft=False,
+            scheduled_post_time=timezone.now(),
+        )
+
+    @mock.patch("schedule_client.utils.django_client.post_results")
+    def test_too_long_post_is_not_published(self, post_results):
+        short = self.create_due_post("Short")
+        too_long = self.create_due_post("x" * 301)
+
+        posts = [
+            post
+            for chunk in PostClient().iter_scheduled_posts(self.account)
+            for post in chunk
+        ]
+
+        self.assertEqual([post.id for post in posts], [short.id])
+        post_results.add_draft.assert_called_once_with(too_long.id, "PostTooLong")
+
+    @mock.patch("schedule_client.utils.django_client.post_results")
+    def test_thread_with_a_too_long_reply_is_not_published(self, post_results):
+        post = self.create_due_post("First")
+        Post.objects.create(
+            text="\u00e9" * 301,
+            bluesky_username_id="length.test",
+            is_draft=False,
+            thread_parent=post,
+        )
+
+        self.assertEqual(list(PostClient().iter_scheduled_posts(self.account)), [])
+        post_results.add_draft.assert_called_once_with(post.id, "PostTooLong")
+
+    def test_graphemes_are_counted(self):
+        # A flag is one character of two code points
+        Post(text="\U0001f1eb\U0001f1f7" * 300).clean()
+        with self.assertRaises(ValidationError):
+            Post(text="\U0001f1eb\U0001f1f7" * 301).clean()
+
+
+class EmbedPlanTests(TestCase):
+    """The embed planned when a post is saved is the one it is published with"""
+
+    def post_object(self, **fields) -> PostObject:
+        post = Post.objects.create(text="Embed", **fields)
+        row = Post.objects.values_list(*PUBLISH_COLUMNS).get(id=post.id)
+        return PostClient._build_post_object(row, "embed.test", False)
+
+    def test_link_card(self):
+        post = self.post_object(
+            link_1="https://example.com",
+            link_card_title="Title",
+            link_card_description="Description",
+        )
+
+        self.assertEqual(post.embed, "link_card")
+        self.assertEqual(post.rendered_text, "Embed")
+        self.assertEqual(link_card_embed(post).external.uri, "https://example.com")
+
+    def test_images(self):
+        post = self.post_object(image_1="image.jpg")
+
+        self.assertEqual(post.embed, "images")
+        self.assertIsNone(link_card_embed(post))
+
+    def test_appended_link(self):
+        post = self.post_object(link_1="https://example.com")
+
+        self.assertIsNone(post.embed)
+        self.assertEqual(post.rendered_text, "Embed\nhttps://example.com\n")
+        self.assertIsNone(link_card_embed(post))
+
+    def test_media_replaces_link_card(self):
+        # A post has one embed, so its link is kept in the text instead
+        for embed, media in (
+            ("images", {"image_1": "image.jpg"}),
+            ("video", {"video": "clip.mp4"}),
+        ):
+            with self.subTest(embed=embed):
+                post = self.post_object(
+                    link_1="https://example.com",
+                    link_card_title="Title",
+                    link_card_description="Description",
+                    **media,
+                )
+
+                self.assertEqual(post.embed, embed)
+                self.assertEqual(post.rendered_text, "Embed\nhttps://example.com\n")
+                self.assertEqual(
+                    [facet["value"] for facet in post.facets], ["https://example.com"]
+                )
+                self.assertIsNone(link_card_embed(post))
+
+    def test_adding_video_rerenders(self):
+        post = Post.objects.create(
+            text="Embed",
+            link_1="https://example.com",
+            link_card_title="Title",
+            link_card_description="Description",
+        )
+        self.assertEqual(post.rendered["embed"], "link_card")
+
+        post.video = "clip.mp4"
+        post.save()
+
+        self.assertEqual(post.rendered["embed"], "video")
+
+
+class InMemoryPostResultsTests(TestCase):
+    def test_results_are_written_by_flush(self):
+        config = Config.objects.create(bluesky_username="memory.test")
+        post = Post.objects.create(
+            text="Published",
+            bluesky_username=config,
+            is_draft=False,
+            scheduled_post_time=timezone.now(),
+        )
+        journal = PostResultJournal(None)
+
+        journal.add_posted(post.id, "cid", "at://did:plc:memory/post/1")
+        self.assertFalse(Post.objects.exclude(posted_at=None).exists())
+
+        journal.flush()
+        post.refresh_from_db()
+        self.assertEqual(post.cid, "cid")
+        self.assertEqual(journal.pending, [])
+
+
+class FailedLoginClaimTests(TestCase):
+    """Posts of an account that cannot log in are left unclaimed"""
+
+    def setUp(self):
+        config = Config.objects.create(bluesky_username="login.test", allow_posts=True)
+        self.account = AccountObject(bluesky_username="login.test", allow_posts=True)
+        self.post = Post.objects.create(
+            text="Due",
+            bluesky_username=config,
+            is_draft=False,
+            scheduled_post_time=timezone.now(),
+        )
+        self.addCleanup(slot_indexes.indexes.clear)
+
+    @mock.patch("schedule_client.schedule_jobs.AtprotoClient")
+    def test_sync_engine(self, atproto_client):
+        atproto_client.return_value.is_valid_login = False
+
+        handle_account_posts(PostClient(), self.account)
+
+        self.post.refresh_from_db()
+        self.assertIsNone(self.post.claimed_by)
+
+    @mock.patch("schedule_client.schedule_jobs.session_manager")
+    def test_async_engine(self, session_manager):
+        session_manager.get_client.side_effect = UnauthorizedError(None)
+
+        handle_accounts_async(PostClient(), [self.account])
+
+        self.post.refresh_from_db()
+        self.assertIsNone(self.post.claimed_by)
+
+
+class ConcurrentClaimTests(TransactionTestCase):
+    """Scheduler processes claiming the same due posts at once never share one.
+    Each worker has its own database connection, as processes would."""
+
+    WORKERS = 4
+    POSTS = 200
+    CHUNK = 10
+
+    def test_claimed_posts_do_not_overlap(self):
+        config = Config.objects.create(bluesky_username="claims.test")
+        Post.objects.bulk_create(
+            Post(
+                text=f"Due {number}",
+                bluesky_username=config,
+                is_draft=False,
+                scheduled_post_time=timezone.now(),
+            )
+            for number in range(self.POSTS)
+        )
+        post_ids = list(Post.objects.values_list("id", flat=True))
+        chunks = [
+            post_ids[start : start + self.CHUNK]
+            for start in range(0, self.POSTS, self.CHUNK)
+        ]
+        barrier = Barrier(self.WORKERS)
+        claims = [[] for _ in range(self.WORKERS)]
+        errors = []
+
+        def claim(worker: int):
+            # Chunks in a different order for every worker, so claims interleave
+            worker_chunks = random.Random(worker).sample(chunks, len(chunks))
+            try:
+                barrier.wait()
+                for chunk in worker_chunks:
+                    claims[worker] += PostClient()._claim_posts(
+                        Post.objects.filter(id__in=chunk)
+                    )
+            except Exception as err:
+                errors.append(err)
+            finally:
+                connection.close()
+
+        threads = [
+            Thread(target=claim, args=(worker,)) for worker in range(self.WORKERS)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        # Every post claimed by exactly one worker
+        claimed = [post_id for worker_claims in claims for post_id in worker_claims]
+        self.assertCountEqual(claimed, post_ids)
+
+
+class ThreadReplyTests(TestCase):
+    def setUp(self):
+        self.post = Post.objects.create(text="First", is_draft=True)
+        # Saved by the thread reply inline, which has no is_draft field
+        self.reply = Post.objects.create(text="Reply", thread_parent=self.post)
+
+    def test_replies_are_never_drafts(self):
+        self.assertFalse(self.reply.is_draft)
+
+    def test_is_draft_is_read_only_for_replies(self):
+        post_admin = PostAdmin(Post, admin.site)
+
+        self.assertIn("is_draft", post_admin.get_readonly_fields(None, self.reply))
+        self.assertNotIn("is_draft", post_admin.get_readonly_fields(None, self.post))
+
+
+class RecordRecoveryTests(SimpleTestCase):
+    def get_existing_record(self, err: BadRequestError):
+        atproto_client = AtprotoClient.__new__(AtprotoClient)
+        atproto_client.did = "did:plc:recovery"
+        atproto_client.client = mock.Mock()
+        atproto_client.client.com.atproto.repo.get_record.side_effect = err
+        return atproto_client._run(
+            atproto_client._get_existing_record(PostObject(id=1, rkey="3kabcdefghijk"))
+        )
+
+    def test_missing_record_is_not_published(self):
+        self.assertIsNone(self.get_existing_record(bad_request("RecordNotFound")))
+
+    def test_other_bad_requests_are_raised(self):
+        for error in ("InvalidRequest", "RepoTakendown", "ExpiredToken"):
+            with self.subTest(error=error), self.assertRaises(BadRequestError):
+                self.get_existing_record(bad_request(error))
+
+
+class FirstErrorTests(SimpleTestCase):
+    def test_no_error(self):
+        self.assertIsNone(first_error(["image", "image"]))
+
+    def test_throttled_upload_is_preferred(self):
+        throttled = RateLimited(timezone.now())
+        self.assertIs(
+            first_error(["image", ValueError("broken"), throttled]), throttled
+        )
+
+    def test_first_error_without_throttling(self):
+        broken = ValueError("broken")
+        self.assertIs(first_error([broken, "image", OSError("closed")]), broken)
+
+
+# sha256 of the empty string, as a raw blob CID and as a record CID
+EMPTY_DIGEST = hashlib.sha256(b"").digest()
+BLOB_CID = libipld.encode_multibase("b", bytes([1, 0x55, 0x12, 32]) + EMPTY_DIGEST)
+RECORD_CID = libipld.encode_multibase("b", bytes([1, 0x71, 0x12, 32]) + EMPTY_DIGEST)
+REPLY_URI = "at://did:plc:abc/app.bsky.feed.post/3kabc"
+
+POST_RECORD = {
+    "$type": "app.bsky.feed.post",
+    "text": "hi #a",
+    "createdAt": "2024-01-01T00:00:00.000Z",
+    "facets": [
+        {
+            "index": {"byteStart": 3, "byteEnd": 5},
+            "features": [{"$type": "app.bsky.richtext.facet#tag", "tag": "a"}],
+        }
+    ],
+    "embed": {
+        "$type": "app.bsky.embed.images",
+        "images": [
+            {
+                "alt": "",
+                "image": {
+                    "$type": "blob",
+                    "ref": {"$link": BLOB_CID},
+                    "mimeType": "image/jpeg",
+                    "size": 70000,
+                },
+            }
+        ],
+    },
+    "reply": {
+        "root": {"uri": REPLY_URI, "cid": RECORD_CID},
+        "parent": {"uri": REPLY_URI, "cid": RECORD_CID},
+    },
+}
+
+# POST_RECORD written out by hand following the DAG-CBOR rules: map keys sorted by
+# length then bytewise, integers and lengths in their shortest form, and links as
+# tag 42 holding the binary CID after a zero byte
+STRONG_REF = [
+    "a2",
+    "63" + b"cid".hex(),
+    "783b" + RECORD_CID.encode().hex(),
+    "63" + b"uri".hex(),
+    "7829" + REPLY_URI.encode().hex(),
+]
+POST_RECORD_DAG_CBOR = bytes.fromhex(
+    "".join(
+        [
+            "a6",
+            "64" + b"text".hex(),
+            "65" + b"hi #a".hex(),
+            "65" + b"$type".hex(),
+            "72" + b"app.bsky.feed.post".hex(),
+            "65" + b"embed".hex(),
+            "a2",
+            "65" + b"$type".hex(),
+            "75" + b"app.bsky.embed.images".hex(),
+            "66" + b"images".hex(),
+            "81",
+            "a2",
+            "63" + b"alt".hex(),
+            "60",
+            "65" + b"image".hex(),
+            "a4",
+            "63" + b"ref".hex(),
+            "d82a" + "5825" + "00" + "01551220" + EMPTY_DIGEST.hex(),
+            "64" + b"size".hex(),
+            "1a00011170",
+            "65" + b"$type".hex(),
+            "64" + b"blob".hex(),
+            "68" + b"mimeType".hex(),
+            "6a" + b"image/jpeg".hex(),
+            "65" + b"reply".hex(),
+            "a2",
+            "64" + b"root".hex(),
+            *STRONG_REF,
+            "66" + b"parent".hex(),
+            *STRONG_REF,
+            "66" + b"facets".hex(),
+            "81",
+            "a2",
+            "65" + b"index".hex(),
+            "a2",
+            "67" + b"byteEnd".hex(),
+            "05",
+            "69" + b"byteStart".hex(),
+            "03",
+            "68" + b"features".hex(),
+            "81",
+            "a2",
+            "63" + b"tag".hex(),
+            "61" + b"a".hex(),
+            "65" + b"$type".hex(),
+            "781b" + b"app.bsky.richtext.facet#tag".hex(),
+            "69" + b"createdAt".hex(),
+            "7818" + b"2024-01-01T00:00:00.000Z".hex(),
+        ]
+    )
+)
+
+
+class RecordCidTests(SimpleTestCase):
+    def test_post_record_encoding(self):
+        self.assertEqual(
+            encode(from_json(POST_RECORD)).hex(), POST_RECORD_DAG_CBOR.hex()
+        )
+
+    def test_expected_encoding_decodes_to_post_record(self):
+        # Guards the hand-written bytes: decoded independently they are the record,
+        # with the link decoded to its CID
+        decoded = libipld.decode_dag_cbor(POST_RECORD_DAG_CBOR)
+        record = json.loads(json.dumps(POST_RECORD))
+        record["embed"]["images"][0]["image"]["ref"] = BLOB_CID
+        self.assertEqual(decoded, record)
+
+    def test_post_record_cid(self):
+        digest = hashlib.sha256(POST_RECORD_DAG_CBOR).digest()
+        expected = libipld.encode_multibase("b", bytes([1, 0x71, 0x12, 32]) + digest)
+
+        cid = record_cid(POST_RECORD)
+
+        self.assertEqual(cid, expected)
+        self.assertEqual(
+            libipld.decode_cid(cid),
+            {
+                "version": 1,
+                "codec": 0x71,
+                "hash": {"code": 0x12, "size": 32, "digest": digest},
+            },
+        )
+
+    def test_integer_widths(self):
+        for value, head in (
+            (0, "00"),
+            (23, "17"),
+            (24, "1818"),
+            (255, "18ff"),
+            (256, "190100"),
+            (65535, "19ffff"),
+            (65536, "1a00010000"),
+            (2**32, "1b0000000100000000"),
+            (-1, "20"),
+            (-25, "3818"),
+        ):
+            with self.subTest(value=value):
+                self.assertEqual(encode(value).hex(), head)
+
+
+class TidTests(SimpleTestCase):
+    def assert_increasing(self, tids):
+        self.assertEqual(len(set(tids)), len(tids))
+        self.assertEqual(sorted(tids), tids)
+        for tid in tids:
+            self.assertEqual(len(tid), TID_LENGTH)
+            self.assertLessEqual(set(tid), set(S32_ALPHABET))
+
+    def test_tids_are_unique_and_increasing(self):
+        tids = []
+        for count in (1, 5, 1000, 1, 200):
+            tids += generate_tids(count)
+        self.assert_increasing(tids)
+
+    def test_clock_going_backwards(self):
+        first = generate_tids(3)
+        with mock.patch("schedule_client.utils.tid.time.time_ns", return_value=0):
+            second = generate_tids(3)
+        self.assert_increasing(first + second)
+
+    def test_threads_never_share_a_tid(self):
+        batches = []
+        barrier = Barrier(8)
+
+        def generate():
+            barrier.wait()
+            for _ in range(50):
+                batches.append(generate_tids(10))
+
+        threads = [Thread(target=generate) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        tids = [tid for batch in batches for tid in batch]
+        self.assertEqual(len(set(tids)), 8 * 50 * 10)
+        for batch in batches:
+            self.assert_increasing(batch)
+        # Each batch takes a range of timestamps no other batch overlaps
+        self.assert_increasing([tid for batch in sorted(batches) for tid in batch])
+
+    def test_encoding_sorts_by_timestamp(self):
+        self.assertEqual(encode_tid(0, 0), "2" * TID_LENGTH)
+        self.assertLess(encode_tid(1, 1023), encode_tid(2, 0))
+
+
+class TokenBucketTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 1_000_000.0
+        self.bucket = TokenBucket(3000, timedelta(minutes=5))
+
+    def test_adopts_ratelimit_headers(self):
+        self.bucket.update(
+            {
+                "ratelimit-limit": "100",
+                "ratelimit-remaining": "10",
+                "ratelimit-reset": str(self.now + 60),
+                "ratelimit-policy": "100;w=60",
+            },
+            self.now,
+        )
+
+        self.assertEqual(self.bucket.capacity, 100)
+        self.assertEqual(self.bucket.window_seconds, 60)
+        self.assertEqual(self.bucket.tokens, 10)
+        self.assertEqual(self.bucket.wait_time(10, self.now), 0)
+        # Refilled at 100 per minute
+        self.assertAlmostEqual(self.bucket.wait_time(20, self.now), 6)
+
+    def test_exhausted_limit_waits_for_reset(self):
+        self.bucket.update(
+            {
+                "ratelimit-limit": "100",
+                "ratelimit-remaining": "0",
+                "ratelimit-reset": str(self.now + 120),
+            },
+            self.now,
+        )
+
+        self.assertEqual(self.bucket.wait_time(1, self.now), 120)
+
+    def test_missing_or_invalid_headers_are_ignored(self):
+        for headers in (
+            {},
+            {"ratelimit-limit": "100", "ratelimit-remaining": "10"},
+            {
+                "ratelimit-limit": "many",
+                "ratelimit-remaining": "10",
+                "ratelimit-reset": str(self.now),
+            },
+        ):
+            with self.subTest(headers=headers):
+                self.bucket.update(headers, self.now)
+                self.assertEqual(self.bucket.capacity, 3000)
+                self.assertEqual(self.bucket.tokens, 3000)
+
+    def test_invalid_policy_window_is_ignored(self):
+        self.bucket.update(
+            {
+                "ratelimit-limit": "100",
+                "ratelimit-remaining": "100",
+                "ratelimit-reset": str(self.now + 60),
+                "ratelimit-policy": "100;w=soon",
+            },
+            self.now,
+        )
+
+        self.assertEqual(self.bucket.capacity, 100)
+        self.assertEqual(self.bucket.window_seconds, 300)
+
+
+class RetryPolicyTests(SimpleTestCase):
+    def test_transient_errors(self):
+        def status_error(status_code: int) -> RequestErrorBase:
+            return RequestErrorBase(
+                Response(
+                    success=False, status_code=status_code, content=None, headers={}
+                )
+            )
+
+        def s3_error(status_code: int) -> ClientError:
+            return ClientError(
+                {"ResponseMetadata": {"HTTPStatusCode": status_code}}, "GetObject"
+            )
+
+        def video_error(status_code: int) -> httpx.HTTPStatusError:
+            request = httpx.Request("POST", "https://video.test")
+            return httpx.HTTPStatusError(
+                "Video service error",
+                request=request,
+                response=httpx.Response(status_code, request=request),
+            )
+
+        for err, transient in (
+            (UnauthorizedError(None), True),
+            (bad_request("InvalidRequest"), False),
+            (RequestErrorBase(None), True),
+            (status_error(429), True),
+            (status_error(503), True),
+            (status_error(501), False),
+            (status_error(404), False),
+            (s3_error(500), True),
+            (s3_error(403), False),
+            (video_error(502), True),
+            (video_error(413), False),
+            (ConnectionError(), True),
+            (TimeoutError(), True),
+            (ValueError(), False),
+        ):
+            with self.subTest(err=err):
+                self.assertIs(is_transient(err), transient)
+
+    def test_backoff_doubles_with_jitter(self):
+        for attempt_count in (1, 2, 3):
+            delay = RETRY_BASE_DELAY * 2 ** (attempt_count - 1)
+            with self.subTest(attempt_count=attempt_count):
+                before = timezone.now()
+                retry_at = next_attempt_at(attempt_count, ConnectionError())
+                self.assertGreaterEqual(retry_at, before + delay * 0.5)
+                self.assertLessEqual(retry_at, timezone.now() + delay)
+
+    @mock.patch("schedule_client.utils.retry_policy.RETRY_MAX_ATTEMPTS", 20)
+    def test_backoff_is_capped(self):
+        retry_at = next_attempt_at(19, ConnectionError())
+
+        self.assertLessEqual(retry_at, timezone.now() + RETRY_MAX_DELAY)
+
+    def test_no_retry_after_the_last_attempt(self):
+        self.assertIsNone(next_attempt_at(RETRY_MAX_ATTEMPTS, ConnectionError()))
+
+    def test_no_retry_of_permanent_errors(self):
+        self.assertIsNone(next_attempt_at(1, bad_request("InvalidRequest")))
+
+
+class SessionManagerTests(TestCase):
+    def setUp(self):
+        self.config = Config.objects.create(bluesky_username="session.test")
+        self.session_manager = SessionManager()
+        patcher = mock.patch(
+            "schedule_client.utils.session_manager.Client",
+            side_effect=self.new_client,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.clients = []
+        self.rejected_logins = 0
+
+    def new_client(self, base_url: str) -> mock.Mock:
+        client = mock.Mock()
+        if len(self.clients) < self.rejected_logins:
+            client.login.side_effect = UnauthorizedError(None)
+        client._access_jwt_payload.exp = (
+            timezone.now() + timedelta(hours=2)
+        ).timestamp()
+        client.export_session_string.return_value = f"session {len(self.clients)}"
+        self.clients.append(client)
+        return client
+
+    def get_client(self):
+        return self.session_manager.get_client("session.test", "password")
+
+    def test_stored_session_is_resumed(self):
+        Config.objects.filter(pk=self.config.pk).update(session_string="stored")
+
+        client = self.get_client()
+
+        client.login.assert_called_once_with(session_string="stored")
+        self.assertEqual(self.session_manager.stats["logins"], 0)
+
+    def test_rejected_session_falls_back_to_login(self):
+        Config.objects.filter(pk=self.config.pk).update(session_string="expired")
+        self.rejected_logins = 1
+
+        client = self.get_client()
+
+        client.login.assert_called_once_with("session.test", "password")
+        self.assertEqual(self.session_manager.stats["logins"], 1)
+        self.config.refresh_from_db()
+        self.assertEqual(self.config.session_string, "session 1")
+
+    def test_cached_client_is_reused(self):
+        client = self.get_client()
+
+        self.assertIs(self.get_client(), client)
+        self.assertEqual(len(self.clients), 1)
+        self.assertEqual(self.session_manager.stats["hits"], 1)
+
+
+def blob_ref(number: int) -> BlobRef:
+    return BlobRef(
+        mime_type="image/jpeg",
+        size=number,
+        ref={"$link": f"bafkreiblob{number}"},
+    )
+
+
+class BlobRefCacheTests(SimpleTestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.cache_dir = os.path.join(temp_dir.name, "media_cache")
+        self.cache = MediaCache(self.cache_dir, 1024 * 1024)
+        patcher = mock.patch("schedule_client.utils.publishing.media_cache", self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.publisher = Publisher("blobs.test", mock.Mock())
+        self.media = self.cache.put_media("image.jpg", "etag", [b"image"])
+        self.addCleanup(self.media.file.close)
+
+    def prepare(self, post_id: int):
+        post = PostObject(id=post_id)
+        self.publisher.thread_blobs[post_id] = [(self.media.content_hash, blob_ref(1))]
+        return [(post, None, None)]
+
+    def test_cache_dir_is_created_on_first_write(self):
+        cache_dir = os.path.join(self.cache_dir, "lazy")
+        cache = MediaCache(cache_dir, 1024 * 1024)
+        self.assertFalse(os.path.exists(cache_dir))
+
+        cache.put_media("image.jpg", "etag", [b"image"]).file.close()
+        self.assertTrue(os.path.exists(cache.index_path))
+
+    def test_blob_refs_are_cached_once_written(self):
+        thread = self.prepare(1)
+        self.assertIsNone(self.cache.get_blob_ref("blobs.test", self.media))
+
+        self.publisher._set_written([thread], [(1, "cid", "uri")])
+
+        self.assertEqual(self.cache.get_blob_ref("blobs.test", self.media), blob_ref(1))
+        self.assertEqual(self.publisher.thread_blobs, {})
+
+    def test_deferred_thread_caches_no_blob_refs(self):
+        thread = self.prepare(1)
+
+        self.publisher._defer_threads([thread], timezone.now())
+
+        self.assertIsNone(self.cache.get_blob_ref("blobs.test", self.media))
+        self.assertEqual(self.publisher.thread_blobs, {})
+
+    def test_failed_write_drops_reused_blob_refs(self):
+        self.cache.put_blob_refs("blobs.test", [(self.media.content_hash, blob_ref(1))])
+        thread = self.prepare(1)
+
+        self.publisher._fail_post(thread[0][0], bad_request("InvalidRequest"))
+
+        self.assertIsNone(self.cache.get_blob_ref("blobs.test", self.media))
+        self.assertEqual(self.publisher.thread_blobs, {})
+
+
+class SharedMediaCacheTests(SimpleTestCase):
+    """Two processes sharing a cache directory, each with its own MediaCache"""
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.cache_dir = temp_dir.name
+
+    def put(self, cache: MediaCache, s3_key: str, body: bytes) -> str:
+        media = cache.put_media(s3_key, "etag", [body])
+        media.file.close()
+        return media.content_hash
+
+    def test_entries_of_other_processes_are_kept(self):
+        first = MediaCache(self.cache_dir, 1024)
+        second = MediaCache(self.cache_dir, 1024)
+
+        self.put(first, "first.jpg", b"first")
+        content_hash = self.put(second, "second.jpg", b"second")
+        second.put_blob_refs("shared.test", [(content_hash, blob_ref(1))])
+        self.put(first, "third.jpg", b"third")
+
+        index = MediaCache(self.cache_dir, 1024)
+        self.assertCountEqual(index.objects, ["first.jpg", "second.jpg", "third.jpg"])
+        self.assertIn(f"shared.test:{content_hash}", index.blob_refs)
+        self.assertEqual(first.get_etag("second.jpg"), "etag")
+
+    def test_eviction_counts_files_of_every_process(self):
+        first = MediaCache(self.cache_dir, 10)
+        second = MediaCache(self.cache_dir, 10)
+
+        evicted_hash = self.put(first, "first.jpg", b"first")
+        self.put(second, "second.jpg", b"other")
+        self.put(first, "third.jpg", b"third")
+
+        self.assertEqual(MediaCache(self.cache_dir, 10).total_bytes, 10)
+        self.assertIsNone(second.get_etag("first.jpg"))
+        self.assertFalse(os.path.exists(first._file_path(evicted_hash)))
+
+
+class VideoUploadTests(TestCase):
+    """Videos streamed from a local S3 bucket to a local video service"""
+
+    username = "video.test"
+    video_size = 3 * 1024 * 1024
+
+    def setUp(self):
+        self.pds = FakePDS()
+        self.s3 = FakeS3("videos", self.video_size)
+        self.video_service = FakeVideoService(polls=2)
+        for service in (self.pds, self.s3, self.video_service):
+            service.start()
+            self.addCleanup(service.stop)
+
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.cache = MediaCache(
+            os.path.join(temp_dir.name, "media_cache"), 2 * self.video_size
+        )
+
+        patchers = [
+            mock.patch.dict(
+                os.environ,
+                {
+                    "AWS_BUCKET_NAME": "videos",
+                    "AWS_ACCESS_KEY": "test",
+                    "AWS_SECRET_ACCESS_KEY": "test",
+                    "AWS_S3_ENDPOINT_URL": self.s3.url,
+                },
+            ),
+            mock.patch(
+                "schedule_client.utils.session_manager.BLUESKY_PDS_URL", self.pds.url
+            ),
+            mock.patch(
+                "schedule_client.utils.atproto_client.VIDEO_SERVICE_URL",
+                self.video_service.url,
+            ),
+            mock.patch(
+                "schedule_client.utils.async_atproto_client.BLUESKY_PDS_URL",
+                self.pds.url,
+            ),
+            mock.patch(
+                "schedule_client.utils.async_atproto_client.VIDEO_SERVICE_URL",
+                self.video_service.url,
+            ),
+            mock.patch(
+                "schedule_client.utils.publishing.VIDEO_POLL_INTERVAL", timedelta()
+            ),
+            # The service DID of the PDS is otherwise resolved from the PLC directory
+            mock.patch.dict(
+                "schedule_client.utils.video._pds_service_dids",
+                {FakePDS.did(self.username): "did:web:127.0.0.1"},
+            ),
+        ]
+        for module in ("publishing", "s3"):
+            patchers.append(
+                mock.patch(f"schedule_client.utils.{module}.media_cache", self.cache)
+            )
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.client = AtprotoClient(self.username, "password", PostClient())
+        self.addCleanup(session_manager.invalidate, self.username)
+        self.addCleanup(self.client.close)
+
+    def upload_video(self, video_path: str, blobs: list) -> dict:
+        return self.client._run(self.client._upload_video(video_path, "A clip", blobs))
+
+    def upload_video_async(self, video_path: str, blobs: list) -> dict:
+        async def upload() -> dict:
+            image_client = ImageClient()
+            client = AsyncAtprotoClient(
+                self.username,
+                self.client.client.export_session_string(),
+                PostClient(),
+                image_client,
+                asyncio.Semaphore(1),
+            )
+            try:
+                return await client._run(
+                    client._upload_video(video_path, "A clip", blobs)
+                )
+            finally:
+                await client.client.request.close()
+                image_client.close()
+
+        return asyncio.run(upload())
+
+    def test_video_is_uploaded_through_a_processing_job(self):
+        blobs = []
+        embed = self.upload_video("clip.mp4", blobs)
+
+        self.assertEqual(embed["$type"], "app.bsky.embed.video")
+        self.assertEqual(embed["alt"], "A clip")
+        self.assertEqual(embed["video"]["size"], self.video_size)
+        self.assertEqual(embed["video"]["mimeType"], "video/mp4")
+        self.assertEqual(self.video_service.stats["blob_bytes"], self.video_size)
+        self.assertEqual(self.pds.stats[GET_SERVICE_AUTH_NSID], 1)
+        self.assertEqual(self.video_service.stats[GET_JOB_STATUS_NSID], 2)
+        self.assertEqual(len(blobs), 1)
+
+    def test_cached_blob_ref_skips_the_upload(self):
+        blobs = []
+        self.upload_video("clip.mp4", blobs)
+        self.cache.put_blob_refs(self.username, blobs)
+
+        embed = self.upload_video("clip.mp4", [])
+
+        self.assertEqual(embed["video"]["size"], self.video_size)
+        self.assertEqual(self.video_service.stats[UPLOAD_VIDEO_NSID], 1)
+
+    def test_failed_processing_raises(self):
+        with self.assertRaisesMessage(VideoProcessingFailed, "Unsupported video"):
+            self.upload_video("invalid.mp4", [])
+
+    def test_async_engine_uploads_the_same_video(self):
+        blobs = []
+        embed = self.upload_video_async("clip.mp4", blobs)
+
+        self.assertEqual(embed, self.upload_video("clip.mp4", []))
+        self.assertEqual(self.video_service.stats[GET_JOB_STATUS_NSID], 4)
+        self.assertEqual(len(blobs), 1)
+
+
+# Pieces of fuzzed post text: links, mentions, hashtags, punctuation, whitespace and
+# characters of one to four UTF-8 bytes
+FUZZ_PIECES = (
+    "https://",
+    "http://",
+    "example.com",
+    "bsky.app",
+    "/path?q=1#top",
+    ":8080",
+    "@",
+    "@alice.test",
+    "#",
+    "＃",
+    ".",
+    "-",
+    "(",
+    ")",
+    ",",
+    "!",
+    "a",
+    "z9",
+    "é",
+    "日本",
+    "\U0001f600",
+    "\U0001f1eb\U0001f1f7",
+    "\u200d",
+    " ",
+    "\n",
+    "\t",
+)
+
+
+class FacetTests(SimpleTestCase):
+    def assert_facets_match_text(self, text: str, aggressive: bool):
+        encoded = text.encode()
+        end = 0
+        for facet in extract_facets(text, aggressive=aggressive):
+            self.assertLessEqual(end, facet.byte_start)
+            self.assertLess(facet.byte_start, facet.byte_end)
+            end = facet.byte_end
+
+            # Offsets are UTF-8 byte offsets of the facet's own text
+            covered = encoded[facet.byte_start : facet.byte_end].decode()
+            if facet.kind == "link":
+                self.assertIn(facet.value, (covered, f"https://{covered}"))
+            else:
+                self.assertEqual(covered[1:], facet.value)
+                self.assertIn(covered[0], "@#＃")
+
+    def test_byte_offsets_after_multibyte_characters(self):
+        text = "日本 \U0001f600 é @alice.bsky.social #tag https://example.com/é"
+        facets = extract_facets(text, aggressive=False)
+
+        self.assertEqual(
+            [(facet.kind, facet.value) for facet in facets],
+            [
+                ("mention", "alice.bsky.social"),
+                ("tag", "tag"),
+                ("link", "https://example.com/é"),
+            ],
+        )
+        self.assert_facets_match_text(text, aggressive=False)
+
+    def test_fuzzed_text(self):
+        fuzz = random.Random(0)
+        for _ in range(2000):
+            text = "".join(fuzz.choices(FUZZ_PIECES, k=fuzz.randint(1, 60)))
+            for aggressive in (False, True):
+                with self.subTest(text=text, aggressive=aggressive):
+                    self.assert_facets_match_text(text, aggressive)
+
+    def test_adversarial_text(self):
+        # Inputs that made the nested quantifiers of the former URL pattern
+        # backtrack catastrophically
+        for text in (
+            "a." * 50000,
+            "a-" * 50000,
+            "http://" + "a." * 50000 + "!",
+            "@" + "a-." * 30000,
+            "#" * 100000,
+            "(" * 50000 + "https://example.com" + ")" * 50000,
+            "https://example.com/" + ")" * 100000,
+            "#tag" + "!" * 100000,
+            "é." * 50000 + "com",
+        ):
+            with self.subTest(text=text[:20]):
+                self.assert_facets_match_text(text, aggressive=True)
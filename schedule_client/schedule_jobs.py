@@ -1,7 +1,12 @@
+import asyncio
+
+from atproto_scheduler.settings import MEDIA_PREFETCH_HORIZON, PUBLISH_ENGINE
 from posts.models import Post
 from schedule_client.utils.atproto_client import AtprotoClient
 from schedule_client.utils.data_models import AccountObject
 from schedule_client.utils.django_client import PostClient, ConfigClient
+from schedule_client.utils.s3 import ImageClient
+from schedule_client.utils.session_manager import session_manager
 
 
 def schedule_and_post() -> None:
@@ -13,10 +18,29 @@ def schedule_and_post() -> None:
 
     if not config.is_placeholder:
         post_client = PostClient()
-        post_client.clear_past_scheduled_times()
+        # Apply results left over from an interrupted tick before fetching due posts
+        post_client.flush_post_results()
+        post_client.catch_up_missed_posts(config.accounts)
+
+        retry_backlog = post_client.get_retry_backlog()
+        if retry_backlog:
+            print(f"Retry backlog: {retry_backlog} posts waiting for another attempt")
 
-        for account in config.accounts:
-            handle_account_posts(post_client, account)
+        accounts_with_work = post_client.get_accounts_with_work()
+        accounts = [
+            account
+            for account in config.accounts
+            if account.bluesky_username in accounts_with_work
+        ]
+
+        try:
+            if PUBLISH_ENGINE == "async":
+                handle_accounts_async(post_client, accounts)
+            else:
+                for account in accounts:
+                    handle_account_posts(post_client, account)
+        finally:
+            post_client.flush_post_results()
 
 
 def handle_account_posts(post_client: PostClient, account: AccountObject) -> None:
@@ -26,20 +50,106 @@ def handle_account_posts(post_client: PostClient, account: AccountObject) -> Non
         post_client (PostClient): Object for interacting with the Posts table
         account (AccountObject): Account details
     """
-    if account.allow_posts:
-        try:
-            post_client.schedule_unscheduled_posts(account)
-            scheduled_posts = post_client.get_scheduled_posts(account)
-        except Exception as e:
-            print(e)
-            raise
-
-        if scheduled_posts:
-            atproto_client = AtprotoClient(
-                account.bluesky_username, account.bluesky_password
+    if not account.allow_posts:
+        return
+
+    try:
+        post_client.schedule_unscheduled_posts(account)
+    except Exception as e:
+        print(e)
+        raise
+
+    # Logged in before any post is claimed, claims of an account that cannot log in
+    # would only hold its posts until their lease expires
+    atproto_client = AtprotoClient(
+        account.bluesky_username, account.bluesky_password, post_client
+    )
+    if not atproto_client.is_valid_login:
+        return
+
+    try:
+        # Due posts are claimed and published a chunk at a time to bound memory
+        for scheduled_posts in post_client.iter_scheduled_posts(account):
+            atproto_client.post_batch(scheduled_posts)
+            post_client.flush_post_results()
+    finally:
+        atproto_client.close()
+
+
+def handle_accounts_async(
+    post_client: PostClient, accounts: list[AccountObject]
+) -> None:
+    """Schedule posts for all accounts, then publish their due posts concurrently.
+    Due posts are claimed a chunk per account at a time, each round of chunks is
+    published concurrently and its results applied before the next round is claimed.
+
+    Args:
+        post_client (PostClient): Object for interacting with the Posts table
+        accounts (list[AccountObject]): Account details
+    """
+    account_chunks = []
+    for account in accounts:
+        if not account.allow_posts:
+            continue
+
+        post_client.schedule_unscheduled_posts(account)
+        account_chunks.append((account, post_client.iter_scheduled_posts(account)))
+
+    while account_chunks:
+        account_posts = []
+        for account, chunks in list(account_chunks):
+            # Logged in before the chunk is claimed, so a failed login leaves the
+            # account's posts unclaimed
+            try:
+                client = session_manager.get_client(
+                    account.bluesky_username, account.bluesky_password
+                )
+            except Exception as err:
+                print(f"Error logging into Bluesky account {account.bluesky_username}.")
+                print(err)
+                account_chunks.remove((account, chunks))
+                continue
+
+            scheduled_posts = next(chunks, None)
+            if scheduled_posts is None:
+                account_chunks.remove((account, chunks))
+                continue
+
+            account_posts.append(
+                (
+                    account.bluesky_username,
+                    client.export_session_string(),
+                    scheduled_posts,
+                )
+            )
+
+        if account_posts:
+            # Imported here so the sync engine does not load the asyncio client
+            from schedule_client.utils.async_atproto_client import post_accounts
+
+            asyncio.run(post_accounts(post_client, account_posts))
+            post_client.flush_post_results()
+
+
+def prefetch_media() -> None:
+    """Stage images of posts due within MEDIA_PREFETCH_HORIZON and flag missing ones"""
+    post_client = PostClient()
+    upcoming_posts = post_client.get_upcoming_image_posts(MEDIA_PREFETCH_HORIZON)
+
+    if not upcoming_posts:
+        return
+
+    image_client = ImageClient()
+    for post_id, images in upcoming_posts:
+        missing_images = [
+            image for image in images if not image_client.stage_image_object(image)
+        ]
+
+        if missing_images:
+            print(f"Missing images for post {post_id}: {missing_images}")
+            post_client.set_media_error(
+                post_id, f"Missing images: {', '.join(missing_images)}"[:300]
             )
-            if atproto_client.is_valid_login:
-                for scheduled_post in scheduled_posts:
-                    print(f"Posting: {scheduled_post.__str__}")
-                    atproto_client.post_to_account(scheduled_post)
-            del atproto_client
+        else:
+            post_client.set_media_error(post_id, None)
+    image_client.close()
@@ -1,10 +1,84 @@
+from datetime import datetime
+from threading import Lock
+
 from apscheduler.schedulers.background import BackgroundScheduler
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
+
+from atproto_scheduler.settings import (
+    MEDIA_PREFETCH_INTERVAL,
+    NEXT_DUE_LEAD,
+    SCHEDULER_INTERVAL,
+    SCHEDULER_MODE,
+    SCHEDULER_SAFETY_INTERVAL,
+)
+from posts.models import Config, Post
+from schedule_client.schedule_jobs import prefetch_media, schedule_and_post
+from schedule_client.utils.django_client import PostClient
 
-from atproto_scheduler.settings import SCHEDULER_INTERVAL
-from schedule_client.schedule_jobs import schedule_and_post
+scheduler = BackgroundScheduler()
+tick_lock = Lock()
 
 
 def start():
-    scheduler = BackgroundScheduler()
-    scheduler.add_job(schedule_and_post, "interval", seconds=SCHEDULER_INTERVAL.seconds)
+    if SCHEDULER_MODE == "next_due":
+        scheduler.add_job(
+            run_and_rearm,
+            "interval",
+            seconds=SCHEDULER_SAFETY_INTERVAL.seconds,
+            id="safety_net",
+        )
+        for sender in (Post, Config):
+            post_save.connect(on_schedule_change, sender=sender)
+            post_delete.connect(on_schedule_change, sender=sender)
+        scheduler.add_job(run_and_rearm, id="next_due", misfire_grace_time=None)
+    else:
+        scheduler.add_job(
+            schedule_and_post, "interval", seconds=SCHEDULER_INTERVAL.seconds
+        )
+
+    scheduler.add_job(
+        prefetch_media, "interval", seconds=MEDIA_PREFETCH_INTERVAL.total_seconds()
+    )
     scheduler.start()
+
+
+def run_and_rearm() -> None:
+    """Run the scheduled operations, then wait for the next pending post.
+    If the run fails, the safety net poll retries it."""
+    with tick_lock:
+        schedule_and_post()
+    # Posts still pending right after a run could not be handled by it, so wait
+    # at least NEXT_DUE_LEAD instead of retrying them in a busy loop
+    arm_next_due(not_before=timezone.now() + NEXT_DUE_LEAD)
+
+
+def arm_next_due(not_before: datetime | None = None) -> None:
+    """Replace the wakeup job with one firing just before the next pending post
+
+    Args:
+        not_before (datetime | None): Earliest time the job may fire, defaults to now
+    """
+    next_due = PostClient().get_next_due_time()
+
+    if next_due is None:
+        if scheduler.get_job("next_due"):
+            scheduler.remove_job("next_due")
+        return
+
+    # Wake up slightly early since posts are only picked up while still in the future
+    run_date = max(next_due - NEXT_DUE_LEAD, not_before or timezone.now())
+    scheduler.add_job(
+        run_and_rearm,
+        "date",
+        run_date=run_date,
+        id="next_due",
+        replace_existing=True,
+        misfire_grace_time=None,
+    )
+
+
+def on_schedule_change(**kwargs) -> None:
+    """Re-arm the wakeup job once a Post or Config change is committed"""
+    transaction.on_commit(arm_next_due)
@@ -0,0 +1,230 @@
+import asyncio
+from datetime import timedelta
+import typing as t
+
+from atproto import AsyncClient, models
+import httpx
+
+from atproto_scheduler.settings import (
+    BLUESKY_PDS_URL,
+    MEDIA_CHUNK_SIZE,
+    MEDIA_UPLOAD_TIMEOUT,
+    PUBLISH_CONCURRENCY,
+    PUBLISH_REQUEST_TIMEOUT,
+    VIDEO_SERVICE_URL,
+)
+from schedule_client.utils.data_models import PostObject
+from schedule_client.utils.django_client import PostClient
+from schedule_client.utils.media_cache import MediaFile
+from schedule_client.utils.publishing import Publisher, Steps
+from schedule_client.utils.rate_limiter import rate_limiter
+from schedule_client.utils.s3 import ImageClient
+from schedule_client.utils.session_manager import session_manager
+from schedule_client.utils.video import (
+    GET_JOB_STATUS_NSID,
+    GET_SERVICE_AUTH_NSID,
+    UPLOAD_VIDEO_NSID,
+    service_auth_params,
+    upload_video_headers,
+)
+
+
+class AsyncAtprotoClient(Publisher):
+    """asyncio client for publishing the due posts of one account.
+
+    All network requests share a semaphore so the number of requests in flight across
+    every account is capped, and each request is bounded by PUBLISH_REQUEST_TIMEOUT.
+    """
+
+    def __init__(
+        self,
+        bluesky_username: str,
+        session_string: str,
+        post_client: PostClient,
+        image_client: ImageClient,
+        semaphore: asyncio.Semaphore,
+    ):
+        super().__init__(bluesky_username, post_client)
+        self.image_client = image_client
+        self.semaphore = semaphore
+
+        # The session was created or refreshed by session_manager, importing it
+        # needs no request
+        self.client = AsyncClient(f"{BLUESKY_PDS_URL}/xrpc")
+        self.did = self.client._import_session_string(session_string).did
+        rate_limiter.watch(self.client, self.bluesky_username)
+
+    async def post_in_order(self, posts: t.List[PostObject]) -> None:
+        """Publish posts, each together with its thread replies, in the order they were
+        scheduled. The threads are written in as few applyWrites calls as possible.
+
+        Args:
+            posts (list[PostObject]): Due posts of this account
+        """
+        try:
+            await self._run(self._publish(posts))
+        finally:
+            await self.client.request.close()
+
+    async def _run(self, steps: Steps) -> t.Any:
+        """Await the requests of shared publishing logic one at a time
+
+        Returns:
+            Any: The outcome of the steps
+        """
+        result = err = None
+        while True:
+            try:
+                method, *args = steps.throw(err) if err else steps.send(result)
+            except StopIteration as stop:
+                return stop.value
+
+            try:
+                result, err = await method(*args), None
+            except Exception as step_err:
+                result, err = None, step_err
+
+    async def _request(
+        self, coroutine: t.Awaitable, timeout: timedelta = PUBLISH_REQUEST_TIMEOUT
+    ) -> t.Any:
+        """Await a request under the global concurrency cap and request timeout"""
+        async with self.semaphore:
+            return await asyncio.wait_for(coroutine, timeout.total_seconds())
+
+    async def _get_record(
+        self, params: models.ComAtprotoRepoGetRecord.Params
+    ) -> models.ComAtprotoRepoGetRecord.Response:
+        return await self._request(self.client.com.atproto.repo.get_record(params))
+
+    async def _send_writes(
+        self, writes: t.List[models.ComAtprotoRepoApplyWrites.Create]
+    ) -> None:
+        await rate_limiter.call_async(
+            rate_limiter.apply_writes_limits(
+                self.client, self.bluesky_username, len(writes)
+            ),
+            lambda: self._request(
+                self.client.com.atproto.repo.apply_writes(
+                    models.ComAtprotoRepoApplyWrites.Data(repo=self.did, writes=writes)
+                )
+            ),
+        )
+
+    async def _get_image_object(self, image_path: str) -> MediaFile:
+        return await asyncio.wait_for(
+            asyncio.to_thread(
+                self.image_client.get_image_object, image_path, raise_errors=True
+            ),
+            PUBLISH_REQUEST_TIMEOUT.total_seconds(),
+        )
+
+    async def _get_video_object(self, video_path: str) -> MediaFile:
+        return await asyncio.wait_for(
+            asyncio.to_thread(
+                self.image_client.get_video_object, video_path, raise_errors=True
+            ),
+            MEDIA_UPLOAD_TIMEOUT.total_seconds(),
+        )
+
+    async def _upload_blob(self, media: MediaFile) -> t.Any:
+        # The file is streamed, not read into memory
+        upload = await rate_limiter.call_async(
+            rate_limiter.upload_blob_limits(self.client),
+            lambda: self._request(
+                self.client.com.atproto.repo.upload_blob(
+                    read_chunks(media), headers={"Content-Length": str(media.size)}
+                ),
+                MEDIA_UPLOAD_TIMEOUT,
+            ),
+        )
+        return upload.blob
+
+    async def _get_service_auth_token(self) -> str:
+        params = await asyncio.to_thread(service_auth_params, self.did)
+        response = await rate_limiter.call_async(
+            rate_limiter.upload_blob_limits(self.client),
+            lambda: self._request(
+                self.client.request.get(
+                    url=f"{self.client._base_url}/{GET_SERVICE_AUTH_NSID}",
+                    params=params,
+                )
+            ),
+        )
+        return response.content["token"]
+
+    async def _send_video(
+        self, video_path: str, video: MediaFile, token: str
+    ) -> httpx.Response:
+        async with httpx.AsyncClient(
+            base_url=VIDEO_SERVICE_URL, timeout=MEDIA_UPLOAD_TIMEOUT.total_seconds()
+        ) as video_client:
+            return await self._request(
+                video_client.post(
+                    f"/xrpc/{UPLOAD_VIDEO_NSID}",
+                    params={"did": self.did, "name": video_path.rsplit("/", 1)[-1]},
+                    headers=upload_video_headers(token, video_path, video.size),
+                    content=read_chunks(video),
+                ),
+                MEDIA_UPLOAD_TIMEOUT,
+            )
+
+    async def _get_job_status(self, job_id: str) -> httpx.Response:
+        async with httpx.AsyncClient(
+            base_url=VIDEO_SERVICE_URL, timeout=MEDIA_UPLOAD_TIMEOUT.total_seconds()
+        ) as video_client:
+            return await self._request(
+                video_client.get(
+                    f"/xrpc/{GET_JOB_STATUS_NSID}", params={"jobId": job_id}
+                )
+            )
+
+    async def _sleep(self, seconds: float) -> None:
+        await asyncio.sleep(seconds)
+
+    async def _resolve_handle(self, handle: str) -> str:
+        return (await self._request(self.client.resolve_handle(handle))).did
+
+    async def _invalidate_session(self) -> None:
+        await asyncio.to_thread(session_manager.invalidate, self.bluesky_username)
+
+    async def _gather(self, steps: t.List[Steps]) -> t.List[t.Any]:
+        return await asyncio.gather(
+            *(self._run(step) for step in steps), return_exceptions=True
+        )
+
+
+async def read_chunks(media: MediaFile) -> t.AsyncIterator[bytes]:
+    """Read a media file in MEDIA_CHUNK_SIZE chunks without blocking the event loop"""
+    while chunk := await asyncio.to_thread(media.file.read, MEDIA_CHUNK_SIZE):
+        yield chunk
+
+
+async def post_accounts(
+    post_client: PostClient,
+    account_posts: t.List[t.Tuple[str, str, t.List[PostObject]]],
+) -> None:
+    """Publish the due posts of several accounts concurrently
+
+    Args:
+        post_client (PostClient): Object for interacting with the Posts table
+        account_posts (list[tuple[str, str, list[PostObject]]]): Username, session string and due posts of each account
+    """
+    # Created inside the running loop so it is bound to it
+    semaphore = asyncio.Semaphore(PUBLISH_CONCURRENCY)
+    image_client = ImageClient()
+
+    try:
+        await asyncio.gather(
+            *(
+                AsyncAtprotoClient(
+                    bluesky_username,
+                    session_string,
+                    post_client,
+                    image_client,
+                    semaphore,
+                ).post_in_order(posts)
+                for bluesky_username, session_string, posts in account_posts
+            )
+        )
+    finally:
+        image_client.close()
@@ -1,140 +1,161 @@
-import re
+from concurrent.futures import ThreadPoolExecutor
+import time
 import typing as t
 
-from atproto import Client, models
+from atproto import models
+import httpx
 
+from atproto_scheduler.settings import (
+    MEDIA_UPLOAD_TIMEOUT,
+    MEDIA_WORKERS,
+    VIDEO_SERVICE_URL,
+)
 from schedule_client.utils.django_client import PostClient
-from schedule_client.utils.data_models import PostObject, AccountObject
+from schedule_client.utils.data_models import PostObject
+from schedule_client.utils.media_cache import MediaFile
+from schedule_client.utils.publishing import Publisher, Steps
+from schedule_client.utils.rate_limiter import rate_limiter
 from schedule_client.utils.s3 import ImageClient
+from schedule_client.utils.session_manager import session_manager
+from schedule_client.utils.video import (
+    GET_JOB_STATUS_NSID,
+    GET_SERVICE_AUTH_NSID,
+    UPLOAD_VIDEO_NSID,
+    service_auth_params,
+    upload_video_headers,
+)
 
 
-class AtprotoClient:
+class AtprotoClient(Publisher):
     """Client for interacting with the at protocol"""
 
-    def __init__(self, bluesky_username: str, bluesky_password: str):
-        self.bluesky_username = bluesky_username
+    def __init__(
+        self, bluesky_username: str, bluesky_password: str, post_client: PostClient
+    ):
+        super().__init__(bluesky_username, post_client)
         self.bluesky_password = bluesky_password
+        # Created for the first post with media
+        self.image_client = None
 
         try:
-            self.client = Client()
-            self.client.login(self.bluesky_username, self.bluesky_password)
+            self.client = session_manager.get_client(
+                self.bluesky_username, self.bluesky_password
+            )
+            self.did = self.client.me.did
+            rate_limiter.watch(self.client, self.bluesky_username)
             self.is_valid_login = True
-            print("Successfully logged into Bluesky account.")
         except:
             print("Error logging into Bluesky account.")
             self.is_valid_login = False
 
-    def post_to_account(self, post: PostObject) -> bool:
-        """Posts to Bluesky
+    def post_batch(self, posts: t.List[PostObject]) -> None:
+        """Posts to Bluesky. Each post is published together with its thread replies,
+        and the threads are written in as few applyWrites calls as possible, in the
+        order they were scheduled.
 
         Args:
-            post (PostObject): Post object with all relevant values
+            posts (list[PostObject]): Due posts of this account
+        """
+        self._run(self._publish(posts))
+
+    def close(self) -> None:
+        if self.image_client:
+            self.image_client.close()
+            self.image_client = None
+
+    def _run(self, steps: Steps) -> t.Any:
+        """Send the requests of shared publishing logic one at a time
 
         Returns:
-            bool: Value indicating success of posting operation
+            Any: The outcome of the steps
         """
-        print(f"Posting to {self.bluesky_username}")
-
-        embed = None
-        facets = None
-        text = post.text
-        post_client = PostClient()
-
-        # Get hyperlinks
-        if post.links and not post.is_link_card:
-            text += "\n"
-            for link in post.links:
-                text += f"{link}\n"
-
-            url_positions = self._extract_url_byte_positions(text, aggressive=True)
-            facets = []
-
-            for link in url_positions:
-                uri = link[0] if link[0].startswith("http") else f"https://{link[0]}"
-                facets.append(
-                    models.AppBskyRichtextFacet.Main(
-                        features=[models.AppBskyRichtextFacet.Link(uri=uri)],
-                        index=models.AppBskyRichtextFacet.ByteSlice(
-                            byte_start=link[1], byte_end=link[2]
-                        ),
-                    )
-                )
-
-        # Check for images. If present, post with images.
-        if post.image_urls_with_alts:
-            images = []
-            image_client = ImageClient()
-
-            for image_with_alt in post.image_urls_with_alts:
-                image_object = image_client.get_image_object(image_with_alt["image"])
-
-                if not image_object:
-                    print(f"Error with image path: {image_with_alt['image']}")
-                    print(f"Setting {post.text} as draft.")
-                    post_client.set_post_as_draft(post.id)
-                    return False
-
-                upload = self.client.com.atproto.repo.upload_blob(image_object)
-                images.append(
-                    models.AppBskyEmbedImages.Image(
-                        alt=image_with_alt["alt_text"], image=upload.blob
-                    )
-                )
-
-            embed = models.AppBskyEmbedImages.Main(images=images)
-
-            image_client.close()
-
-        # If no images, check for single link item with a title and description. If present, post with link card.
-        elif post.is_link_card:
-            embed = models.AppBskyEmbedExternal.Main(
-                external=models.AppBskyEmbedExternal.External(
-                    title=post.link_card_title,
-                    description=post.link_card_description,
-                    uri=post.links[0],
-                )
+        result = err = None
+        while True:
+            try:
+                method, *args = steps.throw(err) if err else steps.send(result)
+            except StopIteration as stop:
+                return stop.value
+
+            try:
+                result, err = method(*args), None
+            except Exception as step_err:
+                result, err = None, step_err
+
+    def _get_record(
+        self, params: models.ComAtprotoRepoGetRecord.Params
+    ) -> models.ComAtprotoRepoGetRecord.Response:
+        return self.client.com.atproto.repo.get_record(params)
+
+    def _send_writes(
+        self, writes: t.List[models.ComAtprotoRepoApplyWrites.Create]
+    ) -> None:
+        rate_limiter.call(
+            rate_limiter.apply_writes_limits(
+                self.client, self.bluesky_username, len(writes)
+            ),
+            self.client.com.atproto.repo.apply_writes,
+            models.ComAtprotoRepoApplyWrites.Data(repo=self.did, writes=writes),
+        )
+
+    def _get_image_object(self, image_path: str) -> MediaFile:
+        return self._image_client().get_image_object(image_path, raise_errors=True)
+
+    def _get_video_object(self, video_path: str) -> MediaFile:
+        return self._image_client().get_video_object(video_path, raise_errors=True)
+
+    def _upload_blob(self, media: MediaFile) -> t.Any:
+        # The file is streamed, not read into memory
+        return rate_limiter.call(
+            rate_limiter.upload_blob_limits(self.client),
+            self.client.com.atproto.repo.upload_blob,
+            media.file,
+            headers={"Content-Length": str(media.size)},
+        ).blob
+
+    def _get_service_auth_token(self) -> str:
+        return rate_limiter.call(
+            rate_limiter.upload_blob_limits(self.client),
+            self.client.request.get,
+            url=f"{self.client._base_url}/{GET_SERVICE_AUTH_NSID}",
+            params=service_auth_params(self.did),
+        ).content["token"]
+
+    def _send_video(
+        self, video_path: str, video: MediaFile, token: str
+    ) -> httpx.Response:
+        with httpx.Client(
+            base_url=VIDEO_SERVICE_URL, timeout=MEDIA_UPLOAD_TIMEOUT.total_seconds()
+        ) as video_client:
+            return video_client.post(
+                f"/xrpc/{UPLOAD_VIDEO_NSID}",
+                params={"did": self.did, "name": video_path.rsplit("/", 1)[-1]},
+                headers=upload_video_headers(token, video_path, video.size),
+                content=video.file,
             )
 
-        try:
-            post_response = self.client.com.atproto.repo.create_record(
-                models.ComAtprotoRepoCreateRecord.Data(
-                    repo=self.client.me.did,
-                    collection=models.ids.AppBskyFeedPost,
-                    record=models.AppBskyFeedPost.Main(
-                        created_at=self.client.get_current_time_iso(),
-                        text=text,
-                        facets=facets,
-                        embed=embed,
-                    ),
-                )
+    def _get_job_status(self, job_id: str) -> httpx.Response:
+        with httpx.Client(
+            base_url=VIDEO_SERVICE_URL, timeout=MEDIA_UPLOAD_TIMEOUT.total_seconds()
+        ) as video_client:
+            return video_client.get(
+                f"/xrpc/{GET_JOB_STATUS_NSID}", params={"jobId": job_id}
             )
-            post_client.set_as_posted(post.id, post_response.cid, post_response.uri)
-            print("Successfully posted to Bluesky.")
-        except Exception as err:
-            print(f"Error with post: {post.text[:50]}")
-            print(f"Setting {post.text[:50]} as draft.")
-            post_client.set_post_as_draft(post.id)
-            print(err)
-            return False
-
-        return True
-
-    def _extract_url_byte_positions(
-        self, text: str, *, aggressive: bool, encoding: str = "UTF-8"
-    ) -> t.List[t.Tuple[str, int, int]]:
-        """If aggressive is False, only links beginning http or https will be detected"""
-        encoded_text = text.encode(encoding)
-
-        if aggressive:
-            pattern = rb"(?:[\w+]+\:\/\/)?(?:[\w\d-]+\.)*[\w-]+[\.\:]\w+\/?(?:[\/\?\=\&\#\.]?[\w-]+)+\/?"
-        else:
-            pattern = rb"https?\:\/\/(?:[\w\d-]+\.)*[\w-]+[\.\:]\w+\/?(?:[\/\?\=\&\#\.]?[\w-]+)+\/?"
-
-        matches = re.finditer(pattern, encoded_text)
-        url_byte_positions = []
-        for match in matches:
-            url_bytes = match.group(0)
-            url = url_bytes.decode(encoding)
-            url_byte_positions.append((url, match.start(), match.end()))
-
-        return url_byte_positions
+
+    def _sleep(self, seconds: float) -> None:
+        time.sleep(seconds)
+
+    def _resolve_handle(self, handle: str) -> str:
+        return self.client.resolve_handle(handle).did
+
+    def _invalidate_session(self) -> None:
+        session_manager.invalidate(self.bluesky_username)
+
+    def _gather(self, steps: t.List[Steps]) -> t.List[t.Any]:
+        with ThreadPoolExecutor(max_workers=MEDIA_WORKERS) as executor:
+            futures = [executor.submit(self._run, step) for step in steps]
+            return [future.exception() or future.result() for future in futures]
+
+    def _image_client(self) -> ImageClient:
+        if self.image_client is None:
+            self.image_client = ImageClient()
+        return self.image_client
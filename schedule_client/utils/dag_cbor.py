@@ -0,0 +1,99 @@
+"""Minimal DAG-CBOR encoder for computing the CID of a record before it is written.
+
+The PDS stores records as DAG-CBOR and refers to them by the CID of that encoding, so
+encoding the same JSON the same way yields the CID the PDS will report. Only the types
+that occur in records are supported: null, booleans, integers, strings, bytes, lists,
+maps and CID links. Records are given in their JSON form, where links are written as
+{"$link": cid} and bytes as {"$bytes": base64}.
+"""
+
+import base64
+import hashlib
+import typing as t
+
+DAG_CBOR_CODEC = 0x71
+SHA2_256 = 0x12
+CID_TAG = 42
+
+
+class Link(bytes):
+    """Binary CID referenced from a record"""
+
+
+def record_cid(record: dict) -> str:
+    """Compute the CID of a record
+
+    Args:
+        record (dict): Record in its JSON form
+
+    Returns:
+        str: CIDv1 (dag-cbor, sha2-256) in base32 multibase
+    """
+    digest = hashlib.sha256(encode(from_json(record))).digest()
+    cid = bytes([1, DAG_CBOR_CODEC, SHA2_256, len(digest)]) + digest
+    return "b" + base64.b32encode(cid).decode().lower().rstrip("=")
+
+
+def from_json(value: t.Any) -> t.Any:
+    """Convert the JSON form of a record to its data model, decoding $link and $bytes"""
+    if isinstance(value, dict):
+        if len(value) == 1 and "$link" in value:
+            return Link(_decode_cid(value["$link"]))
+        if len(value) == 1 and "$bytes" in value:
+            return base64.b64decode(value["$bytes"] + "==")
+        return {key: from_json(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [from_json(item) for item in value]
+    return value
+
+
+def encode(value: t.Any) -> bytes:
+    """Encode a value as canonical DAG-CBOR"""
+    if value is None:
+        return b"\xf6"
+    if value is True:
+        return b"\xf5"
+    if value is False:
+        return b"\xf4"
+    if isinstance(value, int):
+        if value >= 0:
+            return _head(0, value)
+        return _head(1, -1 - value)
+    if isinstance(value, Link):
+        # Tag 42 holding the binary CID prefixed with the identity multibase
+        return _head(6, CID_TAG) + _head(2, len(value) + 1) + b"\x00" + value
+    if isinstance(value, bytes):
+        return _head(2, len(value)) + value
+    if isinstance(value, str):
+        encoded = value.encode("utf-8")
+        return _head(3, len(encoded)) + encoded
+    if isinstance(value, (list, tuple)):
+        return _head(4, len(value)) + b"".join(encode(item) for item in value)
+    if isinstance(value, dict):
+        # Keys are sorted by length first, then bytewise
+        items = sorted(
+            ((encode(key), encode(item)) for key, item in value.items()),
+            key=lambda pair: (len(pair[0]), pair[0]),
+        )
+        return _head(5, len(items)) + b"".join(key + item for key, item in items)
+
+    raise TypeError(f"Cannot encode {type(value).__name__} as DAG-CBOR")
+
+
+def _head(major_type: int, argument: int) -> bytes:
+    """Type and length prefix, using the shortest possible encoding"""
+    if argument < 24:
+        return bytes([major_type << 5 | argument])
+    for additional_info, size in ((24, 1), (25, 2), (26, 4), (27, 8)):
+        if argument < 1 << (8 * size):
+            return bytes([major_type << 5 | additional_info]) + argument.to_bytes(
+                size, "big"
+            )
+    raise ValueError("Integer too large for DAG-CBOR")
+
+
+def _decode_cid(cid: str) -> bytes:
+    if not cid.startswith("b"):
+        raise ValueError(f"Unsupported CID encoding: {cid}")
+    encoded = cid[1:].upper()
+    return base64.b32decode(encoded + "=" * (-len(encoded) % 8))
@@ -1,3 +1,5 @@
+from datetime import time
+
 from pydantic import BaseModel, Field
 
 
@@ -8,8 +10,18 @@ class PostObject(BaseModel):
     links: list[str] = Field(default=[], max_length=4)
     link_card_title: str = Field(default="")
     link_card_description: str = Field(default="")
-    is_link_card: bool = Field(default=False)
+    # Embed planned when the post was rendered, "images", "video", "link_card" or None
+    embed: str | None = Field(default=None)
     image_urls_with_alts: list[dict] = Field(default=[], max_length=4)
+    video: str = Field(default="")
+    video_alt: str = Field(default="")
+    rendered_text: str = Field(default="")
+    facets: list[dict] = Field(default=[])
+    attempt_count: int = Field(default=0)
+    rkey: str = Field(default="")
+    rkey_reused: bool = Field(default=False)
+    # Replies published with the post, in thread order
+    thread_replies: list["PostObject"] = Field(default=[])
 
 
 class AccountObject(BaseModel):
@@ -17,4 +29,10 @@ class AccountObject(BaseModel):
     bluesky_password: str = Field(default="")
     interval_hours: int = Field(default=12)
     interval_minutes: int = Field(default=0)
+    first_post_time: time | None = Field(default=None)
+    quiet_hours_start: time | None = Field(default=None)
+    quiet_hours_end: time | None = Field(default=None)
+    catch_up_policy: str = Field(default="reschedule")
+    max_lateness_minutes: int = Field(default=60)
+    catch_up_slots: int = Field(default=3)
     allow_posts: bool = Field(default=False)
@@ -1,203 +1,827 @@
-from datetime import timedelta
-
+from datetime import datetime, timedelta
+import os
+import socket
+from threading import Lock
+import typing as t
+from uuid import uuid4
+
+from django.db import connection, transaction
+from django.db.models import Count, Max, Q, QuerySet, Sum
 from django.utils import timezone
 
-from atproto_scheduler.settings import SCHEDULER_INTERVAL
-from posts.models import Post, Config
+from atproto_scheduler.settings import (
+    POST_CLAIM_LEASE,
+    SCHEDULE_BATCH_SIZE,
+    SCHEDULER_INTERVAL,
+)
+from posts.models import CatchUpPolicy, Config, Post
 from schedule_client.utils.data_models import PostObject, AccountObject
+from schedule_client.utils.post_results import post_results
+from schedule_client.utils.rendering import (
+    PostTooLong,
+    check_length,
+    render_post,
+    source_hash,
+)
+from schedule_client.utils.retry_policy import next_attempt_at
+from schedule_client.utils.slots import (
+    MIN_INTERVAL,
+    NoAllowedSlot,
+    SlotGrid,
+    SlotIndex,
+)
+from schedule_client.utils.tid import generate_tids
+
+# Columns needed to publish a post, in the order _build_post_object unpacks them
+PUBLISH_COLUMNS = (
+    "id",
+    "text",
+    "link_card_title",
+    "link_card_description",
+    "link_1",
+    "link_2",
+    "link_3",
+    "link_4",
+    "image_1",
+    "image_2",
+    "image_3",
+    "image_4",
+    "alt_1",
+    "alt_2",
+    "alt_3",
+    "alt_4",
+    "video",
+    "video_alt",
+    "rendered",
+    "rendered_hash",
+    "attempt_count",
+    "rkey",
+)
 
 
 class PostClient:
     """Handle interactions with post table"""
 
     def __init__(self) -> None:
-        self.non_draft_unpublished_posts = Post.objects.filter(is_draft=False).filter(
-            posted_at=None
+        # Thread replies are published with the first post of their thread
+        self.non_draft_unpublished_posts = Post.objects.filter(
+            is_draft=False, posted_at=None, thread_parent=None
         )
         self.scheduled_posts = self.non_draft_unpublished_posts.exclude(
             scheduled_post_time=None
         )
 
-    def clear_past_scheduled_times(self) -> None:
-        """Remove scheduled times for unposted elements that are scheduled in the past"""
-        past_scheduled_posts = self.non_draft_unpublished_posts.filter(
-            scheduled_post_time__lt=timezone.now()
-        ).all()
+    def catch_up_missed_posts(self, accounts: list[AccountObject]) -> None:
+        """Apply the catch-up policy of each account to posts whose scheduled time passed
+        more than SCHEDULER_INTERVAL ago without them being published, e.g. while the
+        scheduler was down or a tick overran. Posts claimed by a scheduler process that
+        is still publishing them, and posts waiting to be retried, are kept.
 
-        for past_scheduled_post in past_scheduled_posts:
-            past_scheduled_post.scheduled_post_time = None
-            past_scheduled_post.save()
+        reschedule: Missed posts are unscheduled, and get the next free slots.
+        publish_late: Posts missed by at most max_lateness_minutes are left to be
+            published right away, later ones are rescheduled.
+        spread: Missed posts are spread evenly over the next catch_up_slots intervals,
+            in their original order, alongside the posts already scheduled there.
+
+        Args:
+            accounts (list[AccountObject]): Accounts and their catch-up policies
+        """
+        now = timezone.now()
+        missed_posts = self.non_draft_unpublished_posts.filter(
+            self._unclaimed(now),
+            next_attempt_at=None,
+            scheduled_post_time__lt=now - SCHEDULER_INTERVAL,
+        )
+        late_usernames = set(
+            missed_posts.order_by()
+            .values_list("bluesky_username", flat=True)
+            .distinct()
+        )
+        accounts_by_username = {
+            account.bluesky_username: account for account in accounts
+        }
+
+        for bluesky_username in late_usernames:
+            account = accounts_by_username.get(bluesky_username)
+            account_missed_posts = missed_posts.filter(
+                bluesky_username=bluesky_username
+            )
+            policy = account.catch_up_policy if account else CatchUpPolicy.RESCHEDULE
+
+            if policy == CatchUpPolicy.SPREAD:
+                self._spread_missed_posts(account, account_missed_posts, now)
+                continue
+
+            if policy == CatchUpPolicy.PUBLISH_LATE:
+                account_missed_posts = account_missed_posts.filter(
+                    scheduled_post_time__lt=now - self.lateness(account)
+                )
+            rescheduled_count = account_missed_posts.update(scheduled_post_time=None)
+            if rescheduled_count:
+                print(
+                    f"Rescheduling {rescheduled_count} missed posts "
+                    f"for {bluesky_username}"
+                )
+
+    def _spread_missed_posts(
+        self, account: AccountObject, missed_posts: QuerySet, now: datetime
+    ) -> None:
+        """Spread missed posts evenly over the next catch_up_slots intervals
+
+        Args:
+            account (AccountObject): The Bluesky account the posts belong to
+            missed_posts (QuerySet): Missed posts of the account
+            now (datetime): Time the posts were found missed at
+        """
+        missed_count = missed_posts.count()
+        # Another scheduler process may have spread them since they were found
+        if not missed_count:
+            return
+
+        interval = max(
+            timedelta(hours=account.interval_hours, minutes=account.interval_minutes),
+            MIN_INTERVAL,
+        )
+        spacing = interval * account.catch_up_slots / missed_count
+        first_time = now + timedelta(minutes=1)
+
+        # Spread posts are in the future, so each page drops out of missed_posts
+        spread_count = 0
+        while batch := list(
+            missed_posts.order_by("scheduled_post_time", "id").values_list(
+                "id", flat=True
+            )[:SCHEDULE_BATCH_SIZE]
+        ):
+            Post.objects.bulk_update(
+                [
+                    Post(
+                        id=post_id,
+                        scheduled_post_time=first_time + (spread_count + i) * spacing,
+                        # Rebuilds the slot index of the account
+                        updated_at=now,
+                    )
+                    for i, post_id in enumerate(batch)
+                ],
+                ["scheduled_post_time", "updated_at"],
+            )
+            spread_count += len(batch)
+
+        print(
+            f"Spreading {spread_count} missed posts for {account.bluesky_username} "
+            f"over {account.catch_up_slots} intervals from {first_time}"
+        )
 
     def schedule_unscheduled_posts(self, account: AccountObject) -> None:
-        """Produce a list of all unscheduled posts and distribute them evenly at pre-configured interval
+        """Give all unscheduled posts the first free slots of the account's grid,
+        starting a minute from now. Slots freed by deleted or drafted posts are
+        filled first, then posts continue after the last scheduled one.
+        Posts are scheduled in pages of SCHEDULE_BATCH_SIZE, so a large backlog is
+        never held in memory.
 
         Args:
             account (AccountObject): The Bluesky account whose posts are being scheduled
         """
-        # Get all unscheduled posts
-        unscheduled_posts = (
-            self.non_draft_unpublished_posts.filter(
-                bluesky_username=account.bluesky_username
-            )
-            .filter(scheduled_post_time=None)
-            .all()
+        unscheduled_posts = self.non_draft_unpublished_posts.filter(
+            bluesky_username=account.bluesky_username
+        ).filter(scheduled_post_time=None)
+
+        if not unscheduled_posts.exists():
+            return
+
+        grid = SlotGrid(
+            timedelta(hours=account.interval_hours, minutes=account.interval_minutes),
+            account.first_post_time,
+            account.quiet_hours_start,
+            account.quiet_hours_end,
         )
-        interval = timedelta(
-            hours=account.interval_hours, minutes=account.interval_minutes
+        slot_index = slot_indexes.get_index(
+            account.bluesky_username,
+            grid,
+            self.scheduled_posts.filter(bluesky_username=account.bluesky_username),
         )
+        now = timezone.now()
+        first_slot = grid.first_slot_from(now + timedelta(minutes=1))
+
+        # Newest posts first, paginated by keyset so every page is an index range
+        page = unscheduled_posts.order_by("-created_at", "-id")
+        scheduled_count = 0
+        while batch := list(page.values_list("id", "created_at")[:SCHEDULE_BATCH_SIZE]):
+            try:
+                slots = slot_index.allocate(grid, len(batch), first_slot)
+            except NoAllowedSlot as err:
+                print(f"Cannot schedule posts for {account.bluesky_username}: {err}")
+                break
+
+            with transaction.atomic():
+                Post.objects.bulk_update(
+                    [
+                        Post(
+                            id=post_id,
+                            scheduled_post_time=grid.slot_time(slot),
+                            # bulk_update skips auto_now, and other processes only
+                            # see the new posts in the slot index fingerprint by it
+                            updated_at=now,
+                        )
+                        for (post_id, _), slot in zip(batch, slots)
+                    ],
+                    ["scheduled_post_time", "updated_at"],
+                )
+            slot_indexes.add_scheduled(account.bluesky_username, len(batch), now)
+            if not scheduled_count:
+                first_scheduled_time = grid.slot_time(slots[0])
+            scheduled_count += len(batch)
+            first_slot = slots[-1] + 1
+
+            last_id, last_created_at = batch[-1]
+            page = unscheduled_posts.order_by("-created_at", "-id").filter(
+                Q(created_at__lt=last_created_at)
+                | Q(created_at=last_created_at, id__lt=last_id)
+            )
 
-        if unscheduled_posts:
-            # Get time of last scheduled post - Reference time
-            last_scheduled_post = (
-                self.scheduled_posts.filter(bluesky_username=account.bluesky_username)
-                .order_by("-scheduled_post_time")
-                .first()
+        if scheduled_count:
+            print(
+                f"Scheduled {scheduled_count} posts for {account.bluesky_username} "
+                f"from {first_scheduled_time} to {grid.slot_time(first_slot - 1)}"
             )
 
-            if last_scheduled_post:
-                reference_time = last_scheduled_post.scheduled_post_time + interval
-            else:
-                reference_time = timezone.now() + timedelta(minutes=1)
+    def iter_scheduled_posts(
+        self, account: AccountObject
+    ) -> t.Iterator[list[PostObject]]:
+        """Claim and yield all posts scheduled within SCHEDULER_INTERVAL after
+        timezone.now() and up to the account's lateness before it, and all posts whose
+        next retry is due.
 
-            # Loop through all unscheduled posts
-            for unscheduled_post in unscheduled_posts:
-                # Set scheduled time to reference time plus interval
-                print(f"Setting {unscheduled_post.__str__} to time {reference_time}")
-                unscheduled_post.scheduled_post_time = reference_time
-                unscheduled_post.save()
+        Posts are claimed in chunks of SCHEDULE_BATCH_SIZE, in scheduled order, using
+        keyset pagination on scheduled_post_time and id. Only one chunk is held in
+        memory, and later chunks are only claimed once the earlier ones are consumed.
 
-                # Update reference time to scheduled time used
-                reference_time += interval
+        Args:
+            account (AccountObject): The Bluesky account whose posts are being retrieved
 
-    def get_scheduled_posts(self, account: AccountObject) -> list[PostObject]:
-        """Collect all unscheduled posts within the SCHEDULER_INTERVAL before and after timezone.now().
+        Yields:
+            list[PostObject]: Next chunk of due posts
+        """
+        due_posts = (
+            self.scheduled_posts.filter(bluesky_username=account.bluesky_username)
+            .filter(self._due(timezone.now(), self.lateness(account)))
+            .order_by("scheduled_post_time", "id")
+        )
+
+        page = due_posts
+        while page_keys := list(
+            page.values_list("scheduled_post_time", "id")[:SCHEDULE_BATCH_SIZE]
+        ):
+            post_objects = self._get_claimed_posts(
+                account, Post.objects.filter(id__in=[key[1] for key in page_keys])
+            )
+            if post_objects:
+                yield post_objects
+
+            last_time, last_id = page_keys[-1]
+            page = due_posts.filter(
+                Q(scheduled_post_time__gt=last_time)
+                | Q(scheduled_post_time=last_time, id__gt=last_id)
+            )
+
+    def _get_claimed_posts(
+        self, account: AccountObject, posts: QuerySet
+    ) -> list[PostObject]:
+        """Claim posts and build them, with their thread replies, for publishing
 
         Args:
-            account (AccountObject): The Bluesky account whose posts are being retrieved
+            account (AccountObject): The Bluesky account the posts belong to
+            posts (QuerySet): Due posts to claim
 
         Returns:
-            list[PostObject]: List of all posts within scheduler interval
+            list[PostObject]: Posts claimed by this process, in scheduled order
         """
-
-        account_filtered_posts = self.scheduled_posts.filter(
-            bluesky_username=account.bluesky_username
+        previous_rkeys = self._claim_posts(posts)
+        claimed_posts = (
+            Post.objects.filter(id__in=previous_rkeys)
+            .order_by("scheduled_post_time", "id")
+            .values_list(*PUBLISH_COLUMNS)
         )
 
-        schedule_window_begin = timezone.now() - SCHEDULER_INTERVAL
-        schedule_window_end = timezone.now() + SCHEDULER_INTERVAL
+        thread_replies = {}
+        for parent_id, *row in (
+            Post.objects.filter(thread_parent_id__in=previous_rkeys, posted_at=None)
+            .order_by("thread_position", "id")
+            .values_list("thread_parent_id", *PUBLISH_COLUMNS)
+        ):
+            thread_replies.setdefault(parent_id, []).append(
+                self._build_post_object(
+                    row,
+                    account.bluesky_username,
+                    previous_rkeys[parent_id] is not None,
+                )
+            )
+
+        post_objects = []
+        for row in claimed_posts:
+            post_object = self._build_post_object(
+                row,
+                account.bluesky_username,
+                previous_rkeys[row[0]] is not None,
+                thread_replies.get(row[0]),
+            )
+            # Posts written without Post.clean, e.g. imported in bulk, were never
+            # checked. The whole thread fails if one of its posts is too long.
+            try:
+                for thread_post in (post_object, *post_object.thread_replies):
+                    check_length(thread_post.rendered_text)
+            except PostTooLong as err:
+                print(f"Post {thread_post.id} cannot be published: {err}")
+                self.set_post_failed(post_object, err)
+                continue
+
+            print(f"Posting scheduled post {post_object.id}")
+            post_objects.append(post_object)
 
-        posts_within_window = (
-            account_filtered_posts.exclude(
-                scheduled_post_time__lt=schedule_window_begin
+        return post_objects
+
+    def _claim_posts(self, posts: QuerySet) -> dict[int, str | None]:
+        """Lease posts to this process so no other scheduler process publishes them.
+        Rows locked by another process are skipped, and the lease is only taken on rows
+        whose previous lease is absent or expired, so each post is claimed exactly once
+        even on databases without row locks.
+
+        Posts claimed for the first time, and their thread replies, are assigned a
+        record key before anything is sent to Bluesky.
+
+        Args:
+            posts (QuerySet): Due posts to claim
+
+        Returns:
+            dict[int, str | None]: IDs of the posts claimed by this call, mapped to the record key assigned by an earlier claim
+        """
+        now = timezone.now()
+        claim_token = f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex}"
+
+        with transaction.atomic():
+            candidates = posts.filter(self._unclaimed(now))
+            if connection.features.has_select_for_update_skip_locked:
+                candidates = list(
+                    candidates.select_for_update(skip_locked=True).values_list(
+                        "id", flat=True
+                    )
+                )
+            else:
+                # Without row locks, claim in a single UPDATE so the database
+                # serializes competing claims instead of failing them
+                candidates = candidates.values("id")
+
+            Post.objects.filter(id__in=candidates).filter(self._unclaimed(now)).update(
+                claimed_by=claim_token, claim_expires_at=now + POST_CLAIM_LEASE
             )
-            .exclude(scheduled_post_time__gt=schedule_window_end)
-            .all()
+
+        previous_rkeys = dict(
+            posts.filter(claimed_by=claim_token).values_list("id", "rkey")
         )
 
-        post_objects = []
-        for post in posts_within_window:
-            links_raw = [post.link_1, post.link_2, post.link_3, post.link_4]
-            images_raw = [post.image_1, post.image_2, post.image_3, post.image_4]
-            alt_texts_raw = [post.alt_1, post.alt_2, post.alt_3, post.alt_4]
+        unkeyed_ids = [
+            post_id for post_id, rkey in previous_rkeys.items() if rkey is None
+        ]
+        unkeyed_ids += (
+            Post.objects.filter(
+                thread_parent_id__in=previous_rkeys, posted_at=None, rkey=None
+            )
+            .order_by("thread_position", "id")
+            .values_list("id", flat=True)
+        )
+        Post.objects.bulk_update(
+            [
+                Post(id=post_id, rkey=rkey)
+                for post_id, rkey in zip(unkeyed_ids, generate_tids(len(unkeyed_ids)))
+            ],
+            ["rkey"],
+            batch_size=SCHEDULE_BATCH_SIZE,
+        )
 
-            links = [link for link in links_raw if link]
-            images = [image for image in images_raw if image]
+        return previous_rkeys
 
-            image_urls_with_alts = [
-                {"image": images[i], "alt_text": alt_texts_raw[i]}
-                for i in range(len(images))
-            ]
+    def get_accounts_with_work(self) -> set[str]:
+        """Find the accounts that have posts to schedule or publish, in a single query,
+        so idle accounts cost nothing per tick. Run after catch_up_missed_posts, which
+        leaves only posts that may still be published in the past.
 
-            link_card_title = post.link_card_title if post.link_card_title else ""
-            link_card_description = (
-                post.link_card_description if post.link_card_description else ""
+        Returns:
+            set[str]: Bluesky handles with unscheduled or due posts
+        """
+        now = timezone.now()
+        return set(
+            self.non_draft_unpublished_posts.filter(
+                Q(scheduled_post_time=None)
+                | Q(
+                    next_attempt_at=None,
+                    scheduled_post_time__lte=now + SCHEDULER_INTERVAL,
+                )
+                | Q(next_attempt_at__lte=now)
             )
+            .order_by()
+            .values_list("bluesky_username", flat=True)
+            .distinct()
+        )
 
-            is_link_card = (
-                len(links) == 1
-                and link_card_title != ""
-                and link_card_description != ""
+    @staticmethod
+    def _due(now: datetime, lateness: timedelta = SCHEDULER_INTERVAL) -> Q:
+        """Posts scheduled from lateness before now to SCHEDULER_INTERVAL after now,
+        and posts whose retry is due
+        """
+        return Q(
+            next_attempt_at=None,
+            scheduled_post_time__gte=now - lateness,
+            scheduled_post_time__lte=now + SCHEDULER_INTERVAL,
+        ) | Q(next_attempt_at__lte=now)
+
+    @staticmethod
+    def lateness(account: AccountObject) -> timedelta:
+        """How late posts of an account may still be published"""
+        if account.catch_up_policy == CatchUpPolicy.PUBLISH_LATE:
+            return max(
+                timedelta(minutes=account.max_lateness_minutes), SCHEDULER_INTERVAL
             )
+        return SCHEDULER_INTERVAL
+
+    @staticmethod
+    def _unclaimed(now: datetime) -> Q:
+        return Q(claim_expires_at=None) | Q(claim_expires_at__lte=now)
+
+    @staticmethod
+    def _build_post_object(
+        row: tuple,
+        bluesky_username: str,
+        rkey_reused: bool,
+        thread_replies: list[PostObject] | None = None,
+    ) -> PostObject:
+        """Map a PUBLISH_COLUMNS row to a PostObject without validating it.
+        The database does not enforce the max_length of text fields, check the
+        rendered text with check_length before publishing.
 
-            post_object = PostObject(
-                id=post.id,
-                text=post.text,
-                bluesky_username=account.bluesky_username,
-                links=links,
-                link_card_title=link_card_title,
-                link_card_description=link_card_description,
-                is_link_card=is_link_card,
-                image_urls_with_alts=image_urls_with_alts,
+        Args:
+            row (tuple): Values of PUBLISH_COLUMNS for one post
+            bluesky_username (str): The Bluesky account the post belongs to
+            rkey_reused (bool): The post was claimed before, so its record may already exist
+            thread_replies (list[PostObject]): Replies published with the post, in thread order
+
+        Returns:
+            PostObject: Post ready to be published
+        """
+        (
+            post_id,
+            text,
+            link_card_title,
+            link_card_description,
+            link_1,
+            link_2,
+            link_3,
+            link_4,
+            image_1,
+            image_2,
+            image_3,
+            image_4,
+            alt_1,
+            alt_2,
+            alt_3,
+            alt_4,
+            video,
+            video_alt,
+            rendered,
+            rendered_hash,
+            attempt_count,
+            rkey,
+        ) = row
+
+        links = [link for link in (link_1, link_2, link_3, link_4) if link]
+        image_urls_with_alts = [
+            {"image": image, "alt_text": alt_text or ""}
+            for image, alt_text in (
+                (image_1, alt_1),
+                (image_2, alt_2),
+                (image_3, alt_3),
+                (image_4, alt_4),
             )
+            if image
+        ]
+
+        link_card_title = link_card_title or ""
+        link_card_description = link_card_description or ""
+
+        # Use the record rendered at save time unless the row changed without save()
+        render_source = (
+            text,
+            links,
+            link_card_title,
+            link_card_description,
+            [image["image"] for image in image_urls_with_alts],
+            video or "",
+        )
+        if not rendered or rendered_hash != source_hash(*render_source):
+            rendered = render_post(*render_source)
+
+        return PostObject.model_construct(
+            id=post_id,
+            text=text,
+            bluesky_username=bluesky_username,
+            links=links,
+            link_card_title=link_card_title,
+            link_card_description=link_card_description,
+            embed=rendered["embed"],
+            image_urls_with_alts=image_urls_with_alts,
+            video=video or "",
+            video_alt=video_alt or "",
+            rendered_text=rendered["text"],
+            facets=rendered["facets"],
+            attempt_count=attempt_count,
+            rkey=rkey,
+            rkey_reused=rkey_reused,
+            thread_replies=thread_replies or [],
+        )
 
-            print(f"Posting scheduled post")
-            print(f"Post ID: {post_object.text}")
-            print(f"Post text: {post_object.text}")
-            print(f"Post links: {post_object.links}")
-            print(f"Post image data: {post_object.image_urls_with_alts}")
-            post_objects.append(post_object)
+    def get_next_due_time(self) -> datetime | None:
+        """Find when the scheduler next has work to do
 
-        return post_objects
+        Returns:
+            datetime | None: Now if there are posts to schedule, otherwise the earliest pending scheduled time
+        """
+        allowed_posts = self.non_draft_unpublished_posts.filter(
+            bluesky_username__allow_posts=True
+        )
+
+        if allowed_posts.filter(scheduled_post_time=None).exists():
+            return timezone.now()
+
+        next_times = [
+            allowed_posts.exclude(scheduled_post_time=None)
+            .filter(next_attempt_at=None)
+            .order_by("scheduled_post_time")
+            .values_list("scheduled_post_time", flat=True)
+            .first(),
+            allowed_posts.exclude(next_attempt_at=None)
+            .order_by("next_attempt_at")
+            .values_list("next_attempt_at", flat=True)
+            .first(),
+        ]
+        return min((next_time for next_time in next_times if next_time), default=None)
+
+    def get_upcoming_image_posts(
+        self, horizon: timedelta
+    ) -> list[tuple[int, list[str]]]:
+        """Collect image paths of posts scheduled between now and the prefetch horizon
+
+        Args:
+            horizon (timedelta): How far ahead of now to look
+
+        Returns:
+            list[tuple[int, list[str]]]: Post IDs paired with their image paths
+        """
+        upcoming_ids = list(
+            self.scheduled_posts.filter(bluesky_username__allow_posts=True)
+            .filter(scheduled_post_time__gte=timezone.now())
+            .filter(scheduled_post_time__lte=timezone.now() + horizon)
+            .values_list("id", flat=True)
+        )
+        # Including the replies published with them. Fetched by ID, PostgreSQL scans
+        # the whole post table for an OR of two subqueries.
+        upcoming_posts = Post.objects.filter(
+            Q(id__in=upcoming_ids) | Q(thread_parent_id__in=upcoming_ids)
+        ).values_list("id", "image_1", "image_2", "image_3", "image_4")
+
+        image_posts = []
+        for post_id, *images_raw in upcoming_posts:
+            images = [image for image in images_raw if image]
+            if images:
+                image_posts.append((post_id, images))
+
+        return image_posts
+
+    def set_media_error(self, post_id: int, media_error: str | None) -> None:
+        """Record or clear a problem found while prefetching a post's media
+
+        Args:
+            post_id (int): Unique identifier of post
+            media_error (str | None): Description of the problem, None once resolved
+        """
+        Post.objects.filter(id=post_id).update(media_error=media_error)
 
     def set_post_as_draft(self, post_id: int) -> None:
-        """Set a post as a draft. Used in the event of an error posting to Bluesky
+        """Set a post as a draft. Used in the event of an error posting to Bluesky.
+        Written to the database by flush_post_results.
 
         Args:
             post_id (int): Unique identifier of post
         """
-        try:
-            post_to_draft = Post.objects.filter(id=post_id).first()
-            post_to_draft.is_draft = True
-            post_to_draft.save()
-        except:
-            raise
+        post_results.add_draft(post_id)
 
     def set_as_posted(self, post_id: int, cid: str, uri: str) -> None:
-        """Set a post as published and record relevant data
+        """Set a post as published and record relevant data.
+        Written to the database by flush_post_results.
 
         Args:
             post_id (int): Unique identifier of post
             cid (str): CID response value from Bluesky
             uri (str): URI response value from Bluesky
         """
-        try:
-            posted_object = Post.objects.filter(id=post_id).first()
-            posted_object.posted_at = timezone.now()
-            posted_object.cid = cid
-            posted_object.uri = uri
-            posted_object.save()
-        except:
-            raise
+        post_results.add_posted(post_id, cid, uri)
+
+    def set_post_failed(self, post: PostObject, err: Exception) -> None:
+        """Schedule another attempt for a post that failed transiently, or set it as a
+        draft if the failure is permanent or it ran out of attempts.
+        Written to the database by flush_post_results.
+
+        Args:
+            post (PostObject): The post that failed
+            err (Exception): Error raised while publishing
+        """
+        attempt_count = post.attempt_count + 1
+        retry_at = next_attempt_at(attempt_count, err)
+        last_error = type(err).__name__
+
+        if retry_at:
+            print(f"Retrying post {post.id} at {retry_at} (attempt {attempt_count})")
+            post_results.add_retry(post.id, attempt_count, retry_at, last_error)
+        else:
+            print(f"Setting {post.text[:50]} as draft.")
+            post_results.add_draft(post.id, last_error)
+
+    def get_retry_backlog(self) -> int:
+        """Count posts waiting for another publishing attempt
+
+        Returns:
+            int: Number of posts with a pending retry
+        """
+        return self.non_draft_unpublished_posts.exclude(next_attempt_at=None).count()
+
+    def defer_post(self, post: PostObject, deferred_until: datetime) -> None:
+        """Reschedule a post that was throttled by a rate limit.
+        Written to the database by flush_post_results.
+
+        Args:
+            post (PostObject): The throttled post
+            deferred_until (datetime): When the post may be published
+        """
+        # Only posts that failed before have a pending retry
+        post_results.add_deferred(post.id, deferred_until, post.attempt_count > 0)
+
+    def flush_post_results(self) -> None:
+        """Write all buffered post results to the database in one transaction"""
+        post_results.flush()
 
 
 class ConfigClient:
     """Handle interactions with configuration table"""
 
     def __init__(self) -> None:
+        self.is_placeholder, self.accounts = config_cache.get_accounts()
+
+
+class ConfigCache:
+    """Accounts from the Config table, kept in memory between scheduler ticks.
+
+    Every Config save changes its version, so a single aggregate query per tick tells
+    whether any row was added, changed or deleted, also by another process. Accounts
+    are only reloaded when it did.
+    """
+
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.fingerprint: dict | None = None
         self.is_placeholder = False
-        self.check_placeholder_status()
+        self.accounts: list[AccountObject] = []
+        self.stats = {"loads": 0}
+
+    def get_accounts(self) -> tuple[bool, list[AccountObject]]:
+        """Return the configured accounts, reloading them if the Config table changed
+
+        Returns:
+            tuple[bool, list[AccountObject]]: Whether only the placeholder is configured, and the accounts
+        """
+        fingerprint = Config.objects.aggregate(
+            count=Count("pk"), versions=Sum("version")
+        )
+
+        with self.lock:
+            if fingerprint != self.fingerprint:
+                self._load(fingerprint["count"])
+                self.fingerprint = fingerprint
+            return self.is_placeholder, self.accounts
+
+    def _load(self, count: int) -> None:
+        """Populate Bluesky user data, unless only the placeholder is configured"""
+        self.is_placeholder = (
+            count == 1
+            and Config.objects.filter(bluesky_username="placeholder").exists()
+        )
         self.accounts = []
 
         if not self.is_placeholder:
-            self.populate_bluesky_accounts()
-
-    def populate_bluesky_accounts(self) -> None:
-        """Populate Bluesky user data into self.accounts"""
-        raw_accounts = Config.objects.all()
-        for raw_account in raw_accounts:
-            account = AccountObject(
-                bluesky_username=raw_account.bluesky_username,
-                bluesky_password=raw_account.app_password,
-                interval_hours=raw_account.interval_hours,
-                interval_minutes=raw_account.interval_minutes,
-                allow_posts=raw_account.allow_posts,
-            )
-            self.accounts.append(account)
+            self.accounts = [
+                AccountObject(
+                    bluesky_username=bluesky_username,
+                    bluesky_password=app_password,
+                    interval_hours=interval_hours,
+                    interval_minutes=interval_minutes,
+                    first_post_time=first_post_time,
+                    quiet_hours_start=quiet_hours_start,
+                    quiet_hours_end=quiet_hours_end,
+                    catch_up_policy=catch_up_policy,
+                    max_lateness_minutes=max_lateness_minutes,
+                    catch_up_slots=catch_up_slots,
+                    allow_posts=allow_posts,
+                )
+                for (
+                    bluesky_username,
+                    app_password,
+                    interval_hours,
+                    interval_minutes,
+                    first_post_time,
+                    quiet_hours_start,
+                    quiet_hours_end,
+                    catch_up_policy,
+                    max_lateness_minutes,
+                    catch_up_slots,
+                    allow_posts,
+                ) in Config.objects.values_list(
+                    "bluesky_username",
+                    "app_password",
+                    "interval_hours",
+                    "interval_minutes",
+                    "first_post_time",
+                    "quiet_hours_start",
+                    "quiet_hours_end",
+                    "catch_up_policy",
+                    "max_lateness_minutes",
+                    "catch_up_slots",
+                    "allow_posts",
+                )
+            ]
+
+        self.stats["loads"] += 1
+
+
+config_cache = ConfigCache()
+
+
+class SlotIndexCache:
+    """Occupied slots of each account, kept in memory between scheduler ticks.
+
+    An index is rebuilt when the grid of its account changed, or when the count or
+    latest update of the account's scheduled posts no longer match, which happens when
+    a post is added, deleted, drafted, rescheduled or published, also by another
+    process. Posts scheduled by this process are added to the index as they are
+    scheduled.
+    """
+
+    def __init__(self) -> None:
+        self.indexes: dict[str, tuple[tuple, dict, SlotIndex]] = {}
+        self.stats = {"builds": 0}
+
+    def get_index(
+        self, bluesky_username: str, grid: SlotGrid, scheduled_posts: QuerySet
+    ) -> SlotIndex:
+        """Return the occupied slots of an account, rebuilding them if they changed
+
+        Args:
+            bluesky_username (str): Bluesky handle
+            grid (SlotGrid): Grid of the account
+            scheduled_posts (QuerySet): Scheduled posts of the account
+
+        Returns:
+            SlotIndex: Occupied slots
+        """
+        grid_key = (grid.interval, grid.origin, grid.quiet_hours)
+        fingerprint = scheduled_posts.aggregate(
+            count=Count("pk"), updated_at=Max("updated_at")
+        )
+
+        cached = self.indexes.get(bluesky_username)
+        if cached and cached[:2] == (grid_key, fingerprint):
+            return cached[2]
+
+        slot_index = SlotIndex(
+            grid.slot_of(scheduled_post_time)
+            for scheduled_post_time in scheduled_posts.values_list(
+                "scheduled_post_time", flat=True
+            ).iterator(chunk_size=SCHEDULE_BATCH_SIZE)
+        )
+        self.indexes[bluesky_username] = (grid_key, fingerprint, slot_index)
+        self.stats["builds"] += 1
+        return slot_index
+
+    def add_scheduled(
+        self, bluesky_username: str, count: int, updated_at: datetime
+    ) -> None:
+        """Account for posts scheduled with the cached index, so it stays valid
+
+        Args:
+            bluesky_username (str): Bluesky handle
+            count (int): Number of posts scheduled
+            updated_at (datetime): Latest update of the posts scheduled
+        """
+        fingerprint = self.indexes[bluesky_username][1]
+        fingerprint["count"] += count
+        fingerprint["updated_at"] = max(
+            filter(None, (fingerprint["updated_at"], updated_at))
+        )
 
-    def check_placeholder_status(self) -> None:
-        """Check for presence of configurations. Adds placeholder if none exists."""
-        is_one_config_entry = len(Config.objects.all())
-        is_first_placeholder = Config.objects.first().bluesky_username == "placeholder"
 
-        if is_one_config_entry and is_first_placeholder:
-            self.is_placeholder = True
+slot_indexes = SlotIndexCache()
@@ -0,0 +1,143 @@
+"""Single-pass rich text facet detection for links, mentions and hashtags.
+
+Text is split once into whitespace-delimited tokens and every token is classified with
+plain string checks, so extraction is linear in the length of the text and cannot
+backtrack. Facet positions are UTF-8 byte offsets, as required by Bluesky.
+"""
+
+import re
+import typing as t
+
+TOKEN_PATTERN = re.compile(r"\S+")
+
+LEADING_PUNCTUATION = "([{<\"'"
+TRAILING_PUNCTUATION = ".,;:!?\"'>]}"
+HOSTNAME_CHARS = frozenset("abcdefghijklmnopqrstuvwxyz0123456789-")
+MAX_HOSTNAME_LABEL_LENGTH = 63
+MAX_TAG_LENGTH = 64
+
+
+class Facet(t.NamedTuple):
+    kind: str  # "link", "mention" or "tag"
+    value: str  # URI, handle or tag without its leading symbol
+    byte_start: int
+    byte_end: int
+
+
+def extract_facets(
+    text: str, *, aggressive: bool, encoding: str = "UTF-8"
+) -> t.List[Facet]:
+    """Find links, mentions and hashtags in text
+
+    Args:
+        text (str): Post text
+        aggressive (bool): Also detect links without an http(s) scheme, e.g. example.com/page
+        encoding (str): Encoding used to compute byte offsets
+
+    Returns:
+        list[Facet]: Facets in the order they appear in text
+    """
+    facets = []
+    char_position = 0
+    byte_position = 0
+
+    for match in TOKEN_PATTERN.finditer(text):
+        token, token_start = _strip_punctuation(match.group(0), match.start())
+        if not token:
+            continue
+
+        facet = _classify_token(token, aggressive)
+        if not facet:
+            continue
+
+        # Advance the byte offset incrementally to keep the scan linear
+        byte_position += len(text[char_position:token_start].encode(encoding))
+        char_position = token_start
+        byte_end = byte_position + len(token.encode(encoding))
+
+        facets.append(Facet(facet[0], facet[1], byte_position, byte_end))
+
+    return facets
+
+
+def _strip_punctuation(token: str, start: int) -> t.Tuple[str, int]:
+    """Remove punctuation surrounding a token, keeping balanced closing parentheses"""
+    stripped = token.lstrip(LEADING_PUNCTUATION)
+    start += len(token) - len(stripped)
+
+    # Counted once and the end moved back, so a long run of punctuation is not
+    # copied or counted again for every character stripped
+    unbalanced = stripped.count(")") - stripped.count("(")
+    end = len(stripped)
+    while end:
+        if stripped[end - 1] in TRAILING_PUNCTUATION:
+            end -= 1
+        elif stripped[end - 1] == ")" and unbalanced > 0:
+            unbalanced -= 1
+            end -= 1
+        else:
+            break
+
+    return stripped[:end], start
+
+
+def _classify_token(token: str, aggressive: bool) -> t.Optional[t.Tuple[str, str]]:
+    if token[0] == "@":
+        handle = token[1:]
+        if _is_hostname(handle):
+            return ("mention", handle)
+        return None
+
+    if token[0] in "#＃":
+        tag = token[1:]
+        if tag and len(tag) <= MAX_TAG_LENGTH and not tag.isdigit():
+            return ("tag", tag)
+        return None
+
+    lowered = token.lower()
+    if lowered.startswith(("http://", "https://")):
+        host = _get_host(token.split("://", 1)[1])
+        if _is_hostname(host, require_tld=False):
+            return ("link", token)
+        return None
+
+    if aggressive and "://" not in token and "@" not in token:
+        if _is_hostname(_get_host(token)):
+            return ("link", f"https://{token}")
+
+    return None
+
+
+def _get_host(address: str) -> str:
+    """Return the hostname part of a URL without scheme, dropping any port"""
+    end = len(address)
+    for separator in "/?#":
+        position = address.find(separator)
+        if position != -1:
+            end = min(end, position)
+
+    host, _, port = address[:end].partition(":")
+    if port and not port.isdigit():
+        return ""
+
+    return host
+
+
+def _is_hostname(host: str, require_tld: bool = True) -> bool:
+    """Check that host is a dotted hostname whose last label looks like a TLD"""
+    labels = host.lower().split(".")
+    if len(labels) < 2 and require_tld:
+        return False
+
+    for label in labels:
+        if (
+            not label
+            or len(label) > MAX_HOSTNAME_LABEL_LENGTH
+            or label[0] == "-"
+            or label[-1] == "-"
+            or not HOSTNAME_CHARS.issuperset(label)
+        ):
+            return False
+
+    tld = labels[-1]
+    return not require_tld or (len(tld) >= 2 and tld.isalpha())
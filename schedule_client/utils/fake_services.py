@@ -0,0 +1,487 @@
+"""Local stand-ins for a Bluesky PDS, Bluesky's video service and an S3 bucket, for
+benchmarking and testing the publishing pipeline without network access or real
+accounts.
+
+Each serves HTTP from a background thread on a free local port. Point the scheduler at
+them with BLUESKY_PDS_URL, VIDEO_SERVICE_URL and AWS_S3_ENDPOINT_URL. Every request can
+be slowed down by a fixed latency, and PDS writes can be answered with injected 429s and
+5xx errors.
+"""
+
+import base64
+from collections import Counter
+from datetime import timedelta
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import random
+from threading import Lock, Thread
+import time
+import typing as t
+from urllib.parse import parse_qs, urlparse
+
+from schedule_client.utils.dag_cbor import SHA2_256, record_cid
+from schedule_client.utils.video import (
+    GET_JOB_STATUS_NSID,
+    GET_SERVICE_AUTH_NSID,
+    UPLOAD_VIDEO_NSID,
+)
+
+RAW_CODEC = 0x55
+# Requests the fake PDS may answer with an injected 429 or 5xx
+FAULTY_NSIDS = (
+    "com.atproto.repo.applyWrites",
+    "com.atproto.repo.createRecord",
+    "com.atproto.repo.uploadBlob",
+)
+SESSION_LIFETIME = timedelta(hours=2)
+# Reported in ratelimit-* headers, high enough that only injected 429s throttle
+PDS_RATE_LIMIT = (1_000_000, timedelta(minutes=5))
+
+
+class FakeService:
+    """HTTP server running in a daemon thread"""
+
+    def __init__(self, latency: timedelta = timedelta()) -> None:
+        self.latency = latency.total_seconds()
+        self.lock = Lock()
+        self.stats: Counter = Counter()
+
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self) -> None:
+                service._handle(self, "GET")
+
+            def do_HEAD(self) -> None:
+                service._handle(self, "HEAD")
+
+            def do_POST(self) -> None:
+                service._handle(self, "POST")
+
+            def log_message(self, *args) -> None:
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def count(self, stat: str, amount: int = 1) -> None:
+        with self.lock:
+            self.stats[stat] += amount
+
+    def _handle(self, request: BaseHTTPRequestHandler, method: str) -> None:
+        if self.latency:
+            time.sleep(self.latency)
+        self.handle(request, method)
+
+    def handle(self, request: BaseHTTPRequestHandler, method: str) -> None:
+        raise NotImplementedError
+
+    def read_blob(self, request: BaseHTTPRequestHandler) -> dict:
+        """Stream the request body into a blob, as the PDS stores uploads"""
+        digest = hashlib.sha256()
+        size = 0
+        for chunk in self.read_body(request):
+            digest.update(chunk)
+            size += len(chunk)
+        self.count("blob_bytes", size)
+
+        cid = bytes([1, RAW_CODEC, SHA2_256, digest.digest_size]) + digest.digest()
+        return {
+            "$type": "blob",
+            "ref": {"$link": self.encode_cid(cid)},
+            "mimeType": request.headers.get("Content-Type", "application/octet-stream"),
+            "size": size,
+        }
+
+    @staticmethod
+    def encode_cid(cid: bytes) -> str:
+        return "b" + base64.b32encode(cid).decode().lower().rstrip("=")
+
+    @staticmethod
+    def read_body(request: BaseHTTPRequestHandler) -> t.Iterator[bytes]:
+        """Stream the request body, sent with a length or in chunks"""
+        if request.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            while size := int(request.rfile.readline().split(b";")[0], 16):
+                yield request.rfile.read(size)
+                request.rfile.readline()
+            request.rfile.readline()
+            return
+
+        remaining = int(request.headers.get("Content-Length", 0))
+        while remaining > 0:
+            chunk = request.rfile.read(min(remaining, 64 * 1024))
+            if not chunk:
+                return
+            remaining -= len(chunk)
+            yield chunk
+
+    @staticmethod
+    def respond(
+        request: BaseHTTPRequestHandler,
+        status: int,
+        body: bytes = b"",
+        headers: t.Mapping[str, str] | None = None,
+        send_body: bool = True,
+    ) -> None:
+        request.send_response(status)
+        for name, value in (headers or {}).items():
+            request.send_header(name, value)
+        request.send_header("Content-Length", str(len(body)))
+        request.end_headers()
+        if send_body:
+            request.wfile.write(body)
+
+
+class FakePDS(FakeService):
+    """XRPC endpoints the scheduler uses to log in and publish.
+
+    Records are kept in memory so published posts can be looked up again. Writes and
+    blob uploads are answered with a 429 or a 5xx error at the given rates.
+    """
+
+    def __init__(
+        self,
+        latency: timedelta = timedelta(),
+        throttle_rate: float = 0.0,
+        error_rate: float = 0.0,
+        seed: int = 0,
+    ) -> None:
+        super().__init__(latency)
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.records: dict[tuple[str, str, str], tuple[str, dict]] = {}
+        self.window_start = time.time()
+        self.window_requests = 0
+
+        self.routes = {
+            "com.atproto.server.createSession": self.create_session,
+            "com.atproto.server.refreshSession": self.refresh_session,
+            GET_SERVICE_AUTH_NSID: self.get_service_auth,
+            "app.bsky.actor.getProfile": self.get_profile,
+            "com.atproto.identity.resolveHandle": self.resolve_handle,
+            "com.atproto.repo.uploadBlob": self.upload_blob,
+            "com.atproto.repo.createRecord": self.create_record,
+            "com.atproto.repo.applyWrites": self.apply_writes,
+            "com.atproto.repo.getRecord": self.get_record,
+        }
+
+    def handle(self, request: BaseHTTPRequestHandler, method: str) -> None:
+        url = urlparse(request.path)
+        nsid = url.path.rsplit("/", 1)[-1]
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        self.count(nsid)
+
+        route = self.routes.get(nsid)
+        if route is None:
+            self.respond_json(
+                request, 501, {"error": "MethodNotImplemented", "message": nsid}
+            )
+            return
+
+        if nsid in FAULTY_NSIDS:
+            with self.lock:
+                fault = self.random.random()
+                error_status = self.random.choice((500, 502, 503))
+            if fault < self.throttle_rate:
+                # Drain the request so the connection can be reused
+                for _ in self.read_body(request):
+                    pass
+                self.count("throttled")
+                self.respond_json(
+                    request,
+                    429,
+                    {"error": "RateLimitExceeded", "message": "Rate Limit Exceeded"},
+                    remaining=0,
+                )
+                return
+            if fault < self.throttle_rate + self.error_rate:
+                for _ in self.read_body(request):
+                    pass
+                self.count("errors")
+                self.respond_json(
+                    request,
+                    error_status,
+                    {"error": "InternalServerError", "message": "Injected error"},
+                )
+                return
+
+        status, body = route(request, params)
+        self.respond_json(request, status, body)
+
+    def respond_json(
+        self,
+        request: BaseHTTPRequestHandler,
+        status: int,
+        body: dict,
+        remaining: int | None = None,
+    ) -> None:
+        limit, window = PDS_RATE_LIMIT
+        window_seconds = int(window.total_seconds())
+        now = time.time()
+        with self.lock:
+            if now - self.window_start >= window_seconds:
+                self.window_start = now
+                self.window_requests = 0
+            self.window_requests += 1
+            if remaining is None:
+                remaining = max(limit - self.window_requests, 0)
+            # A throttled client may try again after a second
+            reset_at = now + 1 if remaining == 0 else self.window_start + window_seconds
+
+        self.respond(
+            request,
+            status,
+            json.dumps(body).encode(),
+            {
+                "Content-Type": "application/json; charset=utf-8",
+                "ratelimit-limit": str(limit),
+                "ratelimit-remaining": str(remaining),
+                "ratelimit-reset": str(int(reset_at)),
+                "ratelimit-policy": f"{limit};w={window_seconds}",
+            },
+        )
+
+    def create_session(self, request: BaseHTTPRequestHandler, params: dict):
+        handle = json.loads(b"".join(self.read_body(request)))["identifier"]
+        return 200, self.session(handle)
+
+    def refresh_session(self, request: BaseHTTPRequestHandler, params: dict):
+        token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        return 200, self.session(self.token_subject(token))
+
+    def get_service_auth(self, request: BaseHTTPRequestHandler, params: dict):
+        token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        return 200, {"token": self.token(self.token_subject(token), params["lxm"])}
+
+    def get_profile(self, request: BaseHTTPRequestHandler, params: dict):
+        handle = params["actor"]
+        if handle.startswith("did:"):
+            handle = self.token_subject(
+                request.headers.get("Authorization", "").removeprefix("Bearer ")
+            )
+        return 200, {"did": self.did(handle), "handle": handle}
+
+    def resolve_handle(self, request: BaseHTTPRequestHandler, params: dict):
+        return 200, {"did": self.did(params["handle"])}
+
+    def upload_blob(self, request: BaseHTTPRequestHandler, params: dict):
+        return 200, {"blob": self.read_blob(request)}
+
+    def create_record(self, request: BaseHTTPRequestHandler, params: dict):
+        data = json.loads(b"".join(self.read_body(request)))
+        cid, uri = self.store(
+            data["repo"], data["collection"], data.get("rkey"), data["record"]
+        )
+        return 200, {"uri": uri, "cid": cid}
+
+    def apply_writes(self, request: BaseHTTPRequestHandler, params: dict):
+        data = json.loads(b"".join(self.read_body(request)))
+        for write in data["writes"]:
+            self.store(
+                data["repo"], write["collection"], write.get("rkey"), write["value"]
+            )
+        self.count("records", len(data["writes"]))
+        return 200, {}
+
+    def get_record(self, request: BaseHTTPRequestHandler, params: dict):
+        key = (params["repo"], params["collection"], params["rkey"])
+        with self.lock:
+            stored = self.records.get(key)
+        if stored is None:
+            return 400, {
+                "error": "RecordNotFound",
+                "message": "Could not locate record",
+            }
+
+        cid, record = stored
+        return 200, {"uri": self.uri(*key), "cid": cid, "value": record}
+
+    def store(
+        self, did: str, collection: str, rkey: str | None, record: dict
+    ) -> tuple[str, str]:
+        rkey = rkey or f"{len(self.records):013d}"
+        cid = record_cid(record)
+        with self.lock:
+            self.records[(did, collection, rkey)] = (cid, record)
+        return cid, self.uri(did, collection, rkey)
+
+    def session(self, handle: str) -> dict:
+        return {
+            "did": self.did(handle),
+            "handle": handle,
+            "accessJwt": self.token(handle, "com.atproto.access"),
+            "refreshJwt": self.token(handle, "com.atproto.refresh"),
+        }
+
+    @staticmethod
+    def uri(did: str, collection: str, rkey: str) -> str:
+        return f"at://{did}/{collection}/{rkey}"
+
+    @staticmethod
+    def did(handle: str) -> str:
+        digest = hashlib.sha256(handle.encode()).digest()
+        return "did:plc:" + base64.b32encode(digest).decode().lower()[:24]
+
+    @staticmethod
+    def token(handle: str, scope: str) -> str:
+        """Unsigned JWT, clients only read its expiry"""
+        now = int(time.time())
+        payload = {
+            "scope": scope,
+            "sub": handle,
+            "iat": now,
+            "exp": now + int(SESSION_LIFETIME.total_seconds()),
+        }
+        return ".".join(
+            base64.urlsafe_b64encode(segment).decode().rstrip("=")
+            for segment in (
+                json.dumps({"alg": "none", "typ": "JWT"}).encode(),
+                json.dumps(payload).encode(),
+                b"unsigned",
+            )
+        )
+
+    @staticmethod
+    def token_subject(token: str) -> str:
+        payload = token.split(".")[1]
+        return json.loads(
+            base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4))
+        )["sub"]
+
+
+class FakeVideoService(FakeService):
+    """uploadVideo and getJobStatus of Bluesky's video service.
+
+    An upload starts a job that completes after the given number of getJobStatus
+    polls. Videos named invalid.* fail processing instead.
+    """
+
+    def __init__(self, latency: timedelta = timedelta(), polls: int = 1) -> None:
+        super().__init__(latency)
+        self.polls = polls
+        self.jobs: dict[str, dict] = {}
+
+    def handle(self, request: BaseHTTPRequestHandler, method: str) -> None:
+        url = urlparse(request.path)
+        nsid = url.path.rsplit("/", 1)[-1]
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        self.count(nsid)
+
+        if nsid == UPLOAD_VIDEO_NSID and method == "POST":
+            status, body = self.upload_video(request, params)
+        elif nsid == GET_JOB_STATUS_NSID and method == "GET":
+            status, body = self.get_job_status(request, params)
+        else:
+            status, body = 501, {"error": "MethodNotImplemented", "message": nsid}
+
+        self.respond(
+            request,
+            status,
+            json.dumps(body).encode(),
+            {"Content-Type": "application/json; charset=utf-8"},
+        )
+
+    def upload_video(self, request: BaseHTTPRequestHandler, params: dict):
+        if not request.headers.get("Authorization", "").startswith("Bearer "):
+            for _ in self.read_body(request):
+                pass
+            return 401, {"error": "AuthMissing", "message": "Service auth required"}
+
+        blob = self.read_blob(request)
+        job = {
+            "jobId": blob["ref"]["$link"],
+            "did": params["did"],
+            "state": "JOB_STATE_CREATED",
+        }
+        with self.lock:
+            self.jobs[job["jobId"]] = {
+                "status": job,
+                "blob": blob,
+                "polls": self.polls,
+                "fails": params["name"].startswith("invalid."),
+            }
+        return 200, dict(job)
+
+    def get_job_status(self, request: BaseHTTPRequestHandler, params: dict):
+        with self.lock:
+            job = self.jobs.get(params["jobId"])
+            if job is None:
+                return 404, {"error": "NotFound", "message": "Job not found"}
+
+            job["polls"] -= 1
+            if job["polls"] <= 0 and job["fails"]:
+                job["status"] = {
+                    **job["status"],
+                    "state": "JOB_STATE_FAILED",
+                    "error": "Unsupported video",
+                }
+            elif job["polls"] <= 0:
+                job["status"] = {
+                    **job["status"],
+                    "state": "JOB_STATE_COMPLETED",
+                    "blob": job["blob"],
+                }
+            return 200, {"jobStatus": job["status"]}
+
+
+class FakeS3(FakeService):
+    """Bucket serving generated media of a fixed size for any key.
+
+    Objects are distinct per key and never change, so conditional requests with the
+    ETag of a cached copy are answered with 304 Not Modified.
+    """
+
+    def __init__(
+        self, bucket_name: str, object_size: int, latency: timedelta = timedelta()
+    ) -> None:
+        super().__init__(latency)
+        self.bucket_name = bucket_name
+        self.object_size = object_size
+        self.filler = random.Random(0).randbytes(object_size)
+
+    def handle(self, request: BaseHTTPRequestHandler, method: str) -> None:
+        self.count(method)
+        # Keys are addressed path-style, /bucket/key
+        bucket_name, _, key = urlparse(request.path).path.lstrip("/").partition("/")
+        if method not in ("GET", "HEAD") or bucket_name != self.bucket_name or not key:
+            self.respond(
+                request,
+                404,
+                b"<Error><Code>NoSuchKey</Code></Error>",
+                {"Content-Type": "application/xml"},
+                send_body=method != "HEAD",
+            )
+            return
+
+        body = (key.encode() + self.filler)[: self.object_size]
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        if request.headers.get("If-None-Match") == etag:
+            self.respond(request, 304, headers={"ETag": etag}, send_body=False)
+            return
+
+        if method == "GET":
+            self.count("bytes", len(body))
+        self.respond(
+            request,
+            200,
+            body,
+            {"Content-Type": "image/jpeg", "ETag": etag},
+            send_body=method == "GET",
+        )
@@ -0,0 +1,351 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+import fcntl
+import hashlib
+import json
+import os
+from threading import Lock
+import time
+import typing as t
+from uuid import uuid4
+
+from atproto_client.models.blob_ref import BlobRef
+
+from atproto_scheduler.settings import (
+    MEDIA_BLOB_REF_TTL,
+    MEDIA_CACHE_DIR,
+    MEDIA_CACHE_MAX_BYTES,
+    MEDIA_PREFETCH_HORIZON,
+)
+
+
+class MediaFile(t.NamedTuple):
+    """Cached media opened for reading. The file stays readable after the cache evicts
+    it, so uploads are never cut short. Use as a context manager to close it."""
+
+    file: t.BinaryIO
+    content_hash: str
+    size: int
+
+    def __enter__(self) -> "MediaFile":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.file.close()
+
+
+class MediaCache:
+    """Content-addressed on-disk cache of S3 media and the blob refs they were uploaded as.
+
+    Media is streamed to disk in chunks, stored once per content hash and evicted least
+    recently used first once the cache grows beyond max_bytes. The index maps S3 key to (ETag, content hash)
+    and (account, content hash) to the blob ref previously returned by its PDS.
+    Images prefetched ahead of their post are staged and served without revalidation.
+
+    Scheduler processes sharing the cache directory share the index. Each change is
+    made under a lock file, to the index as last written by any process, so no process
+    overwrites the entries of another and eviction counts the files of all of them.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int) -> None:
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(cache_dir, "index.json")
+        self.lock = Lock()
+
+        self.objects: dict[str, list[str]] = {}
+        self.files: OrderedDict[str, int] = OrderedDict()
+        self.blob_refs: dict[str, list] = {}
+        self.staged: dict[str, float] = {}
+        self.stats = {"hits": 0, "misses": 0, "blob_hits": 0, "bytes_saved": 0}
+        # Identity of the index file last loaded or written, and the files read since,
+        # whose recent use is kept when the index of another process is loaded
+        self.index_version: tuple | None = None
+        self.recently_used: dict[str, None] = {}
+
+        # The directory is created by the first write, importing the cache touches
+        # no disk
+        self._load_index()
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / lookups if lookups else 0.0
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(self.files.values())
+
+    def get_etag(self, s3_key: str) -> str | None:
+        """Return the ETag of the cached copy of an S3 object, if any
+
+        Args:
+            s3_key (str): Full S3 key of the image
+
+        Returns:
+            str | None: ETag to send as IfNoneMatch
+        """
+        with self.lock:
+            self._refresh_index()
+            entry = self.objects.get(s3_key)
+            if entry and entry[1] in self.files:
+                return entry[0]
+            return None
+
+    def get_media(self, s3_key: str, etag: str) -> MediaFile | None:
+        """Open cached media for an S3 key and ETag
+
+        Args:
+            s3_key (str): Full S3 key of the media
+            etag (str): ETag the cached copy must match
+
+        Returns:
+            MediaFile | None: Open media file, or None on a cache miss
+        """
+        with self.lock:
+            self._refresh_index()
+            entry = self.objects.get(s3_key)
+            if not entry or entry[0] != etag or entry[1] not in self.files:
+                return None
+
+            try:
+                media = self._open(entry[1])
+            except OSError:
+                self.files.pop(entry[1], None)
+                return None
+
+            self.files.move_to_end(entry[1])
+            self.recently_used[entry[1]] = None
+            self.stats["hits"] += 1
+            self.stats["bytes_saved"] += media.size
+            return media
+
+    def stage(self, s3_key: str) -> None:
+        """Mark a cached S3 object as prefetched for an upcoming post
+
+        Args:
+            s3_key (str): Full S3 key of the image
+        """
+        with self._updating_index():
+            self.staged[s3_key] = time.time()
+
+    def get_staged_media(self, s3_key: str) -> MediaFile | None:
+        """Open media prefetched within MEDIA_PREFETCH_HORIZON
+
+        Args:
+            s3_key (str): Full S3 key of the media
+
+        Returns:
+            MediaFile | None: Open media file, or None if the media is not staged
+        """
+        with self.lock:
+            self._refresh_index()
+            staged_at = self.staged.get(s3_key)
+            entry = self.objects.get(s3_key)
+
+        if not staged_at or not entry:
+            return None
+
+        if time.time() - staged_at > MEDIA_PREFETCH_HORIZON.total_seconds():
+            return None
+
+        return self.get_media(s3_key, entry[0])
+
+    def put_media(self, s3_key: str, etag: str, chunks: t.Iterable[bytes]) -> MediaFile:
+        """Store media streamed from S3, holding one chunk in memory at a time.
+        Each download counts as a cache miss.
+
+        Args:
+            s3_key (str): Full S3 key of the media
+            etag (str): ETag returned by S3
+            chunks (Iterable[bytes]): Media contents
+
+        Returns:
+            MediaFile: The stored media, opened for reading
+        """
+        # Written outside the lock, a large download must not block other lookups
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = os.path.join(self.cache_dir, f"{uuid4().hex}.tmp")
+        content_hash = hashlib.sha256()
+        size = 0
+        try:
+            with open(tmp_path, "wb") as f:
+                for chunk in chunks:
+                    content_hash.update(chunk)
+                    size += len(chunk)
+                    f.write(chunk)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        content_hash = content_hash.hexdigest()
+
+        with self._updating_index():
+            os.replace(tmp_path, self._file_path(content_hash))
+            media = self._open(content_hash)
+
+            self.files[content_hash] = size
+            self.files.move_to_end(content_hash)
+            self.objects[s3_key] = [etag, content_hash]
+            self.stats["misses"] += 1
+
+        return media
+
+    def get_blob_ref(self, bluesky_username: str, media: MediaFile) -> BlobRef | None:
+        """Return a blob ref previously uploaded by this account for identical media
+
+        Args:
+            bluesky_username (str): Account the blob was uploaded to
+            media (MediaFile): Media contents
+
+        Returns:
+            BlobRef | None: Reusable blob ref, or None if none is known or it has expired
+        """
+        key = f"{bluesky_username}:{media.content_hash}"
+
+        with self.lock:
+            self._refresh_index()
+            entry = self.blob_refs.get(key)
+            if not entry:
+                return None
+
+            stored_at, blob_ref = entry
+            if time.time() - stored_at > MEDIA_BLOB_REF_TTL.total_seconds():
+                del self.blob_refs[key]
+                return None
+
+            self.stats["blob_hits"] += 1
+            self.stats["bytes_saved"] += media.size
+            return BlobRef.model_validate_json(blob_ref)
+
+    def put_blob_refs(
+        self,
+        bluesky_username: str,
+        blob_refs: t.List[t.Tuple[str, BlobRef]],
+    ) -> None:
+        """Remember blob refs referenced by records written to the account.
+        Unreferenced blobs are deleted by the PDS, so only written blobs are reusable.
+
+        Args:
+            bluesky_username (str): Account the blobs were uploaded to
+            blob_refs (list[tuple[str, BlobRef]]): Content hash of each media and its blob ref
+        """
+        if not blob_refs:
+            return
+
+        with self._updating_index():
+            for content_hash, blob_ref in blob_refs:
+                self.blob_refs[f"{bluesky_username}:{content_hash}"] = [
+                    time.time(),
+                    blob_ref.model_dump_json(by_alias=True),
+                ]
+
+    def drop_blob_refs(
+        self, bluesky_username: str, content_hashes: t.List[str]
+    ) -> None:
+        """Forget blob refs of the account, e.g. after a write using them failed
+
+        Args:
+            bluesky_username (str): Account the blobs were uploaded to
+            content_hashes (list[str]): Content hashes of the media
+        """
+        keys = [f"{bluesky_username}:{h}" for h in content_hashes]
+        with self.lock:
+            self._refresh_index()
+            if not any(key in self.blob_refs for key in keys):
+                return
+
+        with self._updating_index():
+            for key in keys:
+                self.blob_refs.pop(key, None)
+
+    def _file_path(self, content_hash: str) -> str:
+        return os.path.join(self.cache_dir, content_hash)
+
+    def _open(self, content_hash: str) -> MediaFile:
+        file = open(self._file_path(content_hash), "rb")
+        return MediaFile(file, content_hash, os.fstat(file.fileno()).st_size)
+
+    def _evict(self) -> None:
+        """Remove least recently used files until the cache fits in max_bytes"""
+        total_bytes = self.total_bytes
+        while total_bytes > self.max_bytes and len(self.files) > 1:
+            content_hash, size = self.files.popitem(last=False)
+            total_bytes -= size
+            try:
+                os.remove(self._file_path(content_hash))
+            except OSError:
+                pass
+
+        self.objects = {
+            s3_key: entry
+            for s3_key, entry in self.objects.items()
+            if entry[1] in self.files
+        }
+        self.staged = {
+            s3_key: staged_at
+            for s3_key, staged_at in self.staged.items()
+            if s3_key in self.objects
+        }
+
+    @contextmanager
+    def _updating_index(self):
+        """Change the index as last written by any process sharing the cache
+        directory, then evict and write it back, all under the lock file"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with self.lock, open(f"{self.index_path}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._refresh_index()
+                yield
+                self._evict()
+                self._save_index()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _index_version(self) -> tuple | None:
+        # The index is replaced by a new file on every write
+        try:
+            stat = os.stat(self.index_path)
+        except OSError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def _refresh_index(self) -> None:
+        """Load the index if another process wrote it since it was last loaded"""
+        if self._index_version() != self.index_version:
+            self._load_index()
+
+    def _load_index(self) -> None:
+        version = self._index_version()
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        self.index_version = version
+        self.objects = index.get("objects", {})
+        self.files = OrderedDict(index.get("files", []))
+        self.blob_refs = index.get("blob_refs", {})
+        self.staged = index.get("staged", {})
+        for content_hash in self.recently_used:
+            if content_hash in self.files:
+                self.files.move_to_end(content_hash)
+
+    def _save_index(self) -> None:
+        index = {
+            "objects": self.objects,
+            "files": list(self.files.items()),
+            "blob_refs": self.blob_refs,
+            "staged": self.staged,
+        }
+        # Unique per write, a crashed writer never leaves a file another one reuses
+        tmp_path = f"{self.index_path}.{uuid4().hex}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self.index_path)
+        self.index_version = self._index_version()
+        self.recently_used.clear()
+
+
+media_cache = MediaCache(MEDIA_CACHE_DIR, MEDIA_CACHE_MAX_BYTES)
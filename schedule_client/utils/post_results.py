@@ -0,0 +1,289 @@
+from contextlib import contextmanager
+from datetime import datetime
+import fcntl
+import json
+import os
+from threading import Lock
+
+from django.db import transaction
+from django.utils import timezone
+
+from atproto_scheduler.settings import POST_RESULTS_JOURNAL
+from posts.models import Post
+
+
+class PostResultJournal:
+    """Buffer of post status changes made during a tick, written to the database in one transaction.
+
+    With a journal path, every result is appended and fsynced to a journal file before the
+    tick moves on, so results that were never flushed (e.g. after a crash) are applied at
+    the next flush instead of the post being published again. Scheduler processes sharing
+    the journal serialize on a lock file next to it. The file must be on storage that
+    survives restarts and deploys to help.
+
+    Without a journal path, results are kept in memory until the next flush. Posts whose
+    results are lost in a crash are claimed again once their lease expires, and found
+    already published by their record key.
+    """
+
+    def __init__(self, journal_path: str | None) -> None:
+        self.journal_path = journal_path
+        self.lock = Lock()
+        self.pending: list[dict] = []
+        # Publish lag, how long after its scheduled time each post was published
+        self.stats = {"posted": 0, "lag_seconds_total": 0.0, "lag_seconds_max": 0.0}
+
+    def add_posted(self, post_id: int, cid: str, uri: str) -> None:
+        """Record a published post
+
+        Args:
+            post_id (int): Unique identifier of post
+            cid (str): CID response value from Bluesky
+            uri (str): URI response value from Bluesky
+        """
+        self._append(
+            {
+                "id": post_id,
+                "posted_at": timezone.now().isoformat(),
+                "cid": cid,
+                "uri": uri,
+            }
+        )
+
+    def add_draft(self, post_id: int, last_error: str | None = None) -> None:
+        """Record a post that failed and should become a draft
+
+        Args:
+            post_id (int): Unique identifier of post
+            last_error (str | None): Class name of the error that made the post fail
+        """
+        self._append({"id": post_id, "is_draft": True, "last_error": last_error})
+
+    def add_retry(
+        self,
+        post_id: int,
+        attempt_count: int,
+        next_attempt_at: datetime,
+        last_error: str,
+    ) -> None:
+        """Record a post that failed transiently and should be attempted again
+
+        Args:
+            post_id (int): Unique identifier of post
+            attempt_count (int): Attempts made so far
+            next_attempt_at (datetime): When the post is due for another attempt
+            last_error (str): Class name of the error of the last attempt
+        """
+        self._append(
+            {
+                "id": post_id,
+                "attempt_count": attempt_count,
+                "next_attempt_at": next_attempt_at.isoformat(),
+                "last_error": last_error,
+            }
+        )
+
+    def add_deferred(
+        self, post_id: int, deferred_until: datetime, is_retry: bool = False
+    ) -> None:
+        """Record a post that was throttled and should be published later
+
+        Args:
+            post_id (int): Unique identifier of post
+            deferred_until (datetime): New scheduled time of the post
+            is_retry (bool): The post is waiting for another attempt, its retry is
+                moved to deferred_until as well
+        """
+        self._append(
+            {
+                "id": post_id,
+                "deferred_until": deferred_until.isoformat(),
+                "is_retry": is_retry,
+            }
+        )
+
+    def flush(self) -> None:
+        """Apply all journaled results to the posts table and clear the journal.
+        Every result also releases the post's claim.
+        """
+        with self._locked():
+            results = self._read()
+            if not results:
+                return
+
+            now = timezone.now()
+            released = {
+                "claimed_by": None,
+                "claim_expires_at": None,
+                "updated_at": now,
+            }
+            posted_posts = [
+                Post(
+                    id=result["id"],
+                    posted_at=datetime.fromisoformat(result["posted_at"]),
+                    cid=result["cid"],
+                    uri=result["uri"],
+                    # The record key is part of uri, a new key is needed if the
+                    # post is reset to be published again
+                    rkey=None,
+                    attempt_count=0,
+                    next_attempt_at=None,
+                    last_error=None,
+                    **released,
+                )
+                for result in results
+                if "posted_at" in result
+            ]
+            retry_posts = [
+                Post(
+                    id=result["id"],
+                    attempt_count=result["attempt_count"],
+                    next_attempt_at=datetime.fromisoformat(result["next_attempt_at"]),
+                    last_error=result["last_error"],
+                    **released,
+                )
+                for result in results
+                if "next_attempt_at" in result
+            ]
+            deferred_posts = [
+                Post(
+                    id=result["id"],
+                    scheduled_post_time=datetime.fromisoformat(
+                        result["deferred_until"]
+                    ),
+                    # A retry left in the past would be due again on the next tick
+                    next_attempt_at=(
+                        datetime.fromisoformat(result["deferred_until"])
+                        if result.get("is_retry")
+                        else None
+                    ),
+                    **released,
+                )
+                for result in results
+                if "deferred_until" in result
+            ]
+            draft_posts = [
+                Post(
+                    id=result["id"],
+                    is_draft=True,
+                    attempt_count=0,
+                    next_attempt_at=None,
+                    last_error=result.get("last_error"),
+                    **released,
+                )
+                for result in results
+                if "is_draft" in result
+            ]
+
+            self._record_lag(posted_posts)
+
+            with transaction.atomic():
+                Post.objects.bulk_update(
+                    posted_posts,
+                    [
+                        "posted_at",
+                        "cid",
+                        "uri",
+                        "rkey",
+                        "attempt_count",
+                        "next_attempt_at",
+                        "last_error",
+                        *released,
+                    ],
+                )
+                Post.objects.bulk_update(
+                    retry_posts,
+                    ["attempt_count", "next_attempt_at", "last_error", *released],
+                )
+                Post.objects.bulk_update(
+                    deferred_posts,
+                    ["scheduled_post_time", "next_attempt_at", *released],
+                )
+                Post.objects.bulk_update(
+                    draft_posts,
+                    [
+                        "is_draft",
+                        "attempt_count",
+                        "next_attempt_at",
+                        "last_error",
+                        *released,
+                    ],
+                )
+
+            if self.journal_path:
+                os.remove(self.journal_path)
+            else:
+                self.pending.clear()
+
+    def _record_lag(self, posted_posts: list[Post]) -> None:
+        """Add the publish lag of posts to the stats and print it.
+        Thread replies have no scheduled time of their own and are not counted.
+        """
+        scheduled_times = dict(
+            Post.objects.filter(id__in=[post.id for post in posted_posts])
+            .exclude(scheduled_post_time=None)
+            .values_list("id", "scheduled_post_time")
+        )
+        lags = [
+            (post.posted_at - scheduled_times[post.id]).total_seconds()
+            for post in posted_posts
+            if post.id in scheduled_times
+        ]
+        if not lags:
+            return
+
+        self.stats["posted"] += len(lags)
+        self.stats["lag_seconds_total"] += sum(lags)
+        self.stats["lag_seconds_max"] = max(self.stats["lag_seconds_max"], *lags)
+        print(
+            f"Published {len(lags)} posts {sum(lags) / len(lags):.1f}s after their "
+            f"scheduled time on average, at most {max(lags):.1f}s"
+        )
+
+    @contextmanager
+    def _locked(self):
+        if not self.journal_path:
+            with self.lock:
+                yield
+            return
+
+        with self.lock, open(f"{self.journal_path}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _append(self, result: dict) -> None:
+        with self._locked():
+            if not self.journal_path:
+                self.pending.append(result)
+                return
+
+            with open(self.journal_path, "a") as f:
+                f.write(f"{json.dumps(result)}\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _read(self) -> list[dict]:
+        if not self.journal_path:
+            return list(self.pending)
+
+        try:
+            with open(self.journal_path) as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return []
+
+        results = []
+        for line in lines:
+            try:
+                results.append(json.loads(line))
+            except ValueError:
+                # Partially written last line from a crash mid-write
+                continue
+
+        return results
+
+
+post_results = PostResultJournal(POST_RESULTS_JOURNAL)
@@ -0,0 +1,484 @@
+"""Publishing logic shared by the sync and asyncio clients.
+
+The clients only differ in how they send requests. Everything else, from preparing a
+thread to recovering a post published by an earlier attempt, deciding what happens to
+a post after each request and polling a video job, is written once here.
+
+The shared logic is written as generators of steps. A step is a transport method of
+the client and its arguments, e.g. ``(self._get_record, params)``. The client's _run
+sends each step, synchronously or awaited, and resumes the generator with its result
+or raises its error into it. A client only implements _run and the transport methods.
+"""
+
+from datetime import datetime
+import time
+import typing as t
+
+from atproto import models
+from atproto.exceptions import BadRequestError, UnauthorizedError
+from atproto_client.models.blob_ref import BlobRef
+
+from atproto_scheduler.settings import (
+    DEFERRED_POST_SPACING,
+    VIDEO_POLL_INTERVAL,
+    VIDEO_PROCESSING_TIMEOUT,
+)
+from schedule_client.utils.data_models import PostObject
+from schedule_client.utils.django_client import PostClient
+from schedule_client.utils.facets import Facet
+from schedule_client.utils.media_cache import media_cache
+from schedule_client.utils.rate_limiter import RateLimited
+from schedule_client.utils.records import (
+    Thread,
+    batch_threads,
+    build_thread_writes,
+    is_record_not_found,
+)
+from schedule_client.utils.retry_policy import is_transient
+from schedule_client.utils.video import completed_blob, job_status, video_embed
+
+# Yields (transport method, *args), is sent the result and returns the outcome
+Steps = t.Generator[tuple, t.Any, t.Any]
+
+
+class Publisher:
+    """Publishes the due posts of one account, whichever client sends its requests"""
+
+    def __init__(self, bluesky_username: str, post_client: PostClient) -> None:
+        self.bluesky_username = bluesky_username
+        self.post_client = post_client
+        # DID of the account, set by the client once logged in
+        self.did = None
+        self.deferred_until = None
+        # Content hash and blob ref of the media of each prepared thread, keyed by
+        # the ID of its first post. Cached once the thread is written.
+        self.thread_blobs: t.Dict[int, t.List[t.Tuple[str, BlobRef]]] = {}
+
+    def _publish(self, posts: t.List[PostObject]) -> Steps:
+        """Publish posts, each together with its thread replies, in the order they
+        were scheduled. The threads are written in as few applyWrites calls as
+        possible.
+
+        Args:
+            posts (list[PostObject]): Due posts of this account
+        """
+        threads = []
+        for post in posts:
+            thread = yield from self._prepare_thread(post)
+            if thread:
+                threads.append(thread)
+
+        for batch in batch_threads(threads):
+            yield from self._apply_writes(batch)
+
+    def _prepare_thread(self, post: PostObject) -> Steps:
+        """Build the facets and embeds of a post and its replies
+
+        Returns:
+            Thread | None: The thread ready to be written, or None if the post was deferred, failed or is already published
+        """
+        if self.deferred_until:
+            self._defer_post(post, self.deferred_until)
+            return None
+
+        # A post claimed before may have been published by an attempt whose result
+        # was never recorded
+        if post.rkey_reused:
+            try:
+                if (yield from self._recover_thread(post)):
+                    return None
+            except Exception as err:
+                yield from self._set_post_failed(post, err)
+                return None
+
+        thread = []
+        blobs = []
+        for thread_post in (post, *post.thread_replies):
+            # Get hyperlinks, mentions and hashtags
+            facets = (yield from self._build_facets(thread_post.facets)) or None
+            try:
+                embed = yield from self._build_embed(thread_post, blobs)
+            except RateLimited as err:
+                self._defer_post(post, err.retry_at)
+                return None
+            except Exception as err:
+                yield from self._set_post_failed(post, err)
+                return None
+            thread.append((thread_post, facets, embed))
+
+        self.thread_blobs[post.id] = blobs
+        return thread
+
+    def _build_embed(self, post: PostObject, blobs: list) -> Steps:
+        """Upload the images or video of a post, or build its link card
+
+        Args:
+            post (PostObject): Post of the thread
+            blobs (list[tuple[str, BlobRef]]): Collects the content hash and blob ref of each media used
+
+        Returns:
+            models.AppBskyEmbedImages.Main | dict | models.AppBskyEmbedExternal.Main | None: Embed of the post record
+
+        Raises:
+            RateLimited: An upload was throttled
+            Exception: The media could not be uploaded
+        """
+        # The embed was planned when the post was rendered, only media is uploaded now
+        if post.embed == "images":
+            images = yield from self._upload_images(post.image_urls_with_alts, blobs)
+            return models.AppBskyEmbedImages.Main(images=images)
+
+        if post.embed == "video":
+            return (yield from self._upload_video(post.video, post.video_alt, blobs))
+
+        if post.embed == "link_card":
+            return link_card_embed(post)
+
+        return None
+
+    def _apply_writes(self, threads: t.List[Thread]) -> Steps:
+        """Write the records of several threads in one applyWrites call.
+        The call succeeds or fails as a whole.
+
+        Args:
+            threads (list[Thread]): Threads ready to be written
+        """
+        writes = []
+        results = []
+        for thread in threads:
+            thread_writes, thread_results = build_thread_writes(self.did, thread)
+            writes += thread_writes
+            results += thread_results
+
+        print(f"Posting {len(writes)} records to {self.bluesky_username}")
+
+        try:
+            yield self._send_writes, writes
+        except RateLimited as err:
+            self._defer_threads(threads, err.retry_at)
+            return
+        except Exception as err:
+            if self._write_one_at_a_time(threads, err):
+                for thread in threads:
+                    yield from self._apply_writes([thread])
+                return
+
+            for thread in threads:
+                yield from self._set_post_failed(thread[0][0], err)
+            return
+
+        self._set_written(threads, results)
+
+    def _recover_thread(self, post: PostObject) -> Steps:
+        """Record a post and its replies as posted if an earlier attempt published them
+
+        Returns:
+            bool: The post is already published
+        """
+        record = yield from self._get_existing_record(post)
+        if not record:
+            return False
+
+        print(f"Post {post.id} was already published as {record.uri}")
+        self.post_client.set_as_posted(post.id, record.cid, record.uri)
+
+        # Replies were written in the same commit as the post
+        for reply in post.thread_replies:
+            reply_record = yield from self._get_existing_record(reply)
+            if reply_record:
+                self.post_client.set_as_posted(
+                    reply.id, reply_record.cid, reply_record.uri
+                )
+
+        return True
+
+    def _get_existing_record(self, post: PostObject) -> Steps:
+        """Look up the record stored under the post's record key
+
+        Returns:
+            models.ComAtprotoRepoGetRecord.Response | None: The record, or None if it does not exist
+
+        Raises:
+            BadRequestError: The lookup was rejected for another reason than a missing record
+        """
+        try:
+            return (yield self._get_record, record_params(self.did, post))
+        except BadRequestError as err:
+            if is_record_not_found(err):
+                return None
+            raise
+
+    def _upload_images(self, image_urls_with_alts: t.List[dict], blobs: list) -> Steps:
+        """Download images from S3 and upload them as blobs concurrently
+
+        Args:
+            image_urls_with_alts (list[dict]): Image paths paired with alt text
+            blobs (list[tuple[str, BlobRef]]): Collects the content hash and blob ref of each image
+
+        Returns:
+            list[models.AppBskyEmbedImages.Image]: Uploaded images in their original order
+
+        Raises:
+            RateLimited: An upload was throttled
+            Exception: The first error of any image that failed
+        """
+        # Every upload runs to its end and closes its file, even if another one fails
+        results = yield self._gather, [
+            self._upload_image(image_with_alt, blobs)
+            for image_with_alt in image_urls_with_alts
+        ]
+        err = first_error(results)
+        if err:
+            raise err
+        return results
+
+    def _upload_image(self, image_with_alt: dict, blobs: list) -> Steps:
+        """Download an image from S3 and upload it as a blob, unless this account
+        uploaded identical media before
+
+        Returns:
+            models.AppBskyEmbedImages.Image: The uploaded image
+        """
+        image_object = yield self._get_image_object, image_with_alt["image"]
+        with image_object:
+            blob = media_cache.get_blob_ref(self.bluesky_username, image_object)
+            if not blob:
+                blob = yield self._upload_blob, image_object
+            blobs.append((image_object.content_hash, blob))
+
+        return models.AppBskyEmbedImages.Image(
+            alt=image_with_alt["alt_text"], image=blob
+        )
+
+    def _upload_video(self, video_path: str, alt_text: str, blobs: list) -> Steps:
+        """Stream a video from S3 to the video service and wait for it to be processed
+
+        Args:
+            video_path (str): Relative location of the video in S3
+            alt_text (str): Alt text of the video
+            blobs (list[tuple[str, BlobRef]]): Collects the content hash and blob ref of the video
+
+        Returns:
+            dict: app.bsky.embed.video embed of the post record
+
+        Raises:
+            TimeoutError: The video is still processing after VIDEO_PROCESSING_TIMEOUT
+            VideoProcessingFailed: The video service could not process the video
+        """
+        video = yield self._get_video_object, video_path
+        with video:
+            blob = media_cache.get_blob_ref(self.bluesky_username, video)
+            if not blob:
+                token = yield (self._get_service_auth_token,)
+                job = job_status((yield self._send_video, video_path, video, token))
+
+                deadline = time.monotonic() + VIDEO_PROCESSING_TIMEOUT.total_seconds()
+                while not (blob := completed_blob(job)):
+                    if time.monotonic() > deadline:
+                        raise TimeoutError(f"Video {video_path} is still processing")
+                    yield self._sleep, VIDEO_POLL_INTERVAL.total_seconds()
+                    job = job_status((yield self._get_job_status, job["jobId"]))
+
+            blobs.append((video.content_hash, blob))
+
+        return video_embed(blob, alt_text)
+
+    def _build_facets(self, rendered_facets: t.List[dict]) -> Steps:
+        """Build rich text facets for links, mentions and hashtags.
+        Mentions whose handle cannot be resolved are left as plain text.
+
+        Args:
+            rendered_facets (list[dict]): Facets found when the post was rendered
+
+        Returns:
+            list[models.AppBskyRichtextFacet.Main]: Facets for the post record
+        """
+        facets = []
+        for facet in (Facet(**facet) for facet in rendered_facets):
+            did = None
+            if facet.kind == "mention":
+                try:
+                    did = yield self._resolve_handle, facet.value
+                except Exception as err:
+                    print(f"Could not resolve mention @{facet.value}: {err!r}")
+                    continue
+            facets.append(facet_model(facet, did))
+
+        return facets
+
+    def _set_post_failed(self, post: PostObject, err: Exception) -> Steps:
+        """Schedule a retry of a failed post or set it as a draft"""
+        if isinstance(err, UnauthorizedError):
+            yield (self._invalidate_session,)
+        self._fail_post(post, err)
+
+    def _defer_post(self, post: PostObject, retry_at: datetime) -> None:
+        """Reschedule a throttled post. Later posts of the account are deferred
+        after it so they keep their order."""
+        self.deferred_until = (
+            max(self.deferred_until or retry_at, retry_at) + DEFERRED_POST_SPACING
+        )
+        print(f"Rate limited, deferring post {post.id} to {self.deferred_until}")
+        self.post_client.defer_post(post, self.deferred_until)
+
+    def _defer_threads(self, threads: t.List[Thread], retry_at: datetime) -> None:
+        """Reschedule the threads of a throttled applyWrites call"""
+        for thread in threads:
+            # Blobs uploaded now may be deleted by the PDS before the retry
+            self.thread_blobs.pop(thread[0][0].id, None)
+            self._defer_post(thread[0][0], retry_at)
+
+    def _set_written(
+        self, threads: t.List[Thread], results: t.List[t.Tuple[int, str, str]]
+    ) -> None:
+        """Record the posts of a successful applyWrites call and cache the blob refs
+        their records reference"""
+        # applyWrites returns no results, the CIDs were computed with the records
+        for post_id, cid, uri in results:
+            self.post_client.set_as_posted(post_id, cid, uri)
+        print("Successfully posted to Bluesky.")
+
+        media_cache.put_blob_refs(
+            self.bluesky_username,
+            [
+                blob
+                for thread in threads
+                for blob in self.thread_blobs.pop(thread[0][0].id, [])
+            ],
+        )
+
+    def _fail_post(self, post: PostObject, err: Exception) -> None:
+        """Schedule a retry of a failed post or set it as a draft"""
+        print(f"Error with post: {post.text[:50]}")
+        print(repr(err))
+        self.post_client.set_post_failed(post, err)
+
+        # A cached blob ref whose blob is gone fails the write, the retry uploads
+        # the media again
+        blobs = self.thread_blobs.pop(post.id, [])
+        media_cache.drop_blob_refs(
+            self.bluesky_username, [content_hash for content_hash, _ in blobs]
+        )
+
+    @staticmethod
+    def _write_one_at_a_time(threads: t.List[Thread], err: Exception) -> bool:
+        """Whether to write the threads of a failed applyWrites call separately.
+        One invalid record rejects the whole call, written one at a time only the
+        invalid thread fails."""
+        return len(threads) > 1 and not is_transient(err)
+
+    # Transport methods, implemented by each client
+
+    def _get_record(
+        self, params: models.ComAtprotoRepoGetRecord.Params
+    ) -> models.ComAtprotoRepoGetRecord.Response:
+        raise NotImplementedError
+
+    def _send_writes(self, writes: t.List[models.ComAtprotoRepoApplyWrites.Create]):
+        """applyWrites call creating the records in one commit
+
+        Raises:
+            RateLimited: The call was throttled
+        """
+        raise NotImplementedError
+
+    def _get_image_object(self, image_path: str):
+        """Image from S3 through the media cache, as a MediaFile"""
+        raise NotImplementedError
+
+    def _get_video_object(self, video_path: str):
+        """Video from S3 through the media cache, as a MediaFile"""
+        raise NotImplementedError
+
+    def _upload_blob(self, media) -> BlobRef:
+        """Stream a MediaFile to the PDS
+
+        Raises:
+            RateLimited: The upload was throttled
+        """
+        raise NotImplementedError
+
+    def _get_service_auth_token(self) -> str:
+        """Token the video service can upload blobs to the account's repo with"""
+        raise NotImplementedError
+
+    def _send_video(self, video_path: str, video, token: str):
+        """Stream a MediaFile to the video service
+
+        Returns:
+            httpx.Response: The uploadVideo response
+        """
+        raise NotImplementedError
+
+    def _get_job_status(self, job_id: str):
+        """Returns the getJobStatus response of a video job"""
+        raise NotImplementedError
+
+    def _sleep(self, seconds: float) -> None:
+        raise NotImplementedError
+
+    def _resolve_handle(self, handle: str) -> str:
+        """Returns the DID of a handle"""
+        raise NotImplementedError
+
+    def _invalidate_session(self) -> None:
+        """Drop the session of the account after the PDS rejected it"""
+        raise NotImplementedError
+
+    def _gather(self, steps: t.List[Steps]) -> t.List[t.Any]:
+        """Run several step generators concurrently
+
+        Returns:
+            list: The outcome of each generator, or the exception it raised
+        """
+        raise NotImplementedError
+
+
+def facet_model(
+    facet: Facet, did: str | None = None
+) -> models.AppBskyRichtextFacet.Main:
+    """Rich text facet of a link, hashtag or a mention resolved to did"""
+    if facet.kind == "link":
+        feature = models.AppBskyRichtextFacet.Link(uri=facet.value)
+    elif facet.kind == "mention":
+        feature = models.AppBskyRichtextFacet.Mention(did=did)
+    else:
+        feature = models.AppBskyRichtextFacet.Tag(tag=facet.value)
+
+    return models.AppBskyRichtextFacet.Main(
+        features=[feature],
+        index=models.AppBskyRichtextFacet.ByteSlice(
+            byte_start=facet.byte_start, byte_end=facet.byte_end
+        ),
+    )
+
+
+def link_card_embed(post: PostObject) -> models.AppBskyEmbedExternal.Main | None:
+    """Link card of a post with a single link, a title and a description"""
+    if post.embed != "link_card":
+        return None
+
+    return models.AppBskyEmbedExternal.Main(
+        external=models.AppBskyEmbedExternal.External(
+            title=post.link_card_title,
+            description=post.link_card_description,
+            uri=post.links[0],
+        )
+    )
+
+
+def record_params(did: str, post: PostObject) -> models.ComAtprotoRepoGetRecord.Params:
+    """getRecord parameters of the record stored under a post's record key"""
+    return models.ComAtprotoRepoGetRecord.Params(
+        repo=did, collection=models.ids.AppBskyFeedPost, rkey=post.rkey
+    )
+
+
+def first_error(results: t.Iterable[t.Any]) -> BaseException | None:
+    """First error among results of concurrent uploads, a throttled one first so the
+    post is deferred rather than failed"""
+    errors = [result for result in results if isinstance(result, BaseException)]
+    for err in errors:
+        if isinstance(err, RateLimited):
+            return err
+    return errors[0] if errors else None
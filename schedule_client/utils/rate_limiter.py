@@ -0,0 +1,239 @@
+import asyncio
+from datetime import datetime, timedelta, timezone as dt_timezone
+from threading import Lock
+import time
+import typing as t
+from urllib.parse import urlparse
+from weakref import WeakSet
+
+from atproto.exceptions import RequestException
+
+from atproto_scheduler.settings import (
+    RATE_LIMIT_ACCOUNT_WRITES,
+    RATE_LIMIT_MAX_WAIT,
+    RATE_LIMIT_PDS_REQUESTS,
+)
+
+# Repo writes are limited per account, in points. Everything else is limited per PDS.
+ACCOUNT_WRITE_NSIDS = (
+    "com.atproto.repo.applyWrites",
+    "com.atproto.repo.createRecord",
+    "com.atproto.repo.deleteRecord",
+    "com.atproto.repo.putRecord",
+)
+CREATE_RECORD_POINTS = 3
+
+
+class RateLimited(Exception):
+    """Raised instead of sending a request that would exceed a rate limit"""
+
+    def __init__(self, retry_at: datetime) -> None:
+        super().__init__(f"Rate limited until {retry_at.isoformat()}")
+        self.retry_at = retry_at
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at capacity per window.
+    Tokens may go negative, which reserves future capacity for requests already waiting.
+    """
+
+    def __init__(self, capacity: int, window: timedelta) -> None:
+        self.capacity = capacity
+        self.window_seconds = window.total_seconds()
+        self.tokens = float(capacity)
+        self.updated_at = time.time()
+        self.blocked_until = 0.0
+
+    @property
+    def rate(self) -> float:
+        return self.capacity / self.window_seconds
+
+    def wait_time(self, cost: int, now: float) -> float:
+        """Seconds until cost tokens are available"""
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+        return max(self.blocked_until - now, (cost - self.tokens) / self.rate, 0.0)
+
+    def update(self, headers: t.Mapping[str, str], now: float) -> None:
+        """Adopt the limit reported by ratelimit-* response headers"""
+        try:
+            limit = int(headers["ratelimit-limit"])
+            remaining = int(headers["ratelimit-remaining"])
+            reset_at = float(headers["ratelimit-reset"])
+        except (KeyError, ValueError):
+            return
+
+        # Policy looks like "5000;w=3600"
+        for part in headers.get("ratelimit-policy", "").split(";")[1:]:
+            key, _, value = part.strip().partition("=")
+            if key == "w" and value.isdigit() and int(value) > 0:
+                self.window_seconds = int(value)
+
+        self.capacity = max(limit, 1)
+        # Requests reserved locally may not have reached the server yet
+        self.tokens = min(self.tokens, remaining)
+        self.updated_at = now
+        self.blocked_until = reset_at if remaining <= 0 else 0.0
+
+
+class RateLimiter:
+    """Process-wide token buckets per account and per PDS.
+
+    Buckets start from the documented Bluesky limits and follow the ratelimit-*
+    headers of every response once a client is watched. Requests wait for their
+    tokens up to RATE_LIMIT_MAX_WAIT, beyond that RateLimited is raised so the post
+    can be deferred instead of failing with a 429.
+    """
+
+    def __init__(self) -> None:
+        self.buckets: dict[str, TokenBucket] = {}
+        self.lock = Lock()
+        self.watched: WeakSet = WeakSet()
+        self.stats = {"waits": 0, "seconds_waited": 0.0, "throttled": 0}
+
+    def watch(self, client: t.Any, bluesky_username: str) -> None:
+        """Follow the rate limit headers of every response received by an atproto client
+
+        Args:
+            client (Client | AsyncClient): Client logged in as bluesky_username
+            bluesky_username (str): Bluesky handle
+        """
+        if client in self.watched:
+            return
+
+        def on_response(response: t.Any) -> None:
+            nsid = response.request.url.path.rsplit("/", 1)[-1]
+            if nsid in ACCOUNT_WRITE_NSIDS:
+                key = self.account_key(bluesky_username)
+            else:
+                key = self.pds_key(client)
+            self.observe(key, response.headers)
+
+        async def on_async_response(response: t.Any) -> None:
+            on_response(response)
+
+        if asyncio.iscoroutinefunction(client.request.close):
+            client.request._client.event_hooks["response"].append(on_async_response)
+        else:
+            client.request._client.event_hooks["response"].append(on_response)
+        self.watched.add(client)
+
+    def apply_writes_limits(
+        self, client: t.Any, bluesky_username: str, creates: int
+    ) -> t.List[t.Tuple[str, int]]:
+        """Buckets and costs for creating several records in one applyWrites call"""
+        return [
+            (self.account_key(bluesky_username), CREATE_RECORD_POINTS * creates),
+            (self.pds_key(client), 1),
+        ]
+
+    def upload_blob_limits(self, client: t.Any) -> t.List[t.Tuple[str, int]]:
+        """Buckets and costs for uploading a blob"""
+        return [(self.pds_key(client), 1)]
+
+    def call(
+        self, limits: t.List[t.Tuple[str, int]], request: t.Callable, *args, **kwargs
+    ) -> t.Any:
+        """Send a request once its rate limits allow it
+
+        Args:
+            limits (list[tuple[str, int]]): Bucket keys and the cost of the request in each
+            request (Callable): Client method sending the request
+
+        Raises:
+            RateLimited: The request cannot be sent within RATE_LIMIT_MAX_WAIT, or the PDS throttled it
+        """
+        time.sleep(self.reserve(limits))
+        try:
+            return request(*args, **kwargs)
+        except RequestException as err:
+            self._raise_if_throttled(err, limits)
+            raise
+
+    async def call_async(
+        self, limits: t.List[t.Tuple[str, int]], request: t.Callable[[], t.Awaitable]
+    ) -> t.Any:
+        """Await a request once its rate limits allow it
+
+        Args:
+            limits (list[tuple[str, int]]): Bucket keys and the cost of the request in each
+            request (Callable[[], Awaitable]): Function creating the request coroutine
+
+        Raises:
+            RateLimited: The request cannot be sent within RATE_LIMIT_MAX_WAIT, or the PDS throttled it
+        """
+        await asyncio.sleep(self.reserve(limits))
+        try:
+            return await request()
+        except RequestException as err:
+            self._raise_if_throttled(err, limits)
+            raise
+
+    def reserve(self, limits: t.List[t.Tuple[str, int]]) -> float:
+        """Take tokens for a request from every bucket it counts against
+
+        Returns:
+            float: Seconds to wait before sending the request
+        """
+        now = time.time()
+        with self.lock:
+            buckets = [(self._get_bucket(key), cost) for key, cost in limits]
+            wait = max(bucket.wait_time(cost, now) for bucket, cost in buckets)
+
+            if wait > RATE_LIMIT_MAX_WAIT.total_seconds():
+                self.stats["throttled"] += 1
+                raise RateLimited(self._to_datetime(now + wait))
+
+            for bucket, cost in buckets:
+                bucket.tokens -= cost
+
+            if wait:
+                self.stats["waits"] += 1
+                self.stats["seconds_waited"] += wait
+
+        return wait
+
+    def observe(self, key: str, headers: t.Mapping[str, str]) -> None:
+        with self.lock:
+            self._get_bucket(key).update(headers, time.time())
+
+    @staticmethod
+    def account_key(bluesky_username: str) -> str:
+        return f"account:{bluesky_username}"
+
+    @staticmethod
+    def pds_key(client: t.Any) -> str:
+        return f"pds:{urlparse(client._base_url).hostname}"
+
+    def _get_bucket(self, key: str) -> TokenBucket:
+        if key not in self.buckets:
+            if key.startswith("account:"):
+                self.buckets[key] = TokenBucket(*RATE_LIMIT_ACCOUNT_WRITES)
+            else:
+                self.buckets[key] = TokenBucket(*RATE_LIMIT_PDS_REQUESTS)
+        return self.buckets[key]
+
+    def _raise_if_throttled(
+        self, err: RequestException, limits: t.List[t.Tuple[str, int]]
+    ) -> None:
+        if not err.response or err.response.status_code != 429:
+            return
+
+        now = time.time()
+        with self.lock:
+            self.stats["throttled"] += 1
+            wait = max(
+                self._get_bucket(key).wait_time(cost, now) for key, cost in limits
+            )
+        # Without headers, back off for at least the longest wait worth waiting
+        wait = max(wait, RATE_LIMIT_MAX_WAIT.total_seconds())
+        raise RateLimited(self._to_datetime(now + wait)) from err
+
+    @staticmethod
+    def _to_datetime(timestamp: float) -> datetime:
+        return datetime.fromtimestamp(timestamp, tz=dt_timezone.utc)
+
+
+rate_limiter = RateLimiter()
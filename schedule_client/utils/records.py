@@ -0,0 +1,110 @@
+"""Post records written in batches with com.atproto.repo.applyWrites.
+
+A thread is a post followed by its replies, each paired with the facets and embed
+built for it. Every record already has its record key, so its URI is known before it
+is written, and its CID is computed locally. Replies can therefore reference the
+posts before them within the same applyWrites call, which creates all of its records
+in one commit or none of them.
+"""
+
+from datetime import timedelta
+import typing as t
+
+from atproto import models
+from atproto.exceptions import BadRequestError
+from atproto_client.models.utils import get_model_as_dict
+from django.utils import timezone
+
+from schedule_client.utils.dag_cbor import record_cid
+from schedule_client.utils.data_models import PostObject
+
+# The PDS rejects applyWrites calls with more writes than this
+MAX_WRITES_PER_CALL = 200
+
+Thread = t.List[t.Tuple[PostObject, t.Optional[list], t.Optional[t.Any]]]
+
+
+def record_uri(did: str, rkey: str) -> str:
+    return f"at://{did}/{models.ids.AppBskyFeedPost}/{rkey}"
+
+
+def is_record_not_found(err: BadRequestError) -> bool:
+    """Whether getRecord failed because no record exists under the record key.
+    Other 400s, e.g. an invalid request or a taken down repo, say nothing about it.
+    """
+    content = err.response.content if err.response else None
+    return getattr(content, "error", None) == "RecordNotFound"
+
+
+def build_thread_writes(
+    did: str, thread: Thread
+) -> t.Tuple[
+    t.List[models.ComAtprotoRepoApplyWrites.Create], t.List[t.Tuple[int, str, str]]
+]:
+    """Build the records of a thread, each reply replying to the post before it
+
+    Args:
+        did (str): DID of the repo the thread is written to
+        thread (Thread): Posts of the thread in order, with their facets and embeds
+
+    Returns:
+        tuple[list[models.ComAtprotoRepoApplyWrites.Create], list[tuple[int, str, str]]]: Writes, and the post ID, CID and URI each of them creates
+    """
+    writes = []
+    results = []
+    root = parent = None
+    # Spaced by a millisecond so replies sort after the posts they reply to
+    created_at = timezone.now()
+
+    for position, (post, facets, embed) in enumerate(thread):
+        record = models.AppBskyFeedPost.Main(
+            created_at=(created_at + timedelta(milliseconds=position)).isoformat(),
+            text=post.rendered_text,
+            facets=facets,
+            embed=None if isinstance(embed, dict) else embed,
+            reply=(
+                models.AppBskyFeedPost.ReplyRef(root=root, parent=parent)
+                if parent
+                else None
+            ),
+        )
+        # The CID is computed from the exact JSON sent to the PDS
+        value = get_model_as_dict(record)
+        if isinstance(embed, dict):
+            # Embeds the installed SDK has no models for are built as JSON
+            value["embed"] = embed
+        ref = models.ComAtprotoRepoStrongRef.Main(
+            uri=record_uri(did, post.rkey), cid=record_cid(value)
+        )
+
+        writes.append(
+            models.ComAtprotoRepoApplyWrites.Create(
+                collection=models.ids.AppBskyFeedPost, rkey=post.rkey, value=value
+            )
+        )
+        results.append((post.id, ref.cid, ref.uri))
+        root = root or ref
+        parent = ref
+
+    return writes, results
+
+
+def batch_threads(threads: t.List[Thread]) -> t.List[t.List[Thread]]:
+    """Group threads into applyWrites calls, in order and without splitting a thread
+
+    Args:
+        threads (list[Thread]): Threads ready to be written
+
+    Returns:
+        list[list[Thread]]: Threads of each call
+    """
+    batches = []
+    batch_size = MAX_WRITES_PER_CALL
+    for thread in threads:
+        if batch_size + len(thread) > MAX_WRITES_PER_CALL:
+            batches.append([])
+            batch_size = 0
+        batches[-1].append(thread)
+        batch_size += len(thread)
+
+    return batches
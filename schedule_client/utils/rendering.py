@@ -0,0 +1,162 @@
+"""Deterministic rendering of a post's final text, facets and embed plan.
+
+Rendering only depends on the post's own fields, so it is done once when the post is
+saved and cached on the row together with a hash of the fields it was rendered from.
+"""
+
+import hashlib
+import json
+import unicodedata
+
+from schedule_client.utils.facets import extract_facets
+
+MAX_POST_GRAPHEMES = 300
+
+ZERO_WIDTH_JOINER = "\u200d"
+REGIONAL_INDICATORS = range(0x1F1E6, 0x1F200)
+EMOJI_MODIFIERS = range(0x1F3FB, 0x1F400)
+
+
+class PostTooLong(Exception):
+    """Raised for a post whose rendered text is longer than MAX_POST_GRAPHEMES"""
+
+
+def source_hash(
+    text: str,
+    links: list[str],
+    link_card_title: str,
+    link_card_description: str,
+    images: list[str],
+    video: str,
+) -> str:
+    """Hash the fields a rendering depends on
+
+    Returns:
+        str: Hex digest that changes whenever the rendering would change
+    """
+    source = [
+        text,
+        links,
+        link_card_title,
+        link_card_description,
+        bool(images),
+        bool(video),
+    ]
+    return hashlib.sha256(json.dumps(source).encode()).hexdigest()
+
+
+def render_post(
+    text: str,
+    links: list[str],
+    link_card_title: str,
+    link_card_description: str,
+    images: list[str],
+    video: str,
+) -> dict:
+    """Render the text, facets and embed plan of a post
+
+    Args:
+        text (str): Post text as written
+        links (list[str]): Non-empty links of the post
+        link_card_title (str): Link card title, empty if unset
+        link_card_description (str): Link card description, empty if unset
+        images (list[str]): Non-empty image paths of the post
+        video (str): Video path of the post, empty if unset
+
+    Returns:
+        dict: Final text, facets as dicts and embed type ("images", "video", "link_card" or None)
+    """
+    # A post has a single embed, so media takes the place of the link card
+    is_link_card = (
+        len(links) == 1
+        and link_card_title != ""
+        and link_card_description != ""
+        and not images
+        and not video
+    )
+
+    # Append links to the text when they are not shown as a link card
+    has_appended_links = bool(links and not is_link_card)
+    if has_appended_links:
+        text += "\n"
+        for link in links:
+            text += f"{link}\n"
+
+    if images:
+        embed = "images"
+    elif video:
+        embed = "video"
+    elif is_link_card:
+        embed = "link_card"
+    else:
+        embed = None
+
+    return {
+        "text": text,
+        "facets": [
+            facet._asdict()
+            for facet in extract_facets(text, aggressive=has_appended_links)
+        ],
+        "embed": embed,
+    }
+
+
+def count_graphemes(text: str) -> int:
+    """Approximate the number of user-perceived characters the way Bluesky limits posts.
+    Combining marks, variation selectors, emoji modifiers and characters joined by a
+    zero width joiner extend the previous character, and regional indicators pair up
+    into flags.
+
+    Args:
+        text (str): Text to measure
+
+    Returns:
+        int: Number of grapheme clusters
+    """
+    count = 0
+    previous = ""
+    pending_flag = False
+
+    for char in text:
+        code_point = ord(char)
+        extends_previous = (
+            previous == ZERO_WIDTH_JOINER
+            or char == ZERO_WIDTH_JOINER
+            or unicodedata.category(char) in ("Mn", "Me")
+            or 0xFE00 <= code_point <= 0xFE0F
+            or code_point in EMOJI_MODIFIERS
+            or (previous == "\r" and char == "\n")
+        )
+
+        if code_point in REGIONAL_INDICATORS:
+            extends_previous = extends_previous or pending_flag
+            pending_flag = not pending_flag
+        else:
+            pending_flag = False
+
+        if not extends_previous or count == 0:
+            count += 1
+        previous = char
+
+    return count
+
+
+def check_length(rendered_text: str) -> None:
+    """Check rendered text against the post length limit of Bluesky
+
+    Args:
+        rendered_text (str): Text of the post record, including appended links
+
+    Raises:
+        PostTooLong: The text has more than MAX_POST_GRAPHEMES graphemes
+    """
+    # A text never has more graphemes than code points
+    if len(rendered_text) <= MAX_POST_GRAPHEMES:
+        return
+
+    graphemes = count_graphemes(rendered_text)
+    if graphemes > MAX_POST_GRAPHEMES:
+        raise PostTooLong(
+            f"Post is {graphemes} characters including appended links, "
+            f"the limit is {MAX_POST_GRAPHEMES}."
+        )
@@ -0,0 +1,80 @@
+from datetime import datetime
+import random
+
+from atproto.exceptions import (
+    BadRequestError,
+    RequestErrorBase,
+    UnauthorizedError,
+)
+from botocore.exceptions import BotoCoreError, ClientError
+from django.utils import timezone
+import httpx
+
+from atproto_scheduler.settings import (
+    RETRY_BASE_DELAY,
+    RETRY_MAX_ATTEMPTS,
+    RETRY_MAX_DELAY,
+)
+
+# HTTP statuses worth retrying, in addition to every 5xx other than 501
+TRANSIENT_STATUSES = (408, 425, 429)
+
+
+def is_transient(err: Exception) -> bool:
+    """Decide whether a failed publish may succeed if it is attempted again
+
+    Args:
+        err (Exception): Error raised while publishing
+
+    Returns:
+        bool: True for network, timeout, throttling and server errors, False otherwise
+    """
+    if isinstance(err, UnauthorizedError):
+        # The session is dropped on failure, the next attempt logs in again
+        return True
+
+    if isinstance(err, BadRequestError):
+        return False
+
+    if isinstance(err, RequestErrorBase):
+        if err.response is None:
+            # Connection failures and timeouts never got a response
+            return True
+        return _is_transient_status(err.response.status_code)
+
+    if isinstance(err, ClientError):
+        return _is_transient_status(
+            err.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 500)
+        )
+
+    # Requests to the video service are sent with httpx directly
+    if isinstance(err, httpx.HTTPStatusError):
+        return _is_transient_status(err.response.status_code)
+
+    return isinstance(
+        err, (BotoCoreError, ConnectionError, TimeoutError, httpx.TransportError)
+    )
+
+
+def next_attempt_at(attempt_count: int, err: Exception) -> datetime | None:
+    """Exponential backoff with jitter for a failed publish
+
+    Args:
+        attempt_count (int): Attempts made so far, including the one that failed
+        err (Exception): Error raised by the last attempt
+
+    Returns:
+        datetime | None: When to attempt again, or None if the post should become a draft
+    """
+    if not is_transient(err) or attempt_count >= RETRY_MAX_ATTEMPTS:
+        return None
+
+    delay = min(RETRY_BASE_DELAY * 2 ** (attempt_count - 1), RETRY_MAX_DELAY)
+    # Spread retries of posts that failed together so they do not return together
+    return timezone.now() + delay * random.uniform(0.5, 1)
+
+
+def _is_transient_status(status_code: int) -> bool:
+    return status_code in TRANSIENT_STATUSES or (
+        status_code >= 500 and status_code != 501
+    )
@@ -1,7 +1,11 @@
-import io
+from contextlib import closing
 import os
 
 import boto3
+from botocore.exceptions import ClientError
+
+from atproto_scheduler.settings import MEDIA_CHUNK_SIZE
+from schedule_client.utils.media_cache import MediaFile, media_cache
 
 
 class ImageClient:
@@ -11,33 +15,130 @@ class ImageClient:
         self.BUCKET_NAME = os.getenv("AWS_BUCKET_NAME")
         self.ACCESS_KEY = os.getenv("AWS_ACCESS_KEY")
         self.SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
+        # Only set for S3-compatible storage other than AWS
+        self.ENDPOINT_URL = os.getenv("AWS_S3_ENDPOINT_URL")
 
         self.client = boto3.client(
             "s3",
             aws_access_key_id=self.ACCESS_KEY,
             aws_secret_access_key=self.SECRET_ACCESS_KEY,
+            endpoint_url=self.ENDPOINT_URL,
+        )
+
+    def get_image_object(
+        self, s3_image_path: str, use_staged: bool = True, raise_errors: bool = False
+    ) -> MediaFile | None:
+        """Retrieve an image from S3 bucket, using the local media cache when the
+        object's ETag is unchanged
+
+        Args:
+            s3_image_path (str): Relative location of S3 path
+            use_staged (bool): Return a prefetched copy without contacting S3
+            raise_errors (bool): Raise errors instead of returning None, so callers can tell a missing object from a timeout
+
+        Returns:
+            MediaFile | None: The image, opened for reading from the media cache
+        """
+        return self._get_media_object(
+            f"images/{s3_image_path}", use_staged, raise_errors
         )
 
-    def get_image_object(self, s3_image_path: str) -> io.BytesIO:
-        """Retrieve image bytes-like object from S3 bucket
+    def get_video_object(
+        self, s3_video_path: str, raise_errors: bool = False
+    ) -> MediaFile | None:
+        """Retrieve a video from S3 bucket, using the local media cache when the
+        object's ETag is unchanged
+
+        Args:
+            s3_video_path (str): Relative location of S3 path
+            raise_errors (bool): Raise errors instead of returning None
+
+        Returns:
+            MediaFile | None: The video, opened for reading from the media cache
+        """
+        return self._get_media_object(f"videos/{s3_video_path}", False, raise_errors)
+
+    def stage_image_object(self, s3_image_path: str) -> bool:
+        """Download an image ahead of its post into the local staging area
 
         Args:
             s3_image_path (str): Relative location of S3 path
 
         Returns:
-            io.BytesIO: Bytes-like object representing image
+            bool: Value indicating whether the image could be retrieved
+        """
+        image_object = self.get_image_object(s3_image_path, use_staged=False)
+
+        if image_object is None:
+            return False
+
+        image_object.file.close()
+        media_cache.stage(f"images/{s3_image_path}")
+        return True
+
+    def _get_media_object(
+        self, full_media_path: str, use_staged: bool, raise_errors: bool
+    ) -> MediaFile | None:
+        """Stream an S3 object into the media cache, so no more than one chunk of it
+        is held in memory
+
+        Args:
+            full_media_path (str): Full S3 key of the media
+            use_staged (bool): Return a prefetched copy without contacting S3
+            raise_errors (bool): Raise errors instead of returning None
+
+        Returns:
+            MediaFile | None: The media, opened for reading from the media cache
         """
-        full_image_path = f"images/{s3_image_path}"
+        if use_staged:
+            media = media_cache.get_staged_media(full_media_path)
+            if media is not None:
+                return media
+
         try:
+            media = self._get_cached_media(full_media_path)
+            if media is not None:
+                return media
+
             s3_response_object = self.client.get_object(
-                Bucket=self.BUCKET_NAME, Key=full_image_path
+                Bucket=self.BUCKET_NAME, Key=full_media_path
             )
-            return s3_response_object["Body"].read()
+            with closing(s3_response_object["Body"]) as body:
+                return media_cache.put_media(
+                    full_media_path,
+                    s3_response_object["ETag"],
+                    body.iter_chunks(MEDIA_CHUNK_SIZE),
+                )
         except Exception as err:
-            print(f"Error retrieving image: {s3_image_path}")
-            print(f"Full image path: {full_image_path}")
+            print(f"Error retrieving media: {full_media_path}")
             print(err)
+            if raise_errors:
+                raise
+            return None
+
+    def _get_cached_media(self, full_media_path: str) -> MediaFile | None:
+        """Return cached media if S3 reports the object as not modified
+
+        Args:
+            full_media_path (str): Full S3 key of the media
+
+        Returns:
+            MediaFile | None: Cached media, or None if the object must be downloaded
+        """
+        cached_etag = media_cache.get_etag(full_media_path)
+        if not cached_etag:
             return None
 
+        try:
+            self.client.head_object(
+                Bucket=self.BUCKET_NAME, Key=full_media_path, IfNoneMatch=cached_etag
+            )
+        except ClientError as err:
+            if err.response["ResponseMetadata"]["HTTPStatusCode"] == 304:
+                return media_cache.get_media(full_media_path, cached_etag)
+            raise
+
+        return None
+
     def close(self) -> None:
         self.client.close()
@@ -0,0 +1,120 @@
+from threading import Lock
+
+from atproto import Client
+from django.utils import timezone
+
+from atproto_scheduler.settings import BLUESKY_PDS_URL, SESSION_REFRESH_MARGIN
+from posts.models import Config
+
+
+class SessionManager:
+    """Process-wide cache of logged in Bluesky clients keyed by username.
+
+    Sessions are exported to Config.session_string so that a restarted process can
+    resume them without calling createSession again.
+    """
+
+    def __init__(self) -> None:
+        self.clients: dict[str, Client] = {}
+        self.session_strings: dict[str, str] = {}
+        self.locks: dict[str, Lock] = {}
+        self.locks_lock = Lock()
+        self.stats = {"hits": 0, "misses": 0, "refreshes": 0, "logins": 0}
+
+    def get_client(self, bluesky_username: str, bluesky_password: str) -> Client:
+        """Return a logged in client, reusing an existing session where possible
+
+        Args:
+            bluesky_username (str): Bluesky handle
+            bluesky_password (str): Bluesky app password, only used if no session can be reused
+
+        Returns:
+            Client: Logged in atproto client
+        """
+        with self._get_lock(bluesky_username):
+            client = self.clients.get(bluesky_username)
+
+            if client:
+                self.stats["hits"] += 1
+                if self._is_expiring(client):
+                    client = self._refresh(client, bluesky_username, bluesky_password)
+            else:
+                self.stats["misses"] += 1
+                client = self._resume(bluesky_username, bluesky_password)
+
+            self.clients[bluesky_username] = client
+            self._store_session_string(bluesky_username, client.export_session_string())
+            return client
+
+    def invalidate(self, bluesky_username: str) -> None:
+        """Drop a cached session, e.g. after the PDS rejects it
+
+        Args:
+            bluesky_username (str): Bluesky handle
+        """
+        with self._get_lock(bluesky_username):
+            self.clients.pop(bluesky_username, None)
+            self.session_strings.pop(bluesky_username, None)
+            Config.objects.filter(bluesky_username=bluesky_username).update(
+                session_string=None
+            )
+
+    def _get_lock(self, bluesky_username: str) -> Lock:
+        with self.locks_lock:
+            return self.locks.setdefault(bluesky_username, Lock())
+
+    def _is_expiring(self, client: Client) -> bool:
+        refresh_at = timezone.now() + SESSION_REFRESH_MARGIN
+        return client._access_jwt_payload.exp < refresh_at.timestamp()
+
+    def _resume(self, bluesky_username: str, bluesky_password: str) -> Client:
+        """Resume a stored session, falling back to a full login"""
+        session_string = (
+            Config.objects.filter(bluesky_username=bluesky_username)
+            .values_list("session_string", flat=True)
+            .first()
+        )
+
+        if session_string:
+            try:
+                client = Client(f"{BLUESKY_PDS_URL}/xrpc")
+                client.login(session_string=session_string)
+                self.session_strings[bluesky_username] = session_string
+                if self._is_expiring(client):
+                    client = self._refresh(client, bluesky_username, bluesky_password)
+                return client
+            except Exception as err:
+                print(f"Stored session for {bluesky_username} rejected: {err}")
+
+        return self._login(bluesky_username, bluesky_password)
+
+    def _refresh(
+        self, client: Client, bluesky_username: str, bluesky_password: str
+    ) -> Client:
+        """Refresh the access and refresh JWTs, falling back to a full login"""
+        try:
+            client._refresh_and_set_session()
+            self.stats["refreshes"] += 1
+            return client
+        except Exception as err:
+            print(f"Session refresh for {bluesky_username} failed: {err}")
+            return self._login(bluesky_username, bluesky_password)
+
+    def _login(self, bluesky_username: str, bluesky_password: str) -> Client:
+        client = Client(f"{BLUESKY_PDS_URL}/xrpc")
+        client.login(bluesky_username, bluesky_password)
+        self.stats["logins"] += 1
+        return client
+
+    def _store_session_string(self, bluesky_username: str, session_string: str) -> None:
+        """Persist the session if it changed, including refreshes made by the client itself"""
+        if self.session_strings.get(bluesky_username) == session_string:
+            return
+
+        Config.objects.filter(bluesky_username=bluesky_username).update(
+            session_string=session_string
+        )
+        self.session_strings[bluesky_username] = session_string
+
+
+session_manager = SessionManager()
@@ -0,0 +1,396 @@
+"""Projection of the schedule under a virtual clock.
+
+The scheduler applies its rules one tick at a time, so the only way to see when posts
+go out is to wait. The simulation applies the same rules to an in-memory snapshot of
+the pending posts, as if a tick ran at the start of the simulation and then every
+SCHEDULER_INTERVAL (or at every next due post): missed posts are caught up with the
+account's policy, unscheduled posts get the first free slots of the account's grid,
+and each post is published by the first tick whose window contains it. Publish times
+are computed from slot and tick numbers instead of stepping the clock, so months of
+schedule for thousands of accounts take seconds.
+
+Requests are counted as the publishing clients send them: one applyWrites call per
+batch of threads due in the same tick, one uploadBlob per image and one getServiceAuth
+per video. Media reused from the blob ref cache is counted again, so the request rate
+is an upper bound.
+"""
+
+from collections import Counter
+from datetime import datetime, timedelta
+import math
+import typing as t
+
+from django.utils import timezone
+
+from atproto_scheduler.settings import (
+    NEXT_DUE_LEAD,
+    RATE_LIMIT_ACCOUNT_WRITES,
+    RATE_LIMIT_PDS_REQUESTS,
+    SCHEDULER_INTERVAL,
+)
+from posts.models import CatchUpPolicy, Post
+from schedule_client.utils.data_models import AccountObject
+from schedule_client.utils.django_client import PostClient
+from schedule_client.utils.rate_limiter import CREATE_RECORD_POINTS
+from schedule_client.utils.records import MAX_WRITES_PER_CALL
+from schedule_client.utils.slots import NoAllowedSlot, SlotGrid, SlotIndex
+
+IMAGE_COLUMNS = ("image_1", "image_2", "image_3", "image_4")
+
+
+class SimulatedPost(t.NamedTuple):
+    id: int | None
+    created_at: datetime
+    scheduled_post_time: datetime | None
+    next_attempt_at: datetime | None
+    # Records written, blobs uploaded and videos uploaded for the post and its replies
+    writes: int = 1
+    blobs: int = 0
+    videos: int = 0
+
+
+class AccountTimeline:
+    """Projected publishing of one account"""
+
+    def __init__(self, bluesky_username: str) -> None:
+        self.bluesky_username = bluesky_username
+        self.pending = 0
+        self.published = 0
+        self.beyond_horizon = 0
+        self.unpublished = 0
+        # First posts published, as (post ID, scheduled time, publish time)
+        self.first_posts: list[tuple[int | None, datetime, datetime]] = []
+        self.last_published_at: datetime | None = None
+
+
+class SimulationResult:
+    """Timelines of all accounts and the requests they send to the PDS"""
+
+    def __init__(self, start: datetime, end: datetime) -> None:
+        self.start = start
+        self.end = end
+        self.timelines: dict[str, AccountTimeline] = {}
+        # Requests in each window of RATE_LIMIT_PDS_REQUESTS, and each clock hour
+        self.pds_requests: Counter = Counter()
+        self.hourly_requests: Counter = Counter()
+        # Write points of each account in each window of RATE_LIMIT_ACCOUNT_WRITES
+        self.account_points: Counter = Counter()
+        self.watched_posts: dict[int, datetime | None] = {}
+
+    def window_start(self, window: int, window_length: timedelta) -> datetime:
+        return self.start + window * window_length
+
+    def hour_start(self, hour: int) -> datetime:
+        """Start of an hour counted in hourly_requests"""
+        return self.start.replace(minute=0, second=0, microsecond=0) + timedelta(
+            hours=hour
+        )
+
+    def peak_pds_requests(self) -> tuple[int, datetime | None]:
+        """Most requests sent within one PDS rate limit window, and when"""
+        return self._peak(self.pds_requests, RATE_LIMIT_PDS_REQUESTS[1])
+
+    def peak_account_points(self) -> tuple[int, datetime | None, str | None]:
+        """Most write points spent by one account within its rate limit window"""
+        if not self.account_points:
+            return 0, None, None
+        (bluesky_username, window), points = self.account_points.most_common(1)[0]
+        return (
+            points,
+            self.window_start(window, RATE_LIMIT_ACCOUNT_WRITES[1]),
+            bluesky_username,
+        )
+
+    def _peak(
+        self, counter: Counter, window_length: timedelta
+    ) -> tuple[int, datetime | None]:
+        if not counter:
+            return 0, None
+        window, count = counter.most_common(1)[0]
+        return count, self.window_start(window, window_length)
+
+
+def load_snapshot(accounts: list[AccountObject]) -> dict[str, list[SimulatedPost]]:
+    """Read the pending posts of accounts from the database
+
+    Args:
+        accounts (list[AccountObject]): Accounts to simulate
+
+    Returns:
+        dict[str, list[SimulatedPost]]: Pending posts of each account
+    """
+    replies: dict[int, list[int]] = {}
+    for parent_id, video, *images in Post.objects.filter(
+        thread_parent__isnull=False, posted_at=None
+    ).values_list("thread_parent_id", "video", *IMAGE_COLUMNS):
+        reply_counts = replies.setdefault(parent_id, [0, 0, 0])
+        reply_counts[0] += 1
+        reply_counts[1] += _count(images)
+        reply_counts[2] += bool(video)
+
+    snapshot: dict[str, list[SimulatedPost]] = {
+        account.bluesky_username: [] for account in accounts
+    }
+    for (
+        post_id,
+        bluesky_username,
+        created_at,
+        scheduled_post_time,
+        next_attempt_at,
+        video,
+        *images,
+    ) in (
+        PostClient()
+        .non_draft_unpublished_posts.filter(bluesky_username__in=snapshot)
+        .values_list(
+            "id",
+            "bluesky_username",
+            "created_at",
+            "scheduled_post_time",
+            "next_attempt_at",
+            "video",
+            *IMAGE_COLUMNS,
+        )
+        .iterator()
+    ):
+        reply_writes, reply_blobs, reply_videos = replies.get(post_id, (0, 0, 0))
+        snapshot[bluesky_username].append(
+            SimulatedPost(
+                post_id,
+                created_at,
+                scheduled_post_time,
+                next_attempt_at,
+                1 + reply_writes,
+                _count(images) + reply_blobs,
+                bool(video) + reply_videos,
+            )
+        )
+
+    return snapshot
+
+
+def synthetic_snapshot(
+    account_count: int, post_count: int, interval: timedelta, images: int = 0
+) -> tuple[list[AccountObject], dict[str, list[SimulatedPost]]]:
+    """Accounts posting at the same interval, each with unscheduled posts
+
+    Args:
+        account_count (int): Number of accounts
+        post_count (int): Unscheduled posts of each account
+        interval (timedelta): Interval of every account
+        images (int): Images of each post
+
+    Returns:
+        tuple[list[AccountObject], dict[str, list[SimulatedPost]]]: Accounts and their posts
+    """
+    # Every post is the same, so the snapshot holds a single one
+    post = SimulatedPost(None, timezone.now(), None, None, blobs=images)
+    interval_minutes = int(interval.total_seconds() // 60)
+    accounts = [
+        AccountObject(
+            bluesky_username=f"synthetic-{i}.invalid",
+            interval_hours=interval_minutes // 60,
+            interval_minutes=interval_minutes % 60,
+            allow_posts=True,
+        )
+        for i in range(account_count)
+    ]
+    return accounts, {
+        account.bluesky_username: [post] * post_count for account in accounts
+    }
+
+
+def simulate(
+    accounts: list[AccountObject],
+    snapshot: dict[str, list[SimulatedPost]],
+    start: datetime,
+    days: int,
+    scheduler_mode: str = "interval",
+    timeline_length: int = 10,
+    watched_post_ids: t.Iterable[int] = (),
+) -> SimulationResult:
+    """Project when pending posts are published, starting with a tick at start
+
+    Args:
+        accounts (list[AccountObject]): Accounts and their configuration
+        snapshot (dict[str, list[SimulatedPost]]): Pending posts of each account
+        start (datetime): Virtual time of the first tick
+        days (int): Length of the simulation
+        scheduler_mode (str): "interval" or "next_due", as SCHEDULER_MODE
+        timeline_length (int): Number of posts listed in each account's timeline
+        watched_post_ids (Iterable[int]): Posts whose publish time is reported
+
+    Returns:
+        SimulationResult: Timelines and request rates
+    """
+    result = SimulationResult(start, start + timedelta(days=days))
+    result.watched_posts = {post_id: None for post_id in watched_post_ids}
+
+    for account in accounts:
+        posts = snapshot.get(account.bluesky_username, [])
+        timeline = AccountTimeline(account.bluesky_username)
+        timeline.pending = len(posts)
+        result.timelines[account.bluesky_username] = timeline
+
+        if not account.allow_posts:
+            timeline.unpublished = len(posts)
+            continue
+
+        published = _project_account(account, posts, start, scheduler_mode)
+        _record_account(result, account, timeline, published, timeline_length)
+
+    return result
+
+
+def _project_account(
+    account: AccountObject,
+    posts: list[SimulatedPost],
+    start: datetime,
+    scheduler_mode: str,
+) -> list[tuple[SimulatedPost, datetime, float]]:
+    """Catch up, schedule and publish the posts of an account
+
+    Returns:
+        list[tuple[SimulatedPost, datetime, float]]: Each post published, with its
+        scheduled time and publish time in seconds after start
+    """
+    tick = SCHEDULER_INTERVAL.total_seconds()
+    missed_before = start - SCHEDULER_INTERVAL
+    grid = SlotGrid(
+        timedelta(hours=account.interval_hours, minutes=account.interval_minutes),
+        account.first_post_time,
+        account.quiet_hours_start,
+        account.quiet_hours_end,
+    )
+
+    # Same rules as PostClient.catch_up_missed_posts
+    scheduled, missed, unscheduled = [], [], []
+    for post in posts:
+        if post.scheduled_post_time is None:
+            unscheduled.append(post)
+        elif post.next_attempt_at or post.scheduled_post_time >= missed_before:
+            scheduled.append((post, post.scheduled_post_time))
+        elif account.catch_up_policy == CatchUpPolicy.SPREAD:
+            missed.append(post)
+        elif (
+            account.catch_up_policy == CatchUpPolicy.PUBLISH_LATE
+            and post.scheduled_post_time >= start - PostClient.lateness(account)
+        ):
+            scheduled.append((post, post.scheduled_post_time))
+        else:
+            unscheduled.append(post)
+
+    if missed:
+        missed.sort(key=lambda post: (post.scheduled_post_time, post.id))
+        spacing = grid.interval * account.catch_up_slots / len(missed)
+        first_time = start + timedelta(minutes=1)
+        scheduled += [(post, first_time + i * spacing) for i, post in enumerate(missed)]
+
+    # Same rules as PostClient.schedule_unscheduled_posts
+    if unscheduled:
+        unscheduled.sort(key=lambda post: (post.created_at, post.id), reverse=True)
+        slot_index = SlotIndex(
+            grid.slot_of(scheduled_time) for _, scheduled_time in scheduled
+        )
+        try:
+            slots = slot_index.allocate(
+                grid,
+                len(unscheduled),
+                grid.first_slot_from(start + timedelta(minutes=1)),
+            )
+        except NoAllowedSlot:
+            slots = []
+        scheduled += [
+            (post, grid.slot_time(slot)) for post, slot in zip(unscheduled, slots)
+        ]
+
+    published = []
+    start_timestamp = start.timestamp()
+    lead = NEXT_DUE_LEAD.total_seconds()
+    for post, scheduled_time in scheduled:
+        if post.next_attempt_at:
+            # Retries are picked up once their next attempt is due
+            due_at = post.next_attempt_at.timestamp() - start_timestamp
+        elif scheduler_mode == "interval":
+            # Posts are picked up by the first tick within SCHEDULER_INTERVAL of them
+            due_at = scheduled_time.timestamp() - start_timestamp - tick
+        else:
+            # The next_due job wakes up NEXT_DUE_LEAD before the post
+            due_at = scheduled_time.timestamp() - start_timestamp - lead
+
+        if scheduler_mode == "interval":
+            published_at = max(0, math.ceil(due_at / tick)) * tick
+        else:
+            published_at = max(0.0, due_at)
+        published.append((post, scheduled_time, published_at))
+
+    return published
+
+
+def _record_account(
+    result: SimulationResult,
+    account: AccountObject,
+    timeline: AccountTimeline,
+    published: list[tuple[SimulatedPost, datetime, float]],
+    timeline_length: int,
+) -> None:
+    """Add the posts published by an account to its timeline and to the request rates"""
+    horizon = (result.end - result.start).total_seconds()
+    pds_window = RATE_LIMIT_PDS_REQUESTS[1].total_seconds()
+    account_window = RATE_LIMIT_ACCOUNT_WRITES[1].total_seconds()
+    # Hours are counted on the clock, not from the start
+    hour_offset = result.start.timestamp() % 3600
+
+    published.sort(key=lambda item: item[2])
+    timeline.unpublished = timeline.pending - len(published)
+
+    tick_writes: dict[float, list[int]] = {}
+    for post, scheduled_time, published_at in published:
+        if post.id in result.watched_posts:
+            result.watched_posts[post.id] = result.start + timedelta(
+                seconds=published_at
+            )
+        if published_at > horizon:
+            timeline.beyond_horizon += 1
+            continue
+
+        timeline.published += 1
+        if len(timeline.first_posts) < timeline_length:
+            timeline.first_posts.append(
+                (
+                    post.id,
+                    scheduled_time,
+                    result.start + timedelta(seconds=published_at),
+                )
+            )
+        tick_writes.setdefault(published_at, []).append(post.writes)
+
+        media_requests = post.blobs + post.videos
+        if media_requests:
+            result.pds_requests[int(published_at // pds_window)] += media_requests
+            result.hourly_requests[
+                int((published_at + hour_offset) // 3600)
+            ] += media_requests
+
+    if tick_writes:
+        timeline.last_published_at = result.start + timedelta(seconds=max(tick_writes))
+
+    for published_at, writes in tick_writes.items():
+        # Threads due in the same tick share applyWrites calls, as in batch_threads
+        calls = 0
+        call_writes = MAX_WRITES_PER_CALL
+        for thread_writes in writes:
+            if call_writes + thread_writes > MAX_WRITES_PER_CALL:
+                calls += 1
+                call_writes = 0
+            call_writes += thread_writes
+
+        result.pds_requests[int(published_at // pds_window)] += calls
+        result.hourly_requests[int((published_at + hour_offset) // 3600)] += calls
+        result.account_points[
+            (account.bluesky_username, int(published_at // account_window))
+        ] += CREATE_RECORD_POINTS * sum(writes)
+
+
+def _count(values: t.Iterable) -> int:
+    return sum(1 for value in values if value)
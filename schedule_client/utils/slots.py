@@ -0,0 +1,147 @@
+"""Posting slots on a per-account grid.
+
+Posts of an account are published at slots spaced by its interval, starting from its
+first post time of day. Slots are numbered from a fixed day, so the grid is the same
+on every tick and a slot freed by a deleted or drafted post is given to the next
+unscheduled post. Slot times are local wall-clock times, so a post at 3AM stays at
+3AM across daylight saving changes. Slots within quiet hours are skipped.
+"""
+
+from bisect import bisect_right
+from datetime import date, datetime, time, timedelta
+from heapq import merge
+from math import gcd
+import typing as t
+
+from django.utils import timezone
+
+GRID_EPOCH = date(2024, 1, 1)
+MIN_INTERVAL = timedelta(minutes=1)
+DAY_SECONDS = 24 * 60 * 60
+
+
+class NoAllowedSlot(Exception):
+    """Every slot of a grid falls within its quiet hours"""
+
+
+class SlotGrid:
+    """Slot times of one account"""
+
+    def __init__(
+        self,
+        interval: timedelta,
+        first_post_time: time | None = None,
+        quiet_hours_start: time | None = None,
+        quiet_hours_end: time | None = None,
+    ) -> None:
+        # Posts closer together than this would be published in the same tick anyway
+        self.interval = max(interval, MIN_INTERVAL)
+        self.origin = datetime.combine(GRID_EPOCH, first_post_time or time())
+        # Looked up once, since grids convert many slots at a time
+        self.timezone = timezone.get_current_timezone()
+        self.quiet_hours = None
+        if quiet_hours_start and quiet_hours_end:
+            self.quiet_hours = (quiet_hours_start, quiet_hours_end)
+
+    def slot_time(self, slot: int) -> datetime:
+        return timezone.make_aware(self.origin + slot * self.interval, self.timezone)
+
+    def slot_of(self, when: datetime) -> int:
+        """Slot whose interval contains a time"""
+        return (timezone.make_naive(when, self.timezone) - self.origin) // self.interval
+
+    def first_slot_from(self, when: datetime) -> int:
+        """First slot at or after a time"""
+        return self._first_slot_from_wall(timezone.make_naive(when, self.timezone))
+
+    def next_allowed(self, slot: int) -> int:
+        """First slot from slot that is outside quiet hours
+
+        Raises:
+            NoAllowedSlot: No slot of the grid is outside quiet hours
+        """
+        if self.quiet_hours is None:
+            return slot
+
+        start, end = self.quiet_hours
+        # Slots fall on the same times of day again after this many slots
+        interval_seconds = int(self.interval.total_seconds())
+        for _ in range(DAY_SECONDS // gcd(interval_seconds, DAY_SECONDS) + 1):
+            wall_time = self.origin + slot * self.interval
+            time_of_day = wall_time.time()
+            if start <= end:
+                is_quiet = start <= time_of_day < end
+            else:
+                is_quiet = time_of_day >= start or time_of_day < end
+            if not is_quiet:
+                return slot
+
+            quiet_until = datetime.combine(wall_time.date(), end)
+            if quiet_until <= wall_time:
+                quiet_until += timedelta(days=1)
+            slot = self._first_slot_from_wall(quiet_until)
+
+        raise NoAllowedSlot(
+            f"Every slot {self.interval} apart from {self.origin.time()} "
+            f"falls between {start} and {end}"
+        )
+
+    def _first_slot_from_wall(self, wall_time: datetime) -> int:
+        return -((self.origin - wall_time) // self.interval)
+
+
+class SlotIndex:
+    """Occupied slots of one account, as sorted runs of consecutive slots.
+    Finding the first free slot from any slot is a binary search over the runs.
+    """
+
+    def __init__(self, slots: t.Iterable[int] = ()) -> None:
+        self.starts: list[int] = []
+        self.ends: list[int] = []
+        self._add(sorted(set(slots)))
+
+    def first_free(self, slot: int) -> int:
+        """First slot from slot that is not occupied"""
+        i = bisect_right(self.starts, slot) - 1
+        if i >= 0 and self.ends[i] > slot:
+            # Runs are never adjacent, so the end of a run is free
+            return self.ends[i]
+        return slot
+
+    def allocate(self, grid: SlotGrid, count: int, first_slot: int) -> list[int]:
+        """Occupy the first free slots outside quiet hours, in a single pass
+
+        Args:
+            grid (SlotGrid): Grid of the account
+            count (int): Number of slots
+            first_slot (int): Earliest slot to occupy
+
+        Returns:
+            list[int]: Slots occupied, in increasing order
+        """
+        slots = []
+        slot = first_slot
+        while len(slots) < count:
+            slot = self.first_free(slot)
+            allowed_slot = grid.next_allowed(slot)
+            if allowed_slot != slot:
+                slot = allowed_slot
+                continue
+            slots.append(slot)
+            slot += 1
+
+        self._add(slots)
+        return slots
+
+    def _add(self, slots: list[int]) -> None:
+        """Merge sorted, unoccupied slots into the runs"""
+        runs = merge(
+            list(zip(self.starts, self.ends)), ((slot, slot + 1) for slot in slots)
+        )
+        self.starts, self.ends = [], []
+        for start, end in runs:
+            if self.ends and start <= self.ends[-1]:
+                self.ends[-1] = max(self.ends[-1], end)
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
@@ -0,0 +1,47 @@
+"""Timestamp identifiers (TIDs), the record keys Bluesky uses for posts.
+
+A TID is a 64-bit integer holding microseconds since the UNIX epoch and a 10-bit
+clock identifier, written as 13 characters of sortable base32.
+"""
+
+import random
+from threading import Lock
+import time
+import typing as t
+
+S32_ALPHABET = "234567abcdefghijklmnopqrstuvwxyz"
+TID_LENGTH = 13
+
+# Random per process so that processes generating TIDs in the same microsecond differ
+CLOCK_ID = random.getrandbits(10)
+
+_lock = Lock()
+_last_timestamp = 0
+
+
+def generate_tids(count: int) -> t.List[str]:
+    """Generate unique, increasing TIDs
+
+    Args:
+        count (int): Number of TIDs
+
+    Returns:
+        list[str]: TIDs in increasing order
+    """
+    global _last_timestamp
+
+    with _lock:
+        # Never reuse a timestamp, even if the clock goes backwards
+        timestamp = max(time.time_ns() // 1000, _last_timestamp + 1)
+        _last_timestamp = timestamp + count - 1
+
+    return [encode_tid(timestamp + i, CLOCK_ID) for i in range(count)]
+
+
+def encode_tid(timestamp: int, clock_id: int) -> str:
+    value = (timestamp << 10) | clock_id
+    chars = []
+    for _ in range(TID_LENGTH):
+        chars.append(S32_ALPHABET[value & 31])
+        value >>= 5
+    return "".join(reversed(chars))
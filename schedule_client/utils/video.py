@@ -0,0 +1,101 @@
+"""Video uploads through Bluesky's video service.
+
+Videos are not uploaded to the PDS directly. The PDS issues a service auth token that
+lets the video service write to the account's repo. The video service accepts the
+upload, processes it in a job, and stores the resulting blob with the PDS. The post
+then embeds that blob. The video lexicons are newer than the installed SDK, so
+requests and the embed are built as plain JSON.
+"""
+
+from datetime import timedelta
+import mimetypes
+import time
+from urllib.parse import urlparse
+
+import httpx
+from atproto_client.models.blob_ref import BlobRef
+from atproto_identity.did.resolver import DidResolver
+
+GET_SERVICE_AUTH_NSID = "com.atproto.server.getServiceAuth"
+UPLOAD_VIDEO_NSID = "app.bsky.video.uploadVideo"
+GET_JOB_STATUS_NSID = "app.bsky.video.getJobStatus"
+SERVICE_AUTH_LIFETIME = timedelta(minutes=30)
+
+_pds_service_dids: dict[str, str] = {}
+
+
+class VideoProcessingFailed(Exception):
+    """The video service could not process a video"""
+
+
+def pds_service_did(did: str) -> str:
+    """Service DID of the PDS hosting an account, the audience of its service auth tokens
+
+    Args:
+        did (str): DID of the account
+
+    Returns:
+        str: did:web of the PDS
+    """
+    if did not in _pds_service_dids:
+        pds_endpoint = DidResolver().resolve(did).get_pds_endpoint()
+        _pds_service_dids[did] = f"did:web:{urlparse(pds_endpoint).hostname}"
+    return _pds_service_dids[did]
+
+
+def service_auth_params(did: str) -> dict:
+    """Parameters of getServiceAuth for a token the video service can upload blobs with"""
+    return {
+        "aud": pds_service_did(did),
+        "lxm": "com.atproto.repo.uploadBlob",
+        "exp": int(time.time() + SERVICE_AUTH_LIFETIME.total_seconds()),
+    }
+
+
+def upload_video_headers(token: str, video_path: str, size: int) -> dict:
+    """Headers of an uploadVideo request, the body is streamed from the media cache"""
+    return {
+        "Authorization": f"Bearer {token}",
+        "Content-Type": mimetypes.guess_type(video_path)[0] or "video/mp4",
+        "Content-Length": str(size),
+    }
+
+
+def job_status(response: httpx.Response) -> dict:
+    """Read the job status from an uploadVideo or getJobStatus response
+
+    Raises:
+        httpx.HTTPStatusError: The video service rejected the request
+    """
+    # A video the service already has is answered with 409 and its existing job
+    if response.status_code != 409:
+        response.raise_for_status()
+    body = response.json()
+    return body.get("jobStatus", body)
+
+
+def completed_blob(job: dict) -> BlobRef | None:
+    """Blob of a processed video
+
+    Returns:
+        BlobRef | None: The blob, or None while the job is still running
+
+    Raises:
+        VideoProcessingFailed: The job failed
+    """
+    if job.get("state") == "JOB_STATE_FAILED":
+        raise VideoProcessingFailed(
+            job.get("error") or job.get("message") or "Video processing failed"
+        )
+    if job.get("blob"):
+        return BlobRef.model_validate(job["blob"])
+    return None
+
+
+def video_embed(blob: BlobRef, alt_text: str) -> dict:
+    """app.bsky.embed.video embed of a post record, as JSON"""
+    return {
+        "$type": "app.bsky.embed.video",
+        "video": blob.model_dump(by_alias=True, exclude_none=True),
+        "alt": alt_text,
+    }